@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.MetricsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -61,7 +63,9 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    'allauth.account.middleware.AccountMiddleware'
+    'allauth.account.middleware.AccountMiddleware',
+    'store.middleware.QueryStatsMiddleware',
+    'store.middleware.RequestProfileMiddleware',
 ]
 
 ROOT_URLCONF = "core.urls"
@@ -77,6 +81,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "store.context_processors.categories",
             ],
         },
     },
@@ -92,11 +97,73 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # A file rather than the in-memory default, so threads in the tests
+        # wait for each other's writes as workers do in production instead
+        # of failing with "database table is locked".
+        "TEST": {"NAME": os.path.join(tempfile.gettempdir(), "aishikkha_test.sqlite3")},
     }
 }
 
 from decouple import config
 
+# Cache shared by all worker processes on the host (version keys, counters,
+# payment results). Point CACHE_BACKEND/CACHE_LOCATION at Redis or memcached
+# when running on several hosts.
+#
+# Django's default cap of 300 entries would cull the product card and review
+# page caches all the time. Past CACHE_MAX_ENTRIES, 1/CACHE_CULL_FREQUENCY of
+# the entries are dropped. Every write to the file cache lists the whole
+# directory (about 10 ms at 10k entries), so for a catalog that needs much
+# more, move to Redis or memcached rather than raising the cap.
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": config("CACHE_LOCATION", default=os.path.join(tempfile.gettempdir(), "aishikkha_cache")),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("CACHE_MAX_ENTRIES", default=10000, cast=int),
+            "CULL_FREQUENCY": config("CACHE_CULL_FREQUENCY", default=10, cast=int),
+        },
+    }
+}
+
+# The tests clear the cache; they get a private in-memory one instead of the
+# shared directory above.
+TEST_RUNNER = "core.test_runner.TestRunner"
+
+# Per-route query counts and DB time (store.query_stats), served on /metrics
+# and the staff profiles page; statements slower than SLOW_QUERY_MS are
+# logged to "store.slow_queries".
+QUERY_STATS = config("QUERY_STATS", default=False, cast=bool)
+SLOW_QUERY_MS = config("SLOW_QUERY_MS", default=100, cast=float)
+
+# Staff can profile a single request with ?_profile=1 or an "X-Profile: 1"
+# header; profiles are listed at /admin/profiles/.
+PROFILE_DIR = config("PROFILE_DIR", default=os.path.join(tempfile.gettempdir(), "aishikkha_profiles"))
+PROFILE_KEEP = config("PROFILE_KEEP", default=50, cast=int)
+
+# eBook downloads (store.downloads): 0 writes each one straight away; otherwise
+# each process batches them and writes every DOWNLOAD_FLUSH_INTERVAL seconds.
+DOWNLOAD_FLUSH_INTERVAL = config("DOWNLOAD_FLUSH_INTERVAL", default=0, cast=float)
+DOWNLOAD_BUFFER_SIZE = config("DOWNLOAD_BUFFER_SIZE", default=500, cast=int)
+
+# Prometheus metrics (store.metrics) served to staff at /metrics. Worker
+# processes share them through files here; empty it before the server starts.
+METRICS_DIR = config("PROMETHEUS_MULTIPROC_DIR", default=os.path.join(tempfile.gettempdir(), "aishikkha_metrics"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "store.slow_queries": {"handlers": ["console"], "level": "WARNING", "propagate": False},
+    },
+}
+
+# Route the bKash payment API to the async views; enable when serving core.asgi.
+ASYNC_PAYMENT_VIEWS = config("ASYNC_PAYMENT_VIEWS", default=False, cast=bool)
+
 BKASH_CONFIG = {
     'SANDBOX_BASE_URL': config("SANDBOX_BASE_URL"),
     'PRODUCTION_BASE_URL': config("PRODUCTION_BASE_URL"),
@@ -105,6 +172,8 @@ BKASH_CONFIG = {
     'USERNAME': config("USERNAME"),
     'PASSWORD': config("PASSWORD"),
     'IS_SANDBOX': config("IS_SANDBOX"),  # Set to False for production
+    # Overrides PRODUCTION_BASE_URL, e.g. with a fake gateway from run_fake_bkash
+    'BASE_URL': config("BKASH_BASE_URL", default=""),
 }
 
 # Password validation
@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "aishikkha-tests",
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+    """Run the tests against a private cache and metrics directory
+
+    So ``cache.clear()`` cannot wipe a real cache, and the tests neither
+    write into nor read the metrics of a server running on this machine.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.mkdtemp(prefix="aishikkha-test-metrics-")
+        self.previous_metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        # Read by prometheus_client when store.metrics is first imported
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.metrics_dir
+        self.settings_override = override_settings(
+            CACHES=TEST_CACHES, METRICS_DIR=self.metrics_dir
+        )
+        self.settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.settings_override.disable()
+        if self.previous_metrics_dir is None:
+            os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        else:
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.previous_metrics_dir
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
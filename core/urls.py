@@ -3,9 +3,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.i18n import JavaScriptCatalog
+from store.staff_views import metrics_view, profile_download, profile_list
 
 urlpatterns = [
+    path('admin/profiles/', profile_list, name='admin_profiles'),
+    path('admin/profiles/<str:name>/<str:kind>/', profile_download, name='admin_profile_download'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/', include('allauth.urls')),
     path('', include('store.urls')),
     path('jsi18n/', JavaScriptCatalog.as_view(), name='javascript-catalog'),
@@ -1,6 +1,11 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from .models import Product, Category, Order, Review
+from .pagination import EstimatedCountPaginator
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils import timezone
@@ -28,16 +33,60 @@ class OrderAdmin(admin.ModelAdmin):
         return False  # Prevent manual order creation
 
 
+class ProductAutocompleteFilter(admin.SimpleListFilter):
+    """Product filter backed by the admin autocomplete endpoint
+
+    Renders a search-as-you-type select instead of one link per product, so
+    only the currently selected product is ever loaded.
+    """
+    title = _('product')
+    parameter_name = 'product__id__exact'
+    template = 'admin/store/product_autocomplete_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        self.field = model._meta.get_field('product')
+        self.admin_site = model_admin.admin_site
+        super().__init__(request, params, model, model_admin)
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return []
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                return queryset.filter(product_id=self.value())
+            except (ValueError, ValidationError) as e:
+                raise IncorrectLookupParameters(e)
+        return queryset
+
+    @property
+    def widget(self):
+        return AutocompleteSelect(self.field, self.admin_site, attrs={'style': 'width: 100%'})
+
+    def widget_html(self):
+        field = forms.ModelChoiceField(
+            queryset=Product.objects.all(), widget=self.widget, required=False
+        )
+        return field.widget.render(self.parameter_name, self.value(), attrs={'id': 'product-filter'})
+
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = [
         'title', 'product_name', 'rating_display', 
         'status_display', 'created_at', 'action_buttons'
     ]
-    list_filter = ['status', 'rating', 'created_at', 'product']
-    search_fields = ['product__name', 'name', 'title', 'comment']
+    list_filter = ['status', 'rating', 'created_at', ProductAutocompleteFilter]
+    list_select_related = ['product']
+    search_fields = ['product__title', 'name', 'title', 'comment']
+    autocomplete_fields = ['product']
     readonly_fields = ['created_at', 'updated_at', 'approved_at', 'approved_by']
     list_per_page = 25
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Review Information', {
@@ -102,8 +151,8 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def approve_reviews(self, request, queryset):
         """Bulk approve reviews"""
-        updated = queryset.filter(status='pending').update(
-            status='approved',
+        updated = queryset.filter(status='pending').set_status(
+            'approved',
             approved_at=timezone.now(),
             approved_by=request.user
         )
@@ -112,8 +161,8 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def reject_reviews(self, request, queryset):
         """Bulk reject reviews"""
-        updated = queryset.filter(status__in=['pending', 'approved']).update(
-            status='rejected',
+        updated = queryset.filter(status__in=['pending', 'approved']).set_status(
+            'rejected',
             approved_at=None,
             approved_by=None
         )
@@ -122,8 +171,8 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def mark_as_pending(self, request, queryset):
         """Mark reviews as pending"""
-        updated = queryset.exclude(status='pending').update(
-            status='pending',
+        updated = queryset.exclude(status='pending').set_status(
+            'pending',
             approved_at=None,
             approved_by=None
         )
@@ -142,5 +191,12 @@ class ReviewAdmin(admin.ModelAdmin):
         
         super().save_model(request, obj, form, change)
 
-    class Media:
-        js = ('admin/js/review_admin.js',)  # Custom JS for AJAX actions
\ No newline at end of file
+    @property
+    def media(self):
+        # Defining ``media`` replaces the inner ``class Media``, so the custom
+        # JS is listed here alongside the product filter's autocomplete assets
+        return (
+            super().media
+            + AutocompleteSelect(Review._meta.get_field('product'), self.admin_site).media
+            + forms.Media(js=['admin/js/review_admin.js'])  # Custom JS for AJAX actions
+        )
@@ -1,6 +1,16 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class StoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "store"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Before anything imports store.metrics, and so prometheus_client
+        metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', settings.METRICS_DIR)
+        os.makedirs(metrics_dir, exist_ok=True)
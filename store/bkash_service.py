@@ -1,53 +1,598 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+
+import httpx
 import requests
-import json
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F, Q, Sum
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .models import BkashToken, CircuitBreakerBucket, CircuitBreakerState
+
+logger = logging.getLogger(__name__)
+
+# Idempotent endpoints: safe to resend after a timeout or a 5xx.
+IDEMPOTENT_PATHS = (
+    '/tokenized/checkout/token/grant',
+    '/tokenized/checkout/token/refresh',
+    '/tokenized/checkout/payment/status',
+)
+
+# Responses that mean bKash itself is struggling
+GATEWAY_ERROR_STATUSES = (429, 500, 502, 503, 504)
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+POOL_SIZE = 10
+
+
+def gateway_ok(response):
+    """Whether bKash answered a call without a connection or server-side failure"""
+    return response is not None and response.status_code not in GATEWAY_ERROR_STATUSES
+
+
+def build_session(base_url, pool_size=POOL_SIZE, retries=2, backoff_factor=0.5):
+    """Keep-alive session for the gateway
+
+    Every call may be retried when the connection could not be opened, since
+    nothing reached bKash then. Only the token calls and the status query
+    are also retried after read timeouts and 429/5xx responses: repeating a
+    create or execute could start or capture a payment twice.
+    """
+    session = requests.Session()
+    session.headers.update({'Content-Type': 'application/json', 'Accept': 'application/json'})
+    connect_only = Retry(
+        total=retries, connect=retries, read=0, status=0, other=0,
+        allowed_methods=None, backoff_factor=backoff_factor, raise_on_status=False,
+    )
+    idempotent = Retry(
+        total=retries, connect=retries, read=retries, status=retries, other=0,
+        allowed_methods=None, backoff_factor=backoff_factor,
+        status_forcelist=GATEWAY_ERROR_STATUSES, raise_on_status=False,
+    )
+    session.mount(
+        base_url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=connect_only)
+    )
+    for path in IDEMPOTENT_PATHS:
+        # requests picks the adapter with the longest matching prefix
+        session.mount(
+            f'{base_url}{path}',
+            HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=idempotent),
+        )
+    return session
+
+
+class MemoryTokenStore:
+    """``BkashToken`` stand-in that keeps the token in this process
+
+    For load tests against a fake gateway, whose tokens must never reach the
+    row the live workers read.
+    """
 
-class BkashService:
     def __init__(self):
+        self.state = None
+        self.lease = ('', 0)
+        self.lock = threading.Lock()
+
+    def load(self):
+        return dict(self.state) if self.state else None
+
+    def claim(self, owner, now, seconds):
+        with self.lock:
+            if self.lease[1] > now:
+                return False
+            self.lease = (owner, now + seconds)
+            return True
+
+    def release(self, owner):
+        with self.lock:
+            if self.lease[0] == owner:
+                self.lease = ('', 0)
+
+    def store(self, state):
+        self.state = dict(state)
+
+
+class TokenManager:
+    """Grant-token lifecycle shared by all workers through the database
+
+    The token, its refresh token and expiry live in the ``BkashToken`` row
+    (or in ``store``, which has the same ``load``/``claim``/``release``/
+    ``store`` methods).
+    Only one grant or refresh runs at a time: a lock guards it within the
+    process, and the row's lease guards it across processes; losers wait
+    for the winner's token instead of calling bKash. Within
+    ``REFRESH_AHEAD`` seconds of expiry the token is still handed out while
+    a background thread renews it, using the refresh-token flow when a
+    refresh token is available and a full grant otherwise.
+    """
+    REFRESH_AHEAD = 300
+    LOCK_TIMEOUT = 30
+    LOCK_WAIT = 5
+
+    def __init__(self, service, clock=time.time, store=BkashToken):
+        self.service = service
+        self.clock = clock
+        self.store = store
+        self._state = None
+        self._lock = threading.Lock()
+        self._background = None
+
+    def is_fresh(self, state):
+        return bool(state) and self.clock() < state['expires_at'] - self.REFRESH_AHEAD
+
+    def is_valid(self, state):
+        return bool(state) and self.clock() < state['expires_at']
+
+    def get_token(self):
+        state = self._state
+        if not self.is_fresh(state):
+            state = self.store.load() or state
+            self._state = state
+        if self.is_fresh(state):
+            return state['id_token']
+        if self.is_valid(state):
+            self.refresh_in_background()
+            return state['id_token']
+        state = self.refresh(blocking=True)
+        return state['id_token'] if state else None
+
+    def refresh_in_background(self):
+        if self._background is not None and self._background.is_alive():
+            return
+        self._background = threading.Thread(
+            target=self.refresh_in_thread, name='bkash-token-refresh', daemon=True
+        )
+        self._background.start()
+
+    def refresh_in_thread(self):
+        try:
+            self.refresh(blocking=False)
+        finally:
+            connection.close()  # the thread's own connection
+
+    def refresh(self, blocking=True):
+        """Renew the token unless someone else already did; returns the new state
+
+        With ``blocking=False`` give up (returning None) instead of waiting
+        for a refresh that is already in progress.
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return None
+        try:
+            state = self.store.load() or self._state
+            if self.is_fresh(state):
+                self._state = state
+                return state
+
+            owner = uuid.uuid4().hex
+            locked = self.store.claim(owner, self.clock(), self.LOCK_TIMEOUT)
+            if not locked:
+                if not blocking:
+                    return None
+                waited = self.wait_for_refresh()
+                if waited:
+                    return waited
+                # The other process is stuck or gone; renew anyway.
+            try:
+                new_state = self.fetch(state)
+                if new_state:
+                    self.store.store(new_state)
+                    self._state = new_state
+                return new_state
+            finally:
+                if locked:
+                    self.store.release(owner)
+        finally:
+            self._lock.release()
+
+    def wait_for_refresh(self):
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            state = self.store.load()
+            if self.is_fresh(state):
+                self._state = state
+                return state
+        return None
+
+    def fetch(self, previous):
+        token_data = None
+        if previous and previous.get('refresh_token'):
+            token_data = self.service.refresh_token(previous['refresh_token'])
+        if token_data is None:
+            token_data = self.service.grant_token()
+        if token_data is None:
+            logger.error('Could not obtain a bKash token')
+            return None
+        return {
+            'id_token': token_data['id_token'],
+            'refresh_token': token_data.get('refresh_token')
+            or (previous or {}).get('refresh_token'),
+            'expires_at': self.clock() + int(token_data.get('expires_in', 3600)),
+        }
+
+
+class GatewayUnavailable(Exception):
+    """The circuit breaker is open, so the call was not sent to bKash"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'bKash is unavailable; retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+class DatabaseBreakerStore:
+    """Circuit breaker state and counts in the database, shared by all workers
+
+    Every write is a single UPDATE statement, atomic on every backend.
+    """
+
+    def load(self):
+        return (
+            CircuitBreakerState.objects.filter(pk=CircuitBreakerState.SINGLETON)
+            .values('state', 'generation', 'since', 'probe_until')
+            .first()
+        )
+
+    def claim_probe(self, generation, now, until):
+        return bool(
+            CircuitBreakerState.objects.filter(
+                pk=CircuitBreakerState.SINGLETON, generation=generation, probe_until__lte=now,
+            ).update(probe_until=until)
+        )
+
+    def transition(self, generation, fields):
+        """Move on from ``generation``; False if another worker already did"""
+        moved = CircuitBreakerState.objects.filter(
+            pk=CircuitBreakerState.SINGLETON, generation=generation,
+        ).update(**fields)
+        if moved:
+            return True
+        try:
+            with transaction.atomic():
+                CircuitBreakerState.objects.create(pk=CircuitBreakerState.SINGLETON, **fields)
+        except IntegrityError:
+            return False
+        return True
+
+    def add(self, number, generation, bucket, calls, failures):
+        slot = CircuitBreakerBucket.objects.filter(slot=number)
+        current = slot.filter(generation=generation, bucket=bucket)
+        if current.update(calls=F('calls') + calls, failures=F('failures') + failures):
+            return
+        # The slot still holds a bucket of an earlier window or generation
+        fresh = {'generation': generation, 'bucket': bucket, 'calls': calls, 'failures': failures}
+        stale = Q(generation__lt=generation) | Q(generation=generation, bucket__lt=bucket)
+        if slot.filter(stale).update(**fresh):
+            return
+        try:
+            with transaction.atomic():
+                CircuitBreakerBucket.objects.create(slot=number, **fresh)
+        except IntegrityError:  # another worker started the bucket meanwhile
+            current.update(calls=F('calls') + calls, failures=F('failures') + failures)
+
+    def window(self, generation, first, last):
+        totals = CircuitBreakerBucket.objects.filter(
+            generation=generation, bucket__gte=first, bucket__lte=last,
+        ).aggregate(calls=Sum('calls'), failures=Sum('failures'))
+        return totals['calls'] or 0, totals['failures'] or 0
+
+
+class MemoryBreakerStore:
+    """``DatabaseBreakerStore`` stand-in that keeps the breaker in this process
+
+    For load tests, whose failures must not open the circuit for real customers.
+    """
+
+    def __init__(self):
+        self.state = None
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        return dict(self.state) if self.state else None
+
+    def claim_probe(self, generation, now, until):
+        with self.lock:
+            state = self.state
+            if not state or state['generation'] != generation or state['probe_until'] > now:
+                return False
+            state['probe_until'] = until
+            return True
+
+    def transition(self, generation, fields):
+        with self.lock:
+            if (self.state['generation'] if self.state else 0) != generation:
+                return False
+            self.state = dict(fields)
+            return True
+
+    def add(self, number, generation, bucket, calls, failures):
+        with self.lock:
+            held = self.buckets.get(number)
+            if held and held[:2] == (generation, bucket):
+                calls, failures = calls + held[2], failures + held[3]
+            elif held and held[:2] > (generation, bucket):
+                return  # a late count for a bucket that has already left the ring
+            self.buckets[number] = (generation, bucket, calls, failures)
+
+    def window(self, generation, first, last):
+        with self.lock:
+            held = [
+                (calls, failures) for held_generation, bucket, calls, failures
+                in self.buckets.values()
+                if held_generation == generation and first <= bucket <= last
+            ]
+        return sum(c for c, _ in held), sum(f for _, f in held)
+
+
+class CircuitBreaker:
+    """Stop sending new payments to bKash while it is failing
+
+    Each new payment (the gated call) is counted in ``BUCKET``-second
+    buckets in ``store``, by default the database, so all workers judge the
+    same recent history; token and status calls are not counted. A call
+    fails when it cannot connect, gets a 429 or 5xx, or takes ``SLOW_CALL``
+    seconds or more. Once ``FAILURE_RATE`` of at least ``MIN_CALLS`` calls
+    in the last ``WINDOW`` seconds failed, the circuit opens and new
+    payments raise ``GatewayUnavailable`` at once instead of waiting on the
+    network. After ``OPEN_SECONDS`` the circuit is half-open: one worker
+    claims the probe slot to send a probe, whose success closes the circuit
+    and whose failure opens it again. Each transition starts a new
+    generation of counters, so a closed circuit starts from a clean window.
+
+    To keep the store off the payment path, each worker adds up its calls
+    and writes them every ``FLUSH_SECONDS``, or at once when they could trip
+    the circuit; it then reads the whole window back before deciding. The
+    state is re-read at most every ``STATE_SECONDS``. If the store cannot
+    be reached the breaker stays out of the way: calls are let through and
+    not counted.
+    """
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    WINDOW = 60
+    BUCKET = 10
+    MIN_CALLS = 20
+    FAILURE_RATE = 0.5
+    SLOW_CALL = 5
+    OPEN_SECONDS = 30
+    PROBE_TIMEOUT = 60
+    FLUSH_SECONDS = 5
+    STATE_SECONDS = 2
+
+    def __init__(self, clock=time.time, store=None):
+        self.clock = clock
+        self.store = store or DatabaseBreakerStore()
+        self._lock = threading.Lock()
+        self._cached = None
+        self._cached_at = -math.inf
+        self._pending = {}  # (generation, bucket) -> [calls, failures]
+        self._flushed_at = clock()
+        self._seen = (0, 0)  # the window as last read back
+
+    def _state(self, fresh=False):
+        now = self.clock()
+        if not fresh and self._cached and now - self._cached_at < self.STATE_SECONDS:
+            return self._cached
+        try:
+            state = self.store.load()
+        except DatabaseError:
+            logger.exception('Could not read the bKash circuit state')
+            return self._cached or self._closed()
+        self._remember(state or self._closed(), now)
+        return self._cached
+
+    def _closed(self):
+        return {'state': self.CLOSED, 'generation': 0, 'since': 0, 'probe_until': 0}
+
+    def _remember(self, state, now=None):
+        self._cached = state
+        self._cached_at = self.clock() if now is None else now
+
+    def _probe_due(self, state):
+        return self.clock() >= state['since'] + self.OPEN_SECONDS
+
+    def state(self):
+        state = self._state()
+        if state['state'] == self.OPEN and self._probe_due(state):
+            return self.HALF_OPEN
+        return state['state']
+
+    def is_open(self):
+        """Whether a gated call would be refused now; unlike ``before_call`` takes no probe slot"""
+        state = self._state()
+        if state['state'] == self.CLOSED:
+            return False
+        return not self._probe_due(state) or state['probe_until'] > self.clock()
+
+    def retry_after(self, state=None):
+        """Seconds until the circuit may let calls through again"""
+        state = state or self._state()
+        if state['state'] == self.CLOSED:
+            return 0
+        return max(1, math.ceil(state['since'] + self.OPEN_SECONDS - self.clock()))
+
+    def before_call(self):
+        """Admit a gated call; True if it is the half-open probe
+
+        Raises ``GatewayUnavailable`` while the circuit is open.
+        """
+        state = self._state()
+        if state['state'] == self.CLOSED:
+            return False
+        if self._probe_due(state):
+            if self._claim_probe(state):
+                logger.info('bKash circuit half-open: sending a probe')
+                return True
+            state = self._state(fresh=True)  # another worker may have moved on
+            if state['state'] == self.CLOSED:
+                return False
+        metrics.BREAKER_REJECTIONS.inc()
+        raise GatewayUnavailable(self.retry_after(state))
+
+    def _claim_probe(self, state):
+        now = self.clock()
+        try:
+            claimed = self.store.claim_probe(state['generation'], now, now + self.PROBE_TIMEOUT)
+        except DatabaseError:
+            logger.exception('Could not claim the bKash circuit probe')
+            return False
+        if claimed:
+            self._remember({**state, 'probe_until': now + self.PROBE_TIMEOUT}, now)
+        return claimed
+
+    def record(self, ok, seconds, probe=False):
+        """Count the outcome of one gated call"""
+        ok = ok and seconds < self.SLOW_CALL
+        try:
+            if probe:
+                state = self._state(fresh=True)
+                if ok:
+                    self._transition(state, self.CLOSED, 'the probe succeeded')
+                else:
+                    self._transition(state, self.OPEN, 'the probe failed')
+                return
+            state = self._state()
+            if state['state'] != self.CLOSED:
+                return  # a call that started before the circuit opened
+            now = self.clock()
+            bucket = int(now // self.BUCKET)
+            first = bucket - self.WINDOW // self.BUCKET + 1
+            with self._lock:
+                counts = self._pending.setdefault((state['generation'], bucket), [0, 0])
+                counts[0] += 1
+                counts[1] += 0 if ok else 1
+                due = now - self._flushed_at >= self.FLUSH_SECONDS
+                if not due and not ok:
+                    calls, failures = self._seen
+                    for (generation, pending_bucket), (c, f) in self._pending.items():
+                        if generation == state['generation'] and pending_bucket >= first:
+                            calls, failures = calls + c, failures + f
+                    due = self._trips(calls, failures)
+                if not due:
+                    return
+                pending, self._pending = self._pending, {}
+                self._flushed_at = now
+            self._flush(pending)
+            calls, failures = self._seen = self.window(state['generation'], bucket)
+            if self._trips(calls, failures):
+                self._transition(
+                    state, self.OPEN,
+                    f'{failures} of {calls} calls failed in the last {self.WINDOW}s',
+                )
+        except DatabaseError:
+            logger.exception('Could not record a bKash call in the circuit breaker')
+
+    def _trips(self, calls, failures):
+        return calls >= self.MIN_CALLS and failures >= self.FAILURE_RATE * calls
+
+    def _flush(self, pending):
+        for (generation, bucket), (calls, failures) in sorted(pending.items()):
+            slot = bucket % (self.WINDOW // self.BUCKET)
+            self.store.add(slot, generation, bucket, calls, failures)
+
+    def window(self, generation, bucket):
+        """``(calls, failures)`` written to the store for the window ending at ``bucket``"""
+        return self.store.window(generation, bucket - self.WINDOW // self.BUCKET + 1, bucket)
+
+    def _transition(self, state, to, reason):
+        """Move the circuit on from ``state``, unless another worker already did"""
+        fields = {
+            'state': to, 'generation': state['generation'] + 1, 'since': self.clock(),
+            'probe_until': 0,
+        }
+        if not self.store.transition(state['generation'], fields):
+            self._state(fresh=True)
+            return
+        self._remember(fields)
+        with self._lock:
+            self._seen = (0, 0)
+        metrics.BREAKER_TRANSITIONS.labels(to).inc()
+        if to == self.OPEN:
+            logger.warning(
+                'bKash circuit opened (%s); refusing new payments for %ss', reason, self.OPEN_SECONDS
+            )
+        else:
+            logger.warning('bKash circuit closed (%s)', reason)
+
+
+class BkashService:
+    def __init__(self, session=None, base_url=None, isolated=False):
+        """``isolated`` keeps the token and circuit breaker in this process, for load tests"""
         self.config = settings.BKASH_CONFIG
-        self.base_url = self.config['PRODUCTION_BASE_URL']
+        self.base_url = base_url or self.config.get('BASE_URL') or self.config['PRODUCTION_BASE_URL']
         self.website_url = 'http://aishikkha.com'
+        self.timeout = (
+            self.config.get('CONNECT_TIMEOUT', CONNECT_TIMEOUT),
+            self.config.get('READ_TIMEOUT', READ_TIMEOUT),
+        )
+        self.session = session or build_session(
+            self.base_url, pool_size=self.config.get('POOL_SIZE', POOL_SIZE)
+        )
+        self.tokens = TokenManager(self, store=MemoryTokenStore() if isolated else BkashToken)
+        self.breaker = CircuitBreaker(store=MemoryBreakerStore() if isolated else None)
+
+    def _post(self, url, headers, data):
+        """POST through the shared session; None if the gateway could not be reached"""
+        response = None
+        with metrics.gateway_call(url[len(self.base_url):]) as call:
+            try:
+                response = self.session.post(url, headers=headers, json=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                call.fail('connection')
+                logger.warning('bKash request to %s failed: %s', url, e)
+            else:
+                call.check(response)
+        return response
+
     def get_token(self):
-        # Check if token exists in cache
-        token = cache.get('bkash_token')
-        if token:
-            return token
-            
-        url = f"{self.base_url}/tokenized/checkout/token/grant"
+        return self.tokens.get_token()
+
+    def _token_request(self, path, data):
+        url = f"{self.base_url}{path}"
         headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
             'username': self.config['USERNAME'],
             'password': self.config['PASSWORD']
         }
         data = {
             'app_key': self.config['APP_KEY'],
-            'app_secret': self.config['APP_SECRET']
+            'app_secret': self.config['APP_SECRET'],
+            **data,
         }
-        
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
+        response = self._post(url, headers, data)
+        if response is not None and response.status_code == 200:
             token_data = response.json()
-            token = token_data.get('id_token')
-            # Cache token for 50 minutes (expires in 1 hour)
-            cache.set('bkash_token', token, 3000)
-            return token
+            if token_data.get('id_token'):
+                return token_data
         return None
-    
-    def create_payment(self, amount, invoice_number, intent='sale'):
-        token = self.get_token()
-        if not token:
-            return None
-            
-        url = f"{self.base_url}/tokenized/checkout/create"
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
+
+    def grant_token(self):
+        return self._token_request('/tokenized/checkout/token/grant', {})
+
+    def refresh_token(self, refresh_token):
+        return self._token_request(
+            '/tokenized/checkout/token/refresh', {'refresh_token': refresh_token}
+        )
+
+    def payment_headers(self, token):
+        return {
             'authorization': token,
             'x-app-key': self.config['APP_KEY']
         }
-        data = {
+
+    def create_payment_data(self, amount, invoice_number, intent='sale'):
+        return {
             'mode': '0011',
             'payerReference': invoice_number,
             'callbackURL': f"{self.website_url}/payment/callback/",  # Update with your domain
@@ -56,52 +601,218 @@ class BkashService:
             'intent': intent,
             'merchantInvoiceNumber': invoice_number
         }
-        
-        response = requests.post(url, headers=headers, json=data)
-        print(response.json())
-        if response.status_code == 200:
+
+    def create_payment(self, amount, invoice_number, intent='sale'):
+        """Raises ``GatewayUnavailable`` while the circuit breaker is open"""
+        probe = self.breaker.before_call()
+        token = self.get_token()
+        if not token:
+            if probe:
+                self.breaker.record(False, 0, probe)
+            return None
+
+        url = f"{self.base_url}/tokenized/checkout/create"
+        data = self.create_payment_data(amount, invoice_number, intent)
+
+        start = time.perf_counter()
+        response = self._post(url, self.payment_headers(token), data)
+        self.breaker.record(gateway_ok(response), time.perf_counter() - start, probe)
+        if response is not None and response.status_code == 200:
+            logger.debug('bKash create: %s', response.text)
             return response.json()
         return None
-    
+
     def execute_payment(self, payment_id):
         token = self.get_token()
         if not token:
             return None
-            
+
         url = f"{self.base_url}/tokenized/checkout/execute"
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'authorization': token,
-            'x-app-key': self.config['APP_KEY']
-        }
         data = {
             'paymentID': payment_id
         }
-        
-        response = requests.post(url, headers=headers, json=data)
-        print(response.json())
-        if response.status_code == 200:
+
+        response = self._post(url, self.payment_headers(token), data)
+        if response is not None and response.status_code == 200:
+            logger.debug('bKash execute: %s', response.text)
             return response.json()
         return None
-    
+
     def query_payment(self, payment_id):
         token = self.get_token()
         if not token:
             return None
-            
+
         url = f"{self.base_url}/tokenized/checkout/payment/status"
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'authorization': token,
-            'x-app-key': self.config['APP_KEY']
-        }
         data = {
             'paymentID': payment_id
         }
-        
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
+
+        response = self._post(url, self.payment_headers(token), data)
+        if response is not None and response.status_code == 200:
             return response.json()
         return None
+
+
+class AsyncBkashService:
+    """Non-blocking twin of ``BkashService`` for the async payment views
+
+    Calls go through an ``httpx.AsyncClient`` with its own keep-alive pool,
+    so a request waiting on bKash holds no thread. There is one client per
+    event loop, since httpx connections cannot move between loops. Tokens
+    come from the shared ``TokenManager``: the hot path is an in-memory
+    check, and the rare grant or refresh runs in a worker thread so that it
+    stays single-flight with the sync views.
+    """
+    RETRY_STATUSES = GATEWAY_ERROR_STATUSES
+
+    def __init__(self, service=None, retries=2, backoff_factor=0.5):
+        self.service = service or get_bkash_service()
+        self.base_url = self.service.base_url
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            connect_timeout, read_timeout = self.service.timeout
+            pool_size = self.service.config.get('POOL_SIZE', POOL_SIZE)
+            client = self._clients[loop] = httpx.AsyncClient(
+                headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+                # Connection failures are always safe to retry; nothing was sent.
+                transport=httpx.AsyncHTTPTransport(retries=self.retries),
+            )
+        return client
+
+    async def aclose(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def _post(self, path, headers, data):
+        """POST to the gateway; None if it could not be reached
+
+        Idempotent paths are also retried after timeouts and 429/5xx.
+        """
+        url = f"{self.base_url}{path}"
+        attempts = 1 + (self.retries if path in IDEMPOTENT_PATHS else 0)
+        with metrics.gateway_call(path) as call:
+            for attempt in range(attempts):
+                if attempt:
+                    await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+                try:
+                    response = await self.client.post(url, headers=headers, json=data)
+                except httpx.HTTPError as e:
+                    logger.warning('bKash request to %s failed: %s', url, e)
+                    response = None
+                    continue
+                if response.status_code not in self.RETRY_STATUSES:
+                    break
+            if response is None:
+                call.fail('connection')
+            else:
+                call.check(response)
+        return response
+
+    async def get_token(self):
+        tokens = self.service.tokens
+        if tokens.is_fresh(tokens._state):
+            return tokens._state['id_token']
+        return await sync_to_async(tokens.get_token)()
+
+    async def _call(self, path, data, probe=None):
+        """``probe`` is ``before_call()``'s answer for gated calls, None for the rest"""
+        token = await self.get_token()
+        if not token:
+            if probe:
+                await sync_to_async(self.service.breaker.record)(
+                    False, 0, probe,
+                )
+            return None
+        start = time.perf_counter()
+        response = await self._post(path, self.service.payment_headers(token), data)
+        if probe is not None:
+            await sync_to_async(self.service.breaker.record)(
+                gateway_ok(response), time.perf_counter() - start, probe,
+            )
+        if response is not None and response.status_code == 200:
+            return response.json()
+        return None
+
+    async def create_payment(self, amount, invoice_number, intent='sale'):
+        """Raises ``GatewayUnavailable`` while the circuit breaker is open"""
+        probe = await sync_to_async(self.service.breaker.before_call)()
+        return await self._call(
+            '/tokenized/checkout/create',
+            self.service.create_payment_data(amount, invoice_number, intent),
+            probe,
+        )
+
+    async def execute_payment(self, payment_id):
+        return await self._call('/tokenized/checkout/execute', {'paymentID': payment_id})
+
+    async def query_payment(self, payment_id):
+        return await self._call('/tokenized/checkout/payment/status', {'paymentID': payment_id})
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_bkash_service():
+    """The process-wide service, so every request shares one connection pool"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = BkashService()
+    return _service
+
+
+_async_service = None
+
+
+def get_async_bkash_service():
+    """The process-wide async service; shares tokens with ``get_bkash_service()``"""
+    global _async_service
+    if _async_service is None:
+        service = get_bkash_service()
+        with _service_lock:
+            if _async_service is None:
+                _async_service = AsyncBkashService(service)
+    return _async_service
+
+
+@contextmanager
+def isolated_service(base_url):
+    """Serve the views' bKash calls from an isolated service for ``base_url``
+
+    For load tests: the fake gateway's tokens and failures stay in this
+    process instead of reaching the token and circuit breaker the live
+    workers use.
+    """
+    global _service, _async_service
+    service = BkashService(base_url=base_url, isolated=True)
+    with _service_lock:
+        previous = _service, _async_service
+        _service, _async_service = service, None
+    try:
+        yield service
+    finally:
+        with _service_lock:
+            _service, _async_service = previous
+        service.session.close()
+
+
+@receiver(setting_changed)
+def reset_services(setting, **kwargs):
+    """Rebuild the shared services when ``BKASH_CONFIG`` is overridden"""
+    global _service, _async_service
+    if setting == 'BKASH_CONFIG':
+        with _service_lock:
+            _service = _async_service = None
@@ -0,0 +1,68 @@
+"""Process-local category registry.
+
+Categories change about once a month but are needed by every page, so each
+worker keeps them in memory: an ordered list for navigation plus slug and id
+lookups. ``Category`` saves and deletes bump a version key in the shared
+cache, and every worker reloads its copy when it sees a new version.
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Category
+
+CATEGORY_VERSION_KEY = 'category_version'
+
+
+def category_version():
+    return cache.get_or_set(CATEGORY_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def bump_category_version():
+    cache.set(CATEGORY_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class CategoryRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._categories = []
+        self._by_slug = {}
+        self._by_id = {}
+
+    def _current(self):
+        version = category_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    categories = list(Category.objects.order_by('pk'))
+                    self._categories = categories
+                    self._by_slug = {category.slug: category for category in categories}
+                    self._by_id = {category.pk: category for category in categories}
+                    self._version = version
+        return self
+
+    def all(self):
+        return self._current()._categories
+
+    def get_by_slug(self, slug):
+        return self._current()._by_slug.get(slug)
+
+    def get_by_id(self, pk):
+        return self._current()._by_id.get(pk)
+
+    def id_for_slug(self, slug):
+        category = self.get_by_slug(slug)
+        return category.pk if category else None
+
+
+registry = CategoryRegistry()
+
+
+def get_category_or_404(slug):
+    category = registry.get_by_slug(slug)
+    if category is None:
+        raise Http404('No Category matches the given query.')
+    return category
@@ -0,0 +1,6 @@
+from .categories import registry
+
+
+def categories(request):
+    """Category navigation for every template, served from the in-process registry"""
+    return {'categories': registry.all()}
@@ -0,0 +1,84 @@
+"""Download counting for ``download_ebook``.
+
+By default every download is written straight away, as one atomic ``F()``
+increment plus one ``DownloadEvent`` row. With ``DOWNLOAD_FLUSH_INTERVAL``
+set, each process instead buffers downloads in memory and writes them in one
+batch every that many seconds (or once ``DOWNLOAD_BUFFER_SIZE`` pile up), so
+a burst of clicks takes the database write lock once per batch rather than
+once per click. Buffered downloads not yet flushed are lost if the process
+dies without running its exit handlers.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import DownloadEvent
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadBuffer:
+    def __init__(self):
+        self.pending = []
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, order_id):
+        with self.lock:
+            self.pending.append((order_id, timezone.now()))
+            full = len(self.pending) >= settings.DOWNLOAD_BUFFER_SIZE
+            if not full:
+                self.arm_timer()
+        if full:
+            self.flush()
+
+    def arm_timer(self):
+        """Schedule a flush unless one is already due; call with ``lock`` held"""
+        if self.timer is None:
+            self.timer = threading.Timer(settings.DOWNLOAD_FLUSH_INTERVAL, self.flush_in_thread)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of downloads written"""
+        with self.lock:
+            downloads, self.pending = self.pending, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        try:
+            DownloadEvent.record(downloads)
+        except DatabaseError:
+            logger.exception(
+                'Could not write %d downloads; keeping them for the next flush', len(downloads)
+            )
+            with self.lock:
+                self.pending[:0] = downloads
+                self.arm_timer()  # or they would wait for the next download
+            return 0
+        return len(downloads)
+
+    def flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()  # the timer thread's own connection
+
+
+_buffer = DownloadBuffer()
+atexit.register(_buffer.flush)
+
+
+def record_download(order_id):
+    if settings.DOWNLOAD_FLUSH_INTERVAL:
+        _buffer.add(order_id)
+    else:
+        DownloadEvent.record([(order_id, timezone.now())])
+
+
+def flush():
+    return _buffer.flush()
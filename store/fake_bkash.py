@@ -0,0 +1,162 @@
+"""In-process fake of the bKash tokenized checkout API.
+
+For load tests and local development: run ``manage.py run_fake_bkash`` and
+point ``BKASH_BASE_URL`` at it, or start a ``FakeBkashGateway`` in-process.
+Faults can be injected to see how checkout copes with a slow or flaky
+gateway:
+
+* ``latency`` (plus up to ``jitter``) seconds of delay before every response;
+* ``error_rate`` -- the share of calls answered with HTTP ``error_status``;
+* ``status_codes`` -- ``{endpoint: statusCode}`` to make an endpoint
+  ("grant", "refresh", "create", "execute" or "status") always answer with a
+  bKash error code, e.g. ``{'execute': '2023'}`` for insufficient balance.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = {
+    '/tokenized/checkout/token/grant': 'grant',
+    '/tokenized/checkout/token/refresh': 'refresh',
+    '/tokenized/checkout/create': 'create',
+    '/tokenized/checkout/execute': 'execute',
+    '/tokenized/checkout/payment/status': 'status',
+}
+
+STATUS_MESSAGES = {
+    '2023': 'Insufficient Balance',
+    '2056': 'Invalid Payment State',
+    '2062': 'The payment has already been completed',
+    '2117': 'Payment execution already been called before',
+    '9999': 'System Error',
+}
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # load tests open many connections at once
+
+
+class FakeBkashGateway:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, status_codes=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.status_codes = dict(status_codes or {})
+        self.random = random.Random(seed)
+        self.payments = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.server = Server((host, port), self.handler_class())
+        self.url = f'http://{host}:{self.server.server_port}'
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def delay(self):
+        """Seconds to wait before the next response"""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def respond(self, path, body):
+        """``(status, payload)`` for one API call, faults included"""
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if failed:
+            return self.error_status, {'statusCode': str(self.error_status),
+                                       'statusMessage': 'Injected error'}
+        code = self.status_codes.get(ENDPOINTS.get(path))
+        if code:
+            return 200, {'statusCode': code,
+                         'statusMessage': STATUS_MESSAGES.get(code, 'Injected failure')}
+        return self.handle(path, body)
+
+    def handle(self, path, body):
+        """``(status, payload)`` of the happy path for one API call"""
+        if path in ('/tokenized/checkout/token/grant', '/tokenized/checkout/token/refresh'):
+            return 200, {
+                'statusCode': '0000', 'statusMessage': 'Successful',
+                'id_token': uuid.uuid4().hex, 'refresh_token': uuid.uuid4().hex,
+                'expires_in': 3600, 'token_type': 'Bearer',
+            }
+        if path == '/tokenized/checkout/create':
+            payment_id = f'TR{uuid.uuid4().hex[:20].upper()}'
+            payment = {
+                'paymentID': payment_id,
+                'amount': body.get('amount'),
+                'merchantInvoiceNumber': body.get('merchantInvoiceNumber'),
+                'transactionStatus': 'Initiated',
+            }
+            with self._lock:
+                self.payments[payment_id] = payment
+            return 200, {
+                'statusCode': '0000', 'statusMessage': 'Successful',
+                'bkashURL': f'{self.url}/checkout?paymentID={payment_id}', **payment,
+            }
+        if path in ('/tokenized/checkout/execute', '/tokenized/checkout/payment/status'):
+            with self._lock:
+                payment = self.payments.get(body.get('paymentID'))
+                if payment is None:
+                    return 200, {'statusCode': '2056', 'statusMessage': STATUS_MESSAGES['2056']}
+                if path == '/tokenized/checkout/execute':
+                    if payment['transactionStatus'] == 'Completed':
+                        return 200, {'statusCode': '2062', 'statusMessage': STATUS_MESSAGES['2062']}
+                    payment.update(transactionStatus='Completed', trxID=uuid.uuid4().hex[:10].upper())
+                payment = dict(payment)
+            return 200, {'statusCode': '0000', 'statusMessage': 'Successful', **payment}
+        return 404, {'statusCode': '404', 'statusMessage': 'Not found'}
+
+    def handler_class(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    body = {}
+                delay = gateway.delay()
+                if delay:
+                    time.sleep(delay)
+                status, payload = gateway.respond(self.path, body)
+                content = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
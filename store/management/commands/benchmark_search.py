@@ -0,0 +1,88 @@
+# management/commands/benchmark_search.py
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from store import search
+from store.models import Category, Product
+
+WORDS = [
+    'chatgpt', 'prompt', 'midjourney', 'python', 'django', 'machine', 'learning',
+    'freelancing', 'design', 'marketing', 'guide', 'mastery', 'career', 'data',
+    'চ্যাটজিপিটি', 'প্রম্পট', 'কৃত্রিম', 'বুদ্ধিমত্তা', 'শিখুন', 'ক্যারিয়ার', 'ডিজাইন',
+    'ফ্রিল্যান্সিং', 'প্রোগ্রামিং', 'গাইড', 'সহজ', 'ভাষায়', 'বই', 'ব্যবহার',
+]
+QUERIES = ['chatgpt', 'বুদ্ধিমত্তা', 'midjourney design', 'প্রম্পট গাইড', 'nothingmatches']
+LATIN = 'abcdefghijklmnopqrstuvwxyz'
+BENGALI = 'কখগঘচছজঝটঠডঢতথদধনপফবভমযরলশষসহ'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare FTS search with the old icontains query on synthetic catalogs. '
+        'Everything runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def legacy_search(self, query):
+        return list(Product.objects.filter(
+            Q(title__icontains=query) |
+            Q(author__icontains=query) |
+            Q(description__icontains=query)
+        ).distinct().values_list('pk', flat=True)[:search.SEARCH_LIMIT])
+
+    def timed(self, func, query, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(query)
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    def vocabulary(self, rng, size=20_000):
+        """Filler words plus the query words, with Zipf-like frequencies"""
+        words = [
+            ''.join(rng.choices(rng.choice([LATIN, BENGALI]), k=rng.randint(3, 9)))
+            for _ in range(size)
+        ]
+        words[50:50 + len(WORDS)] = WORDS
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+        return words, weights
+
+    def populate(self, size, rng):
+        category = Category.objects.create(name='Benchmark', slug='benchmark-search')
+        words, weights = self.vocabulary(rng)
+        batch = []
+        for i in range(size):
+            batch.append(Product(
+                title=' '.join(rng.choices(words, weights, k=4)),
+                author=' '.join(rng.choices(words, weights, k=2)),
+                description=' '.join(rng.choices(words, weights, k=120)),
+                category=category, price=100,
+                sample_pdf_file='sample_pdfs/benchmark.pdf',
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        search.rebuild_index()
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'products':>9}  {'query':<22}{'icontains ms':>13}{'fts ms':>9}")
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.populate(size, rng)
+                for query in QUERIES:
+                    legacy = self.timed(self.legacy_search, query, options['repeat'])
+                    ranked = self.timed(search.search_products, query, options['repeat'])
+                    self.stdout.write(f'{size:>9}  {query:<22}{legacy:>13.1f}{ranked:>9.1f}')
+                transaction.set_rollback(True)
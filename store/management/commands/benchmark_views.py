@@ -0,0 +1,160 @@
+# management/commands/benchmark_views.py
+import json
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from store.models import Category, Order, Product, Review
+
+# Views that write to the database; timed inside a transaction that is rolled back
+MUTATING_VIEWS = {'download_ebook'}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every store page through the test client against the current '
+        'database (see generate_catalog) and write latency percentiles and '
+        'query counts to JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--output', default='benchmark_views.json')
+        parser.add_argument('--compare', metavar='JSON',
+                            help='Earlier result file to print p50 changes against')
+        parser.add_argument('--view', action='append',
+                            help='Only benchmark this URL name; may be repeated')
+
+    def targets(self):
+        """``(label, path)`` for each store view, using real rows for its arguments"""
+        product = Product.objects.order_by('-pk').first()
+        reviewed = (
+            Review.objects.filter(status='approved').values_list('product_id', flat=True)
+            .order_by('-product_id').first()
+        )
+        category = Category.objects.order_by('pk').first()
+        pending = Order.objects.filter(status='pending').order_by('-created_at').first()
+        paid = Order.objects.filter(status='paid').order_by('-created_at').first()
+        if not (product and category and pending and paid):
+            raise CommandError('Not enough data; run generate_catalog first')
+        word = product.title.split()[0]
+        return [
+            ('home', reverse('store:home')),
+            ('home?window=7d', reverse('store:home') + '?window=7d'),
+            ('product_list', reverse('store:product_list')),
+            ('product_list_by_category',
+             reverse('store:product_list_by_category', args=[category.slug])),
+            ('product_detail', reverse('store:product_detail', args=[reviewed or product.pk])),
+            ('get_reviews_ajax', reverse('store:get_reviews_ajax', args=[reviewed or product.pk])),
+            ('search', f"{reverse('store:search')}?q={word}"),
+            ('search_suggest', f"{reverse('store:search_suggest')}?q={word[:3]}"),
+            ('checkout', reverse('store:checkout', args=[product.pk])),
+            ('payment_page', reverse('store:payment_page', args=[pending.pk])),
+            ('payment_success', reverse('store:payment_success', args=[paid.pk])),
+            ('download_ebook', reverse('store:download_ebook', args=[paid.pk])),
+        ]
+
+    def measure(self, client, path, repeat, warmup):
+        for _ in range(warmup):
+            client.get(path)
+        timings, queries = [], []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(path)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+        return {
+            'path': path,
+            'status': response.status_code,
+            'requests': repeat,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p90_ms': round(percentile(timings, 90), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': statistics.median_low(queries),
+            'max_queries': max(queries),
+        }
+
+    @staticmethod
+    def git_revision():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        setup_test_environment(debug=False)  # allows the test client's host
+        client = Client()
+        targets = self.targets()
+        if options['view']:
+            targets = [target for target in targets if target[0] in options['view']]
+
+        results = {}
+        self.stdout.write(f"{'view':<28}{'status':>7}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'queries':>9}")
+        for label, path in targets:
+            if label in MUTATING_VIEWS:
+                # Unbuffered, so the download writes happen inside the transaction
+                with transaction.atomic(), override_settings(DOWNLOAD_FLUSH_INTERVAL=0):
+                    result = self.measure(client, path, options['repeat'], options['warmup'])
+                    transaction.set_rollback(True)
+            else:
+                result = self.measure(client, path, options['repeat'], options['warmup'])
+            results[label] = result
+            self.stdout.write(
+                f"{label:<28}{result['status']:>7}{result['p50_ms']:>9.1f}"
+                f"{result['p90_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['queries']:>9}"
+            )
+
+        report = {
+            'revision': self.git_revision(),
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'rows': {
+                model.__name__.lower(): model.objects.count()
+                for model in (Category, Product, Review, Order)
+            },
+            'views': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def compare(self, report, path):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f"\nAgainst {baseline.get('revision') or path}:")
+        for label, result in report['views'].items():
+            before = baseline['views'].get(label)
+            if not before:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            self.stdout.write(
+                f"{label:<28}{before['p50_ms']:>9.1f} -> {result['p50_ms']:<9.1f}"
+                f"{change:>+7.1f}%  queries {before['queries']} -> {result['queries']}"
+            )
@@ -0,0 +1,178 @@
+# management/commands/generate_catalog.py
+import math
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from store import categories, search, suggest
+from store.models import (
+    BestsellerRank, Category, DownloadEvent, Order, Product, RatingSummary, Review,
+    StoreCounter,
+)
+
+WORDS = [
+    'chatgpt', 'prompt', 'midjourney', 'python', 'django', 'machine', 'learning',
+    'freelancing', 'design', 'marketing', 'guide', 'mastery', 'career', 'data',
+    'চ্যাটজিপিটি', 'প্রম্পট', 'কৃত্রিম', 'বুদ্ধিমত্তা', 'শিখুন', 'ক্যারিয়ার', 'ডিজাইন',
+    'ফ্রিল্যান্সিং', 'প্রোগ্রামিং', 'গাইড', 'সহজ', 'ভাষায়', 'বই', 'ব্যবহার',
+]
+AUTHORS = ['AiShikkha', 'Rahim Uddin', 'Nusrat Jahan', 'তানভীর আহমেদ', 'Farhana Akter']
+DESCRIPTION_VARIANTS = 200
+
+REVIEW_STATUSES = (['approved', 'pending', 'rejected'], [80, 15, 5])
+REVIEW_RATINGS = ([1, 2, 3, 4, 5], [4, 6, 15, 35, 40])
+ORDER_STATUSES = (['paid', 'pending', 'failed'], [60, 30, 10])
+HISTORY_DAYS = 365
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a deterministic synthetic catalog (categories, '
+        'products, reviews and orders) for local benchmarking'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000,
+                            help='Number of products, e.g. 1000 up to 1000000')
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--reviews-per-product', type=float, default=5)
+        parser.add_argument('--orders-per-product', type=float, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete all existing categories, products, reviews and orders first')
+
+    def descriptions(self, rng):
+        """A fixed pool of Markdown descriptions, each rendered to HTML once"""
+        pool = []
+        for _ in range(DESCRIPTION_VARIANTS):
+            paragraphs = [
+                ' '.join(rng.choices(WORDS, k=rng.randint(20, 60))).capitalize() + '.'
+                for _ in range(rng.randint(1, 4))
+            ]
+            description = f'**{rng.choice(WORDS).title()}** ' + '\n\n'.join(paragraphs)
+            pool.append((description, Product(description=description).render_description()))
+        return pool
+
+    def handle(self, *args, **options):
+        if options['products'] < 1:
+            raise CommandError('--products must be at least 1')
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        if options['flush']:
+            # Plain DELETEs: the ORM's per-row cascade and signals would take
+            # hours on a large catalog, and everything they maintain is rebuilt below.
+            models = [Review, DownloadEvent, Order, BestsellerRank, RatingSummary, Product, Category]
+            connection.ops.execute_sql_flush(connection.ops.sql_flush(
+                no_style(), [model._meta.db_table for model in models], reset_sequences=True,
+            ))
+
+        category_ids = []
+        for i in range(options['categories']):
+            category, _ = Category.objects.get_or_create(
+                slug=f'synthetic-{i + 1}', defaults={'name': f'Synthetic {i + 1}'}
+            )
+            category_ids.append(category.pk)
+
+        descriptions = self.descriptions(rng)
+        now = timezone.now()
+        review_serial = Review.objects.count()
+        customers = max(1, int(options['products'] * options['orders_per_product'] / 3))
+        totals = {'products': 0, 'reviews': 0, 'orders': 0}
+
+        remaining = options['products']
+        while remaining:
+            size = min(batch_size, remaining)
+            remaining -= size
+            with transaction.atomic():
+                products = []
+                for _ in range(size):
+                    description, description_html = rng.choice(descriptions)
+                    price = rng.randrange(100, 1000, 10)
+                    products.append(Product(
+                        title=' '.join(rng.choices(WORDS, k=rng.randint(2, 5))).title(),
+                        author=rng.choice(AUTHORS),
+                        description=description,
+                        description_html=description_html,
+                        category_id=rng.choice(category_ids),
+                        original_price=price + rng.randrange(0, 500, 50),
+                        price=price,
+                        drive_link='https://example.com/ebook.pdf',
+                        sample_pdf_file='sample_pdfs/sample.pdf',
+                    ))
+                products = Product.objects.bulk_create(products)
+
+                reviews, orders = [], []
+                for product in products:
+                    for _ in range(self.poisson(rng, options['reviews_per_product'])):
+                        review_serial += 1
+                        reviews.append(Review(
+                            product_id=product.pk,
+                            name=f'Reader {review_serial}',
+                            email=f'reader{review_serial}@example.com',
+                            rating=rng.choices(*REVIEW_RATINGS)[0],
+                            title=' '.join(rng.choices(WORDS, k=3)).capitalize(),
+                            comment=' '.join(rng.choices(WORDS, k=rng.randint(5, 40))),
+                            status=rng.choices(*REVIEW_STATUSES)[0],
+                        ))
+                    for _ in range(self.poisson(rng, options['orders_per_product'])):
+                        status = rng.choices(*ORDER_STATUSES)[0]
+                        customer = rng.randrange(customers)
+                        orders.append(Order(
+                            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                            customer_name=f'Customer {customer}',
+                            email=f'customer{customer}@example.com',
+                            phone=f'01{rng.randrange(10 ** 9):09d}',
+                            product_id=product.pk,
+                            amount=product.price,
+                            status=status,
+                            bkash_payment_id=f'TR{rng.getrandbits(48):012X}',
+                            paid_at=(
+                                now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+                                if status == 'paid' else None
+                            ),
+                        ))
+                Review.objects.bulk_create(reviews, batch_size=batch_size)
+                Order.objects.bulk_create(orders, batch_size=batch_size)
+
+            totals['products'] += len(products)
+            totals['reviews'] += len(reviews)
+            totals['orders'] += len(orders)
+            self.stdout.write(
+                f"  {totals['products']} products, {totals['reviews']} reviews, "
+                f"{totals['orders']} orders"
+            )
+
+        # bulk_create skips save() and signals, so rebuild everything they maintain.
+        self.stdout.write('Rebuilding summaries, counters, rankings and the search index...')
+        RatingSummary.rebuild()
+        StoreCounter.reconcile()
+        BestsellerRank.refresh()
+        search.rebuild_index()
+        suggest.bump_catalog_version()
+        categories.bump_category_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {totals['products']} products, {totals['reviews']} reviews and "
+            f"{totals['orders']} orders in {time.perf_counter() - started:.1f}s"
+        ))
+
+    @staticmethod
+    def poisson(rng, mean):
+        """Knuth's method; fine for the small means used here"""
+        if mean <= 0:
+            return 0
+        limit, k, p = math.exp(-mean), 0, 1.0
+        while True:
+            p *= rng.random()
+            if p <= limit:
+                return k
+            k += 1
@@ -0,0 +1,189 @@
+# management/commands/loadtest_checkout.py
+import json
+import logging
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from store.bkash_service import isolated_service
+from store.fake_bkash import FakeBkashGateway
+from store.management.commands.benchmark_views import percentile
+from store.models import BestsellerRank, Order, Product, StoreCounter
+
+STEPS = ('checkout', 'create', 'execute', 'total')
+EMAIL_DOMAIN = 'loadtest.invalid'
+
+# SQLite, then PostgreSQL wording
+LOCK_ERROR = re.compile(
+    r'database is locked|database table is locked|deadlock detected|'
+    r'could not obtain lock|lock timeout',
+    re.IGNORECASE,
+)
+
+
+class LockErrorCounter(logging.Handler):
+    """Count logged errors caused by database lock contention"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        text = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            text += f' {record.exc_info[1]}'
+        if LOCK_ERROR.search(text):
+            self.count += 1  # handle() holds the handler lock around emit()
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent checkout -> create_payment -> execute_payment flows '
+        'through the store views against a bKash gateway and report orders/sec, '
+        'latency percentiles and database lock errors. Writes real orders to '
+        'the configured database; they are deleted afterwards unless --keep'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent customers, like WSGI worker threads')
+        parser.add_argument('--product', type=int,
+                            help='Product to buy (default: the newest)')
+        parser.add_argument('--gateway', metavar='URL',
+                            help='Use a running gateway (e.g. run_fake_bkash) instead '
+                                 'of starting one in-process')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='In-process gateway delay per response, in seconds')
+        parser.add_argument('--jitter', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of in-process gateway calls answered with a 503')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the orders created by the run')
+
+    def flow(self, urls, run, i):
+        """One customer's checkout; ``(failed step or None, {step: seconds})``"""
+        client = Client(raise_request_exception=False)
+        timings = {}
+        started = step_started = time.perf_counter()
+
+        def lap(step):
+            nonlocal step_started
+            now = time.perf_counter()
+            timings[step] = now - step_started
+            step_started = now
+
+        response = client.post(urls['checkout'], {
+            'name': f'Load test {i}', 'phone': '01700000000',
+            'email': f'{run}-{i}@{EMAIL_DOMAIN}',
+        })
+        lap('checkout')
+        if response.status_code != 302:
+            return 'checkout', timings
+        order_id = response.url.rstrip('/').rsplit('/', 1)[-1]
+
+        response = client.post(
+            urls['create'], json.dumps({'order_id': order_id}), content_type='application/json',
+        )
+        lap('create')
+        data = response.json() if response.status_code == 200 else {}
+        if not data.get('success'):
+            return 'create', timings
+
+        response = client.get(urls['execute'], {'paymentID': data['payment_id']})
+        lap('execute')
+        if response.status_code != 302 or response.url != reverse(
+            'store:payment_success', args=[order_id]
+        ):
+            return 'execute', timings
+        timings['total'] = time.perf_counter() - started
+        return None, timings
+
+    def run_flows(self, run, product, orders, workers):
+        urls = {
+            'checkout': reverse('store:checkout', args=[product.pk]),
+            'create': reverse('store:create_payment'),
+            'execute': reverse('store:payment_callback'),
+        }
+        samples = {step: [] for step in STEPS}
+        failures = dict.fromkeys(STEPS[:-1], 0)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda i: self.flow(urls, run, i), range(orders))
+            for failed, timings in results:
+                for step, seconds in timings.items():
+                    samples[step].append(seconds)
+                if failed:
+                    failures[failed] += 1
+        return time.perf_counter() - start, samples, failures
+
+    def report(self, elapsed, samples, failures, lock_errors):
+        self.stdout.write(f"{'step':<10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for step in STEPS:
+            if samples[step]:
+                self.stdout.write(f'{step:<10}' + ''.join(
+                    f'{percentile(samples[step], pct) * 1000:>9.0f}' for pct in (50, 95, 99)
+                ))
+        paid = len(samples['total'])
+        attempted = paid + sum(failures.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Paid {paid}/{attempted} orders in {elapsed:.2f}s: {paid / elapsed:.1f} orders/s; '
+            'failed at ' + ', '.join(f'{step} {count}' for step, count in failures.items())
+            + f'; database lock errors: {lock_errors}'
+        ))
+
+    def cleanup(self, run):
+        """Delete the run's orders and put the counters they touched right"""
+        Order.objects.filter(email__startswith=f'{run}-', email__endswith=f'@{EMAIL_DOMAIN}').delete()
+        StoreCounter.reconcile()
+        BestsellerRank.refresh()
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by('-pk')
+        if options['product']:
+            products = products.filter(pk=options['product'])
+        product = products.first()
+        if product is None:
+            raise CommandError('No product to buy; run generate_catalog first')
+
+        gateway = None
+        url = options['gateway']
+        if not url:
+            gateway = FakeBkashGateway(
+                latency=options['latency'], jitter=options['jitter'],
+                error_rate=options['error_rate'],
+            ).start()
+            url = gateway.url
+        counter = LockErrorCounter()
+        loggers = [logging.getLogger(name) for name in ('django.request', 'store.views')]
+        for logger in loggers:
+            logger.addHandler(counter)
+        run = uuid.uuid4().hex[:8]
+        try:
+            # The views get a service of their own, so the gateway's tokens
+            # never replace the one the live workers use.
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            ), isolated_service(url):
+                self.stdout.write(
+                    f"{options['orders']} checkouts of product {product.pk} with "
+                    f"{options['workers']} workers against {url}\n"
+                )
+                elapsed, samples, failures = self.run_flows(
+                    run, product, options['orders'], options['workers'],
+                )
+            self.report(elapsed, samples, failures, counter.count)
+        finally:
+            for logger in loggers:
+                logger.removeHandler(counter)
+            if gateway:
+                gateway.stop()
+            if not options['keep']:
+                self.cleanup(run)
@@ -0,0 +1,101 @@
+# management/commands/loadtest_payments.py
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from store.bkash_service import AsyncBkashService, BkashService
+from store.fake_bkash import FakeBkashGateway
+
+
+class Command(BaseCommand):
+    help = (
+        'Create payments against a local fake bKash gateway with injected '
+        'latency, through sync workers and through the async service'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Seconds the fake gateway waits before each response')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Sync worker threads, like WSGI workers')
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='In-flight requests for the async service')
+
+    def report(self, label, elapsed, latencies, failures, threads):
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f'{label:<8}{len(latencies) + failures:>9}{failures:>9}{elapsed:>10.2f}'
+            f'{(len(latencies) + failures) / elapsed:>10.1f}'
+            f'{statistics.median(latencies) * 1000 if latencies else 0:>9.0f}'
+            f'{p95 * 1000:>9.0f}{threads:>9}'
+        )
+
+    def run_sync(self, service, total, workers):
+        latencies, failures = [], 0
+
+        def create(i):
+            start = time.perf_counter()
+            response = service.create_payment(100, f'LOAD-SYNC-{i}')
+            return response, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for response, latency in pool.map(create, range(total)):
+                if response and response.get('statusCode') == '0000':
+                    latencies.append(latency)
+                else:
+                    failures += 1
+        return time.perf_counter() - start, latencies, failures, workers
+
+    async def run_async(self, service, total, concurrency):
+        latencies, failures = [], 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create(i):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                response = await service.create_payment(100, f'LOAD-ASYNC-{i}')
+                if response and response.get('statusCode') == '0000':
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    failures += 1
+
+        await service.get_token()  # the one-off grant is not what is being measured
+        start = time.perf_counter()
+        await asyncio.gather(*(create(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+        await service.aclose()
+        return elapsed, latencies, failures, 1  # everything waits on the one event loop
+
+    def handle(self, *args, **options):
+        with FakeBkashGateway(latency=options['latency']) as gateway:
+            # Isolated: the fake gateway's tokens must not reach the live workers.
+            sync_service = BkashService(base_url=gateway.url, isolated=True)
+            sync_service.get_token()
+            async_service = AsyncBkashService(
+                BkashService(base_url=gateway.url, isolated=True), retries=0,
+            )
+
+            self.stdout.write(
+                f"{options['requests']} payment creations, gateway latency "
+                f"{options['latency'] * 1000:.0f} ms\n"
+            )
+            self.stdout.write(
+                f"{'mode':<8}{'requests':>9}{'failed':>9}{'seconds':>10}{'req/s':>10}"
+                f"{'p50 ms':>9}{'p95 ms':>9}{'threads':>9}"
+            )
+            elapsed, latencies, failures, threads = self.run_sync(
+                sync_service, options['requests'], options['workers']
+            )
+            self.report('sync', elapsed, latencies, failures, threads)
+            elapsed, latencies, failures, threads = asyncio.run(self.run_async(
+                async_service, options['requests'], options['concurrency']
+            ))
+            self.report('async', elapsed, latencies, failures, threads)
+            sync_service.session.close()
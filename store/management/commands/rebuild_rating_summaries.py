@@ -0,0 +1,20 @@
+# management/commands/rebuild_rating_summaries.py
+from django.core.management.base import BaseCommand
+
+from store.models import RatingSummary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product rating summaries from approved reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'product_ids', nargs='*', type=int,
+            help='Only rebuild these products (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        rebuilt = RatingSummary.rebuild(options['product_ids'] or None)
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt rating summaries for {rebuilt} products')
+        )
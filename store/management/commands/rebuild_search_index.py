@@ -0,0 +1,18 @@
+# management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index'
+
+    def handle(self, *args, **options):
+        if not search.uses_fts():
+            self.stdout.write(
+                f'{connection.vendor} searches the product table directly; nothing to rebuild'
+            )
+            return
+        indexed = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products'))
@@ -0,0 +1,152 @@
+# management/commands/reconcile_payments.py
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from store.bkash_service import get_bkash_service
+from store.models import JobLease, Order
+
+LOCK_NAME = 'reconcile_payments'
+LOCK_TIMEOUT = 60 * 30
+
+PAID = 'paid'
+FAILED = 'failed'
+PENDING = 'pending'
+ERROR = 'error'
+SKIPPED = 'skipped'
+
+# bKash transactionStatus values that settle a payment for good
+COMPLETED_STATUSES = {'Completed'}
+FAILED_STATUSES = {'Failed', 'Cancelled', 'Expired', 'Declined'}
+
+
+class RateLimiter:
+    """Spread calls evenly at ``rate`` per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0, slot - now))
+
+
+class Command(BaseCommand):
+    help = (
+        'Ask bKash for the status of stale pending orders and mark them paid '
+        'or failed (safe to run on a schedule)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=15,
+                            help='Only orders untouched for this many minutes')
+        parser.add_argument('--limit', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--rate', type=float, default=10,
+                            help='Maximum status queries per second (0 for no limit)')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Query bKash but do not update any order')
+
+    def handle(self, *args, **options):
+        owner = uuid.uuid4().hex
+        if not JobLease.claim(LOCK_NAME, owner, LOCK_TIMEOUT):
+            self.stdout.write(self.style.WARNING('Another reconciliation is running; exiting'))
+            return
+        try:
+            self.reconcile(options)
+        finally:
+            JobLease.release(LOCK_NAME, owner)
+
+    def stale_orders(self, older_than, limit):
+        cutoff = timezone.now() - timedelta(minutes=older_than)
+        return list(
+            Order.objects.filter(status='pending', updated_at__lt=cutoff)
+            .exclude(bkash_payment_id__isnull=True)
+            .exclude(bkash_payment_id='')
+            .order_by('updated_at')
+            .values_list('pk', 'bkash_payment_id')[:limit]
+        )
+
+    def query(self, service, limiter, payment_id):
+        limiter.wait()
+        response = service.query_payment(payment_id)
+        if not response or 'transactionStatus' not in response:
+            return ERROR, None  # unreachable, or a bKash error code
+        status = response['transactionStatus']
+        if status in COMPLETED_STATUSES:
+            return PAID, response.get('trxID')
+        if status in FAILED_STATUSES:
+            return FAILED, None
+        return PENDING, None
+
+    def apply(self, results):
+        """Settle one batch of ``(order_id, outcome, trx_id)``; returns skipped order ids"""
+        settle = {order_id: (outcome, trx_id) for order_id, outcome, trx_id in results
+                  if outcome in (PAID, FAILED)}
+        if not settle:
+            return set()
+        with transaction.atomic():
+            orders = Order.objects.select_for_update().filter(pk__in=settle, status='pending')
+            updated = set()
+            for order in orders:
+                outcome, trx_id = settle[order.pk]
+                order.status = outcome
+                if trx_id:
+                    order.trx_id = trx_id
+                order.save()  # keeps paid_at, counters and bestsellers in step
+                updated.add(order.pk)
+        return set(settle) - updated  # settled meanwhile, e.g. by the callback
+
+    def reconcile(self, options):
+        started = time.perf_counter()
+        orders = self.stale_orders(options['older_than'], options['limit'])
+        counts = dict.fromkeys([PAID, FAILED, PENDING, ERROR, SKIPPED], 0)
+        if not orders:
+            self.stdout.write('No stale pending orders')
+            return counts
+
+        service = get_bkash_service()
+        service.get_token()  # once here rather than racing in every worker
+        limiter = RateLimiter(options['rate'])
+        batch = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            outcomes = pool.map(lambda order: self.query(service, limiter, order[1]), orders)
+            for (order_id, _), (outcome, trx_id) in zip(orders, outcomes):
+                counts[outcome] += 1
+                batch.append((order_id, outcome, trx_id))
+                if len(batch) >= options['batch_size']:
+                    if not options['dry_run']:
+                        counts[SKIPPED] += self.skip(self.apply(batch), batch, counts)
+                    batch = []
+            if batch and not options['dry_run']:
+                counts[SKIPPED] += self.skip(self.apply(batch), batch, counts)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {len(orders)} orders in {elapsed:.1f}s ({len(orders) / elapsed:.1f}/s): "
+            + ', '.join(f'{count} {outcome}' for outcome, count in counts.items())
+            + (' (dry run)' if options['dry_run'] else '')
+        ))
+        return counts
+
+    @staticmethod
+    def skip(skipped, batch, counts):
+        """Move orders that were settled elsewhere out of their outcome count"""
+        for order_id, outcome, _ in batch:
+            if order_id in skipped:
+                counts[outcome] -= 1
+        return len(skipped)
@@ -0,0 +1,16 @@
+# management/commands/reconcile_store_counters.py
+from django.core.management.base import BaseCommand
+
+from store.models import StoreCounter
+
+
+class Command(BaseCommand):
+    help = 'Recompute the storefront counters shown on the home page'
+
+    def handle(self, *args, **options):
+        for name, (old, new) in StoreCounter.reconcile().items():
+            if old != new:
+                self.stdout.write(self.style.WARNING(f'{name}: {old} -> {new}'))
+            else:
+                self.stdout.write(f'{name}: {new}')
+        self.stdout.write(self.style.SUCCESS('Store counters reconciled'))
@@ -0,0 +1,21 @@
+# management/commands/refresh_bestsellers.py
+from django.core.management.base import BaseCommand
+
+from store.models import BestsellerRank
+
+
+class Command(BaseCommand):
+    help = 'Recompute bestseller rankings from paid orders (run on a schedule)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window', action='append', choices=list(BestsellerRank.WINDOW_DAYS),
+            help='Only refresh this window; may be repeated (default: all windows)',
+        )
+
+    def handle(self, *args, **options):
+        windows = options['window'] or list(BestsellerRank.WINDOW_DAYS)
+        BestsellerRank.refresh(windows)
+        self.stdout.write(
+            self.style.SUCCESS(f"Refreshed bestseller windows: {', '.join(windows)}")
+        )
@@ -0,0 +1,32 @@
+# management/commands/render_descriptions.py
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Pre-render product descriptions from Markdown to sanitized HTML'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Re-render every product, e.g. after changing MARKDOWNIFY settings '
+                 '(default: only products without rendered HTML)',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        products = Product.objects.only('pk', 'description', 'description_html').order_by('pk')
+        if not options['all']:
+            products = products.filter(description_html='')
+
+        rendered, batch = 0, []
+        for product in products.iterator(chunk_size=options['batch_size']):
+            product.description_html = product.render_description()
+            batch.append(product)
+            if len(batch) >= options['batch_size']:
+                rendered += Product.objects.bulk_update(batch, ['description_html'])
+                batch = []
+        if batch:
+            rendered += Product.objects.bulk_update(batch, ['description_html'])
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} product descriptions'))
@@ -0,0 +1,55 @@
+# management/commands/run_fake_bkash.py
+from django.core.management.base import BaseCommand, CommandError
+
+from store.fake_bkash import ENDPOINTS, FakeBkashGateway
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve a fake bKash tokenized checkout API for local development and '
+        'load tests; point BKASH_BASE_URL at it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Seconds to wait before each response')
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help='Up to this many extra seconds, at random')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of calls answered with --error-status')
+        parser.add_argument('--error-status', type=int, default=503)
+        parser.add_argument('--status-code', action='append', default=[],
+                            metavar='ENDPOINT=CODE',
+                            help='Always answer ENDPOINT with this bKash statusCode, '
+                                 'e.g. execute=2023; may be repeated')
+        parser.add_argument('--seed', type=int)
+
+    def parse_status_codes(self, values):
+        endpoints = set(ENDPOINTS.values())
+        codes = {}
+        for value in values:
+            endpoint, _, code = value.partition('=')
+            if endpoint not in endpoints or not code:
+                raise CommandError(
+                    f"Bad --status-code {value!r}; use one of {', '.join(sorted(endpoints))}=CODE"
+                )
+            codes[endpoint] = code
+        return codes
+
+    def handle(self, *args, **options):
+        gateway = FakeBkashGateway(
+            host=options['host'], port=options['port'],
+            latency=options['latency'], jitter=options['jitter'],
+            error_rate=options['error_rate'], error_status=options['error_status'],
+            status_codes=self.parse_status_codes(options['status_code']),
+            seed=options['seed'],
+        )
+        self.stdout.write(f'Fake bKash gateway on {gateway.url}; set BKASH_BASE_URL={gateway.url}')
+        try:
+            gateway.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.server.server_close()
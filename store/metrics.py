@@ -0,0 +1,135 @@
+"""Prometheus metrics for bKash gateway calls and store views.
+
+Every worker process writes its samples to memory-mapped files in
+``METRICS_DIR`` (prometheus_client's multiprocess mode) and ``/metrics``
+merges the files of all workers, so one scrape covers the whole server.
+Empty the directory before the server starts; under gunicorn also call
+``mark_process_dead(worker.pid)`` from the ``child_exit`` hook so a dead
+worker's in-flight gauges go away with it.
+
+prometheus_client only uses multiprocess mode if ``PROMETHEUS_MULTIPROC_DIR``
+is set when it is first imported; ``StoreConfig.ready()`` sets it from
+``METRICS_DIR`` unless the environment already does.
+"""
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+mark_process_dead = multiprocess.mark_process_dead
+
+GATEWAY_ENDPOINTS = {
+    '/tokenized/checkout/token/grant': 'grant',
+    '/tokenized/checkout/token/refresh': 'refresh',
+    '/tokenized/checkout/create': 'create',
+    '/tokenized/checkout/execute': 'execute',
+    '/tokenized/checkout/payment/status': 'query',
+}
+
+GATEWAY_LATENCY = Histogram(
+    'bkash_request_duration_seconds', 'bKash API call latency, retries included',
+    ['endpoint'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+GATEWAY_ERRORS = Counter(
+    'bkash_request_errors_total',
+    'Failed bKash API calls by reason: connection, http_<status> or bkash_<statusCode>',
+    ['endpoint', 'reason'],
+)
+GATEWAY_IN_FLIGHT = Gauge(
+    'bkash_requests_in_flight', 'bKash API calls waiting for a response',
+    ['endpoint'], multiprocess_mode='livesum',
+)
+BREAKER_TRANSITIONS = Counter(
+    'bkash_circuit_transitions_total', 'bKash circuit breaker state changes', ['state'],
+)
+BREAKER_REJECTIONS = Counter(
+    'bkash_circuit_rejections_total', 'Payments refused while the bKash circuit was open',
+)
+REQUEST_LATENCY = Histogram(
+    'store_request_duration_seconds', 'Store request latency by URL name',
+    ['view', 'method', 'status'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+# Only observed with QUERY_STATS=True (store.query_stats)
+REQUEST_QUERIES = Histogram(
+    'store_request_db_queries', 'Database statements per request by URL name', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_DB_TIME = Histogram(
+    'store_request_db_seconds', 'Database time per request by URL name', ['view'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class GatewayCall:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def fail(self, reason):
+        GATEWAY_ERRORS.labels(self.endpoint, reason).inc()
+
+    def check(self, response):
+        """Count an HTTP error or a bKash error code in a ``requests``/``httpx`` response"""
+        if response.status_code >= 400:
+            return self.fail(f'http_{response.status_code}')
+        try:
+            code = response.json().get('statusCode')
+        except (ValueError, AttributeError):
+            return
+        if code and code != '0000':
+            self.fail(f'bkash_{code}')
+
+
+@contextmanager
+def gateway_call(path):
+    """Time one bKash API call and count it as in flight meanwhile"""
+    endpoint = GATEWAY_ENDPOINTS.get(path, 'other')
+    in_flight = GATEWAY_IN_FLIGHT.labels(endpoint)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield GatewayCall(endpoint)
+    finally:
+        GATEWAY_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+        in_flight.dec()
+
+
+def observe_request(view, method, status, seconds):
+    REQUEST_LATENCY.labels(view, method, f'{status // 100}xx').observe(seconds)
+
+
+def observe_queries(view, count, seconds):
+    REQUEST_QUERIES.labels(view).observe(count)
+    REQUEST_DB_TIME.labels(view).observe(seconds)
+
+
+class BreakerStateCollector:
+    """The shared circuit breaker state, read from the database at scrape time"""
+
+    def collect(self):
+        from .bkash_service import CircuitBreaker  # which imports this module
+
+        breaker = CircuitBreaker()
+        current = breaker.state()
+        family = GaugeMetricFamily(
+            'bkash_circuit_state', 'bKash circuit breaker state; 1 for the current one',
+            labels=['state'],
+        )
+        for state in (breaker.CLOSED, breaker.HALF_OPEN, breaker.OPEN):
+            family.add_metric([state], 1 if state == current else 0)
+        yield family
+
+
+def render():
+    """All workers' metrics in the Prometheus text format"""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(BreakerStateCollector())
+    return generate_latest(registry)
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,131 @@
+import cProfile
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from . import metrics, profiling, query_stats
+
+
+class HybridMiddleware:
+    """Base for middleware that runs natively under both WSGI and ASGI
+
+    Under ASGI the handler passes a coroutine ``get_response`` and awaits
+    ``__acall__``, so a request does not cross into a thread on its way
+    through the middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Observe request latency per URL name for ``/metrics``"""
+
+    def process(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    def observe(self, request, response, start):
+        match = request.resolver_match
+        metrics.observe_request(
+            match.view_name if match else 'unresolved', request.method,
+            response.status_code, time.perf_counter() - start,
+        )
+
+
+class QueryStatsMiddleware(HybridMiddleware):
+    """Record query count, DB time and slowest statements per URL name
+
+    Opt-in with ``QUERY_STATS=True``; otherwise Django drops the middleware
+    at startup and requests pay nothing.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_STATS:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        if iscoroutinefunction(self):
+            connection_created.connect(
+                query_stats.install_on_connect, dispatch_uid='query_stats_install',
+            )
+
+    def process(self, request):
+        recorder = query_stats.QueryRecorder(request=request)
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.record(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = query_stats.QueryRecorder(request=request)
+        with query_stats.recording(recorder):
+            response = await self.get_response(request)
+        self.record(request, recorder)
+        return response
+
+    def record(self, request, recorder):
+        query_stats.record(query_stats.route_name(request), recorder)
+
+
+class RequestProfileMiddleware(HybridMiddleware):
+    """Profile one request for a staff user who asks with ``?_profile`` or ``X-Profile``
+
+    Everything below this middleware, view and template rendering included,
+    runs under ``cProfile``; see ``store.profiling`` for the output. Requests
+    that do not ask only pay for two dictionary lookups. Under ASGI the
+    profiler sees the event loop thread only: work a view hands to
+    ``sync_to_async`` is timed but not broken down, and other requests
+    running on the loop meanwhile show up in the profile.
+    """
+
+    def process(self, request):
+        if not profiling.is_requested(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.save(profiler, request, response, start)
+
+    async def __acall__(self, request):
+        if not await profiling.ais_requested(request):
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.save(profiler, request, response, start)
+
+    def save(self, profiler, request, response, start):
+        path = profiling.save_profile(profiler, request, time.perf_counter() - start)
+        response['X-Profile'] = path.stem
+        return response
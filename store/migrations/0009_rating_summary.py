@@ -0,0 +1,64 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    Product = apps.get_model("store", "Product")
+    Review = apps.get_model("store", "Review")
+    RatingSummary = apps.get_model("store", "RatingSummary")
+
+    summaries = {
+        pk: RatingSummary(product_id=pk)
+        for pk in Product.objects.values_list("pk", flat=True)
+    }
+    rows = (
+        Review.objects.filter(status="approved")
+        .values("product_id", "rating")
+        .annotate(n=models.Count("id"))
+        .order_by()
+    )
+    for row in rows:
+        summary = summaries[row["product_id"]]
+        summary.count += row["n"]
+        summary.total += row["n"] * row["rating"]
+        setattr(summary, f"star_{row['rating']}", row["n"])
+    RatingSummary.objects.bulk_create(summaries.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0008_remove_product_pdf_file_product_drive_link"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RatingSummary",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="rating_summary",
+                        serialize=False,
+                        to="store.product",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("total", models.PositiveIntegerField(default=0)),
+                ("star_1", models.PositiveIntegerField(default=0)),
+                ("star_2", models.PositiveIntegerField(default=0)),
+                ("star_3", models.PositiveIntegerField(default=0)),
+                ("star_4", models.PositiveIntegerField(default=0)),
+                ("star_5", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Rating Summary",
+                "verbose_name_plural": "Rating Summaries",
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    Product = apps.get_model("store", "Product")
+    Order = apps.get_model("store", "Order")
+    StoreCounter = apps.get_model("store", "StoreCounter")
+
+    StoreCounter.objects.bulk_create(
+        [
+            StoreCounter(name="products", value=Product.objects.count()),
+            StoreCounter(
+                name="customers",
+                value=Order.objects.values("email").distinct().count(),
+            ),
+            StoreCounter(
+                name="paid_orders", value=Order.objects.filter(status="paid").count()
+            ),
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0009_rating_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoreCounter",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F
+
+
+def backfill_paid_at(apps, schema_editor):
+    Order = apps.get_model("store", "Order")
+    Order.objects.filter(status="paid", paid_at__isnull=True).update(
+        paid_at=F("updated_at")
+    )
+
+
+def build_all_time_ranking(apps, schema_editor):
+    Order = apps.get_model("store", "Order")
+    BestsellerRank = apps.get_model("store", "BestsellerRank")
+    rows = (
+        Order.objects.filter(status="paid")
+        .values("product_id", "product__category_id")
+        .annotate(sales=models.Count("id"))
+        .order_by()
+    )
+    BestsellerRank.objects.bulk_create(
+        [
+            BestsellerRank(
+                window="all",
+                product_id=row["product_id"],
+                category_id=row["product__category_id"],
+                sales=row["sales"],
+            )
+            for row in rows
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0010_store_counter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="paid_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="BestsellerRank",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "window",
+                    models.CharField(
+                        choices=[
+                            ("all", "All time"),
+                            ("30d", "Last 30 days"),
+                            ("7d", "Last 7 days"),
+                        ],
+                        max_length=3,
+                    ),
+                ),
+                ("sales", models.PositiveIntegerField(default=0)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="store.category",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bestseller_ranks",
+                        to="store.product",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["window", "category", "-sales"],
+                        name="store_bests_window_487ed8_idx",
+                    )
+                ],
+                "unique_together": {("window", "product")},
+            },
+        ),
+        migrations.RunPython(backfill_paid_at, migrations.RunPython.noop),
+        migrations.RunPython(build_all_time_ranking, migrations.RunPython.noop),
+    ]
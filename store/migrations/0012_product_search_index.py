@@ -0,0 +1,63 @@
+import unicodedata
+
+from django.db import migrations
+
+BENGALI_TOKENCHARS = "".join(
+    chr(c)
+    for c in range(0x0980, 0x0A00)
+    if unicodedata.category(chr(c)) in ("Mn", "Mc")
+) + "\u200c\u200d"
+
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, COALESCE(title, '')), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, COALESCE(author, '')), 'B') || "
+    "setweight(to_tsvector('simple'::regconfig, COALESCE(description, '')), 'C')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        Product = apps.get_model("store", "Product")
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts USING fts5("
+            "title, author, description, "
+            "tokenize = \"unicode61 remove_diacritics 2 tokenchars '%s'\")"
+            % BENGALI_TOKENCHARS
+        )
+        rows = [
+            tuple(unicodedata.normalize("NFC", value or "") for value in row[1:])
+            + (row[0],)
+            for row in Product.objects.values_list(
+                "pk", "title", "author", "description"
+            )
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO store_product_fts (title, author, description, rowid) "
+                "VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS store_product_search_idx "
+            "ON store_product USING GIN ((%s))" % PG_SEARCH_VECTOR
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS store_product_fts")
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS store_product_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0011_bestseller_rank"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
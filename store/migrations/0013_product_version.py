@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0012_product_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
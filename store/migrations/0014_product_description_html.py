@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0013_product_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="description_html",
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0014_product_description_html"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(fields=["-created_at"], name="review_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["status", "-created_at"], name="review_status_created_idx"
+            ),
+        ),
+    ]
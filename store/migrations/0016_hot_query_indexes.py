@@ -0,0 +1,46 @@
+# Generated by Django 4.2.23 on 2026-10-18 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0015_review_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["bkash_payment_id"], name="order_bkash_payment_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["email"], name="order_email_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "paid_at"], name="order_status_paid_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["created_at"], name="product_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "created_at"], name="product_category_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "status", "created_at"],
+                name="review_product_status_idx",
+            ),
+        ),
+    ]
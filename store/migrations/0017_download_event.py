@@ -0,0 +1,43 @@
+# Generated by Django 4.2.23 on 2026-10-18 05:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0016_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DownloadEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="download_events",
+                        to="store.order",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["created_at"], name="download_created_idx")
+                ],
+            },
+        ),
+    ]
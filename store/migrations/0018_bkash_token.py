@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-18 05:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0017_download_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BkashToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("id_token", models.TextField(blank=True)),
+                ("refresh_token", models.TextField(blank=True)),
+                ("expires_at", models.FloatField(default=0)),
+                ("lease_owner", models.CharField(blank=True, max_length=32)),
+                ("lease_until", models.FloatField(default=0)),
+            ],
+            options={
+                "verbose_name": "bKash Token",
+                "verbose_name_plural": "bKash Tokens",
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.23 on 2026-10-18 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0018_bkash_token"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CircuitBreakerBucket",
+            fields=[
+                (
+                    "slot",
+                    models.PositiveSmallIntegerField(primary_key=True, serialize=False),
+                ),
+                ("generation", models.PositiveIntegerField(default=0)),
+                ("bucket", models.BigIntegerField(default=0)),
+                ("calls", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Circuit Breaker Bucket",
+                "verbose_name_plural": "Circuit Breaker Buckets",
+            },
+        ),
+        migrations.CreateModel(
+            name="CircuitBreakerState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("state", models.CharField(max_length=10)),
+                ("generation", models.PositiveIntegerField(default=0)),
+                ("since", models.FloatField(default=0)),
+                ("probe_until", models.FloatField(default=0)),
+            ],
+            options={
+                "verbose_name": "Circuit Breaker State",
+                "verbose_name_plural": "Circuit Breaker States",
+            },
+        ),
+    ]
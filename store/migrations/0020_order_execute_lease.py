@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0019_circuit_breaker"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="execute_lease_until",
+            field=models.FloatField(default=0, editable=False),
+        ),
+    ]
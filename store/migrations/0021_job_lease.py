@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0020_order_execute_lease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobLease",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("owner", models.CharField(blank=True, max_length=32)),
+                ("until", models.FloatField(default=0)),
+            ],
+            options={
+                "verbose_name": "Job Lease",
+                "verbose_name_plural": "Job Leases",
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# 0011 only built the all-time ranking
+WINDOW_DAYS = {"30d": 30, "7d": 7}
+
+
+def build_windowed_rankings(apps, schema_editor):
+    Order = apps.get_model("store", "Order")
+    BestsellerRank = apps.get_model("store", "BestsellerRank")
+    now = timezone.now()
+    for window, days in WINDOW_DAYS.items():
+        rows = (
+            Order.objects.filter(status="paid", paid_at__gte=now - timedelta(days=days))
+            .values("product_id", "product__category_id")
+            .annotate(sales=models.Count("id"))
+            .order_by()
+        )
+        BestsellerRank.objects.filter(window=window).delete()
+        BestsellerRank.objects.bulk_create(
+            [
+                BestsellerRank(
+                    window=window,
+                    product_id=row["product_id"],
+                    category_id=row["product__category_id"],
+                    sales=row["sales"],
+                )
+                for row in rows
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0021_job_lease"),
+    ]
+
+    operations = [
+        migrations.RunPython(build_windowed_rankings, migrations.RunPython.noop),
+    ]
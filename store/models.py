@@ -1,9 +1,18 @@
-from django.db import models
+import time
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Exists, F, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round, Substr
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 import uuid
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import linebreaks
 
 class Category(models.Model):
     name = models.CharField(_("Category Name"), max_length=100)
@@ -16,10 +25,57 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+STARS = '★★★★★☆☆☆☆☆'
+MAX_ID_BATCH = 30000
+
+
+def id_batches(ids):
+    """Slices of ``ids`` small enough for one ``pk__in``
+
+    SQLite allows 999 parameters per statement; some are left over for the
+    rest of the query.
+    """
+    ids = list(ids)
+    limit = connection.features.max_query_params
+    size = min(limit - 99, MAX_ID_BATCH) if limit else MAX_ID_BATCH
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def star_string(average):
+    """Five-character star bar for an average rating, rounded half up"""
+    filled = int(Decimal(str(average)).quantize(Decimal('1'), ROUND_HALF_UP))
+    return STARS[5 - filled:10 - filled]
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_rating_stats(self):
+        """Annotate rating average, count and star bar from the rating summary
+
+        The annotations are picked up by the ``Product`` rating methods, so
+        listings render ratings without a query per product.
+        """
+        average = Round(
+            Cast(
+                Cast('rating_summary__total', models.FloatField())
+                / NullIf('rating_summary__count', 0),
+                models.DecimalField(max_digits=6, decimal_places=3),
+            ),
+            1,
+        )
+        filled = Coalesce(Cast(Round(average), models.IntegerField()), 0)
+        return self.annotate(
+            rating_count=Coalesce('rating_summary__count', 0),
+            rating_average=Coalesce(Cast(average, models.FloatField()), 0.0),
+            rating_stars=Substr(Value(STARS), 6 - filled, 5),
+        )
+
+
 class Product(models.Model):
     title = models.CharField(_("Title"), max_length=200)
     author = models.CharField(_("Author"), max_length=100)
     description = models.TextField(_("Description"))
+    description_html = models.TextField(blank=True, editable=False)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name=_("Category"))
     original_price = models.DecimalField(_("original_price"), max_digits=10, decimal_places=2, default=500)
     price = models.DecimalField(_("price"), max_digits=10, decimal_places=2)
@@ -27,38 +83,236 @@ class Product(models.Model):
     sample_pdf_file = models.FileField(_(" Sample PDF File"), upload_to='sample_pdfs/')
     thumbnail = models.ImageField(_("Thumbnail(250pxX200px)"), upload_to='thumbnails/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = ProductQuerySet.as_manager()
     
     class Meta:
         verbose_name = _("Ebook")
         verbose_name_plural = _("Ebooks")
+        indexes = [
+            # Ascending, so a backwards walk also yields the ``-pk`` tie-break
+            # of the cursor paginator without a sort.
+            models.Index(fields=['created_at'], name='product_created_idx'),
+            models.Index(fields=['category', 'created_at'], name='product_category_created_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What description_html was rendered from, unless the field was deferred
+        instance._rendered_description = instance.__dict__.get('description')
+        return instance
+
+    def render_description(self):
+        """Markdown description as sanitized HTML, with line breaks applied"""
+        from markdownify.templatetags.markdownify import markdownify
+        return linebreaks(markdownify(self.description))
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        rendered = False
+        if (update_fields is None or 'description' in update_fields) and (
+            self.description != getattr(self, '_rendered_description', None)
+        ):
+            self.description_html = self.render_description()
+            rendered = True
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'description_html'}
+        adding = self._state.adding
+        if not adding:
+            # Bump in the same UPDATE: writing back the version read earlier
+            # could undo a concurrent bump and revive stale cache entries.
+            version, self.version = self.version, F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        with transaction.atomic():
+            try:
+                super().save(*args, **kwargs)
+            except Exception:
+                if not adding:
+                    self.version = version
+                raise
+            if adding:
+                StoreCounter.add(StoreCounter.PRODUCTS, 1)
+            else:
+                self.refresh_from_db(fields=['version'])
+        if rendered:
+            self._rendered_description = self.description
+
+    @staticmethod
+    def bump_versions(product_ids):
+        """Invalidate cached renderings (e.g. product cards) of these products
+
+        ``None`` invalidates every product in one statement.
+        """
+        if product_ids is None:
+            Product.objects.update(version=F('version') + 1)
+            return
+        for batch in id_batches(product_ids):
+            Product.objects.filter(pk__in=batch).update(version=F('version') + 1)
+
+    def _get_rating_summary(self):
+        try:
+            return self.rating_summary
+        except RatingSummary.DoesNotExist:
+            return RatingSummary(product=self)
+
     def get_average_rating(self):
-        """Calculate average rating from approved reviews"""
-        approved_reviews = self.reviews.filter(status='approved')
-        if approved_reviews.exists():
-            return round(approved_reviews.aggregate(
-                models.Avg('rating')
-            )['rating__avg'], 1)
-        return 0
+        """Average rating of approved reviews"""
+        if 'rating_average' in self.__dict__:
+            return self.rating_average or 0
+        return self._get_rating_summary().average
 
     def get_star_display(self):
         """Return stars for template display"""
-        return '★' * round(self.get_average_rating()) + '☆' * (5 - round(self.get_average_rating()))
+        if 'rating_stars' in self.__dict__:
+            return self.rating_stars
+        return star_string(self.get_average_rating())
 
     def get_rating_count(self):
         """Get count of approved reviews"""
-        return self.reviews.filter(status='approved').count()
+        if 'rating_count' in self.__dict__:
+            return self.rating_count
+        return self._get_rating_summary().count
     
     def get_rating_distribution(self):
         """Get distribution of ratings"""
-        approved_reviews = self.reviews.filter(status='approved')
-        distribution = {}
-        for i in range(1, 6):
-            distribution[i] = approved_reviews.filter(rating=i).count()
-        return distribution
+        return self._get_rating_summary().distribution
+
+
+class RatingSummary(models.Model):
+    """Denormalized rating totals of a product's approved reviews.
+
+    Kept in step by ``Review.save``, the review ``post_delete`` signal and
+    ``ReviewQuerySet.set_status``; ``rebuild_rating_summaries`` repairs drift.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary'
+    )
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    star_1 = models.PositiveIntegerField(default=0)
+    star_2 = models.PositiveIntegerField(default=0)
+    star_3 = models.PositiveIntegerField(default=0)
+    star_4 = models.PositiveIntegerField(default=0)
+    star_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Rating Summary")
+        verbose_name_plural = _("Rating Summaries")
+
+    def __str__(self):
+        return f'{self.product_id}: {self.average} ({self.count})'
+
+    @property
+    def average(self):
+        if not self.count:
+            return 0
+        average = Decimal(self.total) / Decimal(self.count)
+        return float(average.quantize(Decimal('0.1'), ROUND_HALF_UP))
+
+    @property
+    def distribution(self):
+        return {i: getattr(self, f'star_{i}') for i in range(1, 6)}
+
+    @classmethod
+    def apply_changes(cls, changes, create_missing=True):
+        """Apply ``(product_id, rating, +1/-1)`` changes to the summaries
+
+        Must run inside the transaction that changed the reviews.
+        """
+        deltas = {}
+        for product_id, rating, sign in changes:
+            delta = deltas.setdefault(product_id, {'count': 0, 'total': 0})
+            delta['count'] += sign
+            delta['total'] += sign * rating
+            delta[f'star_{rating}'] = delta.get(f'star_{rating}', 0) + sign
+
+        for product_id, delta in deltas.items():
+            delta = {field: value for field, value in delta.items() if value}
+            if not delta:
+                continue
+            updated = cls.objects.filter(product_id=product_id).update(
+                **{field: F(field) + value for field, value in delta.items()}
+            )
+            if not updated and create_missing:
+                cls.rebuild([product_id])
+        Product.bump_versions(list(deltas))
+        Review.bump_page_versions(list(deltas))
+
+    @classmethod
+    def rebuild(cls, product_ids=None):
+        """Recompute summaries from approved reviews; returns the number rebuilt"""
+        if product_ids is None:
+            # A full rebuild filters nothing by id, so it fits in a handful
+            # of statements however large the catalog is.
+            with transaction.atomic():
+                summaries = cls._summarize(
+                    Product.objects.values_list('pk', flat=True),
+                    Review.objects.filter(status='approved'),
+                )
+                cls.objects.all().delete()
+                cls.objects.bulk_create(summaries)
+                Product.bump_versions(None)
+                Review.bump_page_versions(None)
+            return len(summaries)
+
+        rebuilt = 0
+        with transaction.atomic():
+            for batch in id_batches(set(product_ids)):
+                summaries = cls._summarize(
+                    Product.objects.filter(pk__in=batch).values_list('pk', flat=True),
+                    Review.objects.filter(status='approved', product_id__in=batch),
+                )
+                batch = [summary.product_id for summary in summaries]
+                cls.objects.filter(product_id__in=batch).delete()
+                cls.objects.bulk_create(summaries)
+                Product.bump_versions(batch)
+                Review.bump_page_versions(batch)
+                rebuilt += len(summaries)
+        return rebuilt
+
+    @classmethod
+    def _summarize(cls, product_ids, reviews):
+        """Unsaved summaries of ``product_ids`` counting ``reviews``"""
+        rows = reviews.values('product_id', 'rating').annotate(n=models.Count('id')).order_by()
+        summaries = {pk: cls(product_id=pk) for pk in product_ids}
+        for row in rows:
+            summary = summaries.get(row['product_id'])
+            if summary is None:  # product created after the id list was read
+                continue
+            summary.count += row['n']
+            summary.total += row['n'] * row['rating']
+            setattr(summary, f"star_{row['rating']}", row['n'])
+        return list(summaries.values())
+
+
+class ReviewQuerySet(models.QuerySet):
+    def set_status(self, status, **fields):
+        """Bulk status change that keeps rating summaries in step"""
+        with transaction.atomic():
+            rows = list(
+                self.exclude(status=status)
+                .select_for_update()
+                .values_list('pk', 'product_id', 'rating', 'status')
+            )
+            if not rows:
+                return 0
+            updated = self.model.objects.filter(pk__in=[row[0] for row in rows]).update(
+                status=status, **fields
+            )
+            changes = []
+            for pk, product_id, rating, old_status in rows:
+                if old_status == 'approved':
+                    changes.append((product_id, rating, -1))
+                if status == 'approved':
+                    changes.append((product_id, rating, 1))
+            RatingSummary.apply_changes(changes)
+        return updated
 
 class Review(models.Model):
     RATING_CHOICES = [
@@ -96,9 +350,22 @@ class Review(models.Model):
         related_name='approved_reviews'
     )
     
+    objects = ReviewQuerySet.as_manager()
+
+    PAGE_VERSION_KEY = 'review_page_version:{}'
+    PAGE_GENERATION_KEY = 'review_page_generation'
+    PAGE_VERSION_TIMEOUT = 60 * 60 * 24 * 7  # a lost stamp only costs one rebuild per page
+
     class Meta:
         ordering = ['-created_at']
         unique_together = ['product', 'email']  # One review per user per product
+        indexes = [
+            models.Index(fields=['-created_at'], name='review_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='review_status_created_idx'),
+            models.Index(
+                fields=['product', 'status', 'created_at'], name='review_product_status_idx'
+            ),
+        ]
         
     def __str__(self):
         return f'{self.name} - {self.product.title} ({self.rating}/5)'
@@ -106,12 +373,60 @@ class Review(models.Model):
     def get_star_display(self):
         """Return stars for template display"""
         return '★' * self.rating + '☆' * (5 - self.rating)
+
+    @classmethod
+    def page_version(cls, product_id):
+        """Stamp of a product's approved reviews, shared by all workers; None if no such product
+
+        A stamp is only created for a product that exists, so made-up ids
+        cannot fill the cache with keys.
+        """
+        keys = [cls.PAGE_GENERATION_KEY, cls.PAGE_VERSION_KEY.format(product_id)]
+        stamps = cache.get_many(keys)
+        if keys[1] not in stamps and not Product.objects.filter(pk=product_id).exists():
+            return None
+        return '.'.join(
+            stamps.get(key)
+            or cache.get_or_set(key, lambda: uuid.uuid4().hex, cls.PAGE_VERSION_TIMEOUT)
+            for key in keys
+        )
+
+    @classmethod
+    def bump_page_versions(cls, product_ids):
+        """Invalidate cached review pages once the current transaction commits
+
+        ``None`` invalidates every product at once, without a key per product.
+        """
+        if product_ids is None:
+            keys = [cls.PAGE_GENERATION_KEY]
+        else:
+            keys = [cls.PAGE_VERSION_KEY.format(pk) for pk in product_ids]
+        if keys:
+            transaction.on_commit(
+                lambda: cache.set_many(
+                    {key: uuid.uuid4().hex for key in keys}, cls.PAGE_VERSION_TIMEOUT
+                )
+            )
     
     def save(self, *args, **kwargs):
         if self.status == 'approved' and not self.approved_at:
-            from django.utils import timezone
             self.approved_at = timezone.now()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = (
+                    Review.objects.filter(pk=self.pk)
+                    .select_for_update()
+                    .values('product_id', 'rating', 'status')
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            changes = []
+            if previous and previous['status'] == 'approved':
+                changes.append((previous['product_id'], previous['rating'], -1))
+            if self.status == 'approved':
+                changes.append((self.product_id, self.rating, 1))
+            RatingSummary.apply_changes(changes)
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -130,8 +445,472 @@ class Order(models.Model):
     bkash_payment_id = models.CharField(max_length=100, blank=True, null=True)
     trx_id = models.CharField(max_length=100, blank=True, null=True)
     downloads = models.IntegerField(default=0)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    # Unix time until which one request holds the right to execute the payment
+    execute_lease_until = models.FloatField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bkash_payment_id'], name='order_bkash_payment_idx'),
+            models.Index(fields=['email'], name='order_email_idx'),
+            models.Index(fields=['status', 'paid_at'], name='order_status_paid_idx'),
+        ]
     
     def __str__(self):
-        return f"Order {self.id} - {self.email}"
\ No newline at end of file
+        return f"Order {self.id} - {self.email}"
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            previous_status = None
+            adding = self._state.adding
+            if not adding and (update_fields is None or 'status' in update_fields):
+                previous_status = (
+                    Order.objects.filter(pk=self.pk)
+                    .select_for_update()
+                    .values_list('status', flat=True)
+                    .first()
+                )
+            elif not adding:
+                previous_status = self.status  # not being saved, so not changing
+            becomes_paid = self.status == 'paid' and previous_status != 'paid'
+            if becomes_paid and not self.paid_at:
+                self.paid_at = timezone.now()
+            # Write before reading on inserts: on SQLite a transaction that
+            # reads first cannot wait for another writer's lock.
+            super().save(*args, **kwargs)
+            if adding:
+                StoreCounter.add_customer(self)
+            if becomes_paid:
+                StoreCounter.add(StoreCounter.PAID_ORDERS, 1)
+                BestsellerRank.record_sale(self, 1)
+            elif previous_status == 'paid' and self.status != 'paid':
+                StoreCounter.add(StoreCounter.PAID_ORDERS, -1)
+                BestsellerRank.record_sale(self, -1)
+
+    @classmethod
+    def claim_execution(cls, payment_id, seconds):
+        """Take the lease on executing the pending ``payment_id``; its expiry, or None
+
+        One conditional UPDATE, atomic on every database backend, so of
+        concurrent callbacks for one payment only one calls bKash.
+        """
+        if not payment_id:
+            raise ValueError('A payment id is required')
+        now = time.time()
+        until = now + seconds
+        claimed = cls.objects.filter(
+            bkash_payment_id=payment_id, status='pending', execute_lease_until__lte=now,
+        ).update(execute_lease_until=until)
+        return until if claimed else None
+
+    @classmethod
+    def release_execution(cls, payment_id, until):
+        """Give up the lease taken by ``claim_execution``, unless it already expired"""
+        cls.objects.filter(
+            bkash_payment_id=payment_id, execute_lease_until=until,
+        ).update(execute_lease_until=0)
+
+    @classmethod
+    def execution_leased(cls, payment_id):
+        """Whether a request is executing the pending ``payment_id`` right now"""
+        return cls.objects.filter(
+            bkash_payment_id=payment_id, status='pending', execute_lease_until__gt=time.time(),
+        ).exists()
+
+    @classmethod
+    def mark_paid(cls, payment_id, trx_id):
+        """Move the pending order for ``payment_id`` to paid; False if it was not pending
+
+        A single conditional UPDATE instead of ``save()``, so concurrent
+        callbacks for one payment cannot both count the sale.
+        """
+        if not payment_id:
+            raise ValueError('A payment id is required')
+        now = timezone.now()
+        with transaction.atomic():
+            updated = cls.objects.filter(bkash_payment_id=payment_id, status='pending').update(
+                status='paid', trx_id=trx_id, paid_at=now, updated_at=now,
+            )
+            if not updated:
+                return False
+            StoreCounter.add(StoreCounter.PAID_ORDERS, updated)
+            for order in cls.objects.filter(bkash_payment_id=payment_id, paid_at=now).only(
+                'product_id', 'paid_at'
+            ):
+                BestsellerRank.record_sale(order, 1)
+        return True
+
+
+class DownloadEvent(models.Model):
+    """One eBook download; append-only, written in bulk by ``DownloadEvent.record``"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='download_events')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='download_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Download of {self.order_id} at {self.created_at}'
+
+    @classmethod
+    def record(cls, downloads):
+        """Store ``(order_id, downloaded_at)`` pairs in one short transaction
+
+        ``Order.downloads`` goes up with a single ``F()`` UPDATE for all the
+        orders, so concurrent writers never lose a click, and the events are
+        inserted with one ``bulk_create``.
+        """
+        if not downloads:
+            return
+        per_order = {}
+        for order_id, _downloaded_at in downloads:
+            per_order[order_id] = per_order.get(order_id, 0) + 1
+        by_count = {}
+        for order_id, count in per_order.items():
+            by_count.setdefault(count, []).append(order_id)
+        with transaction.atomic():
+            Order.objects.filter(pk__in=per_order).update(downloads=models.Case(
+                *[models.When(pk__in=order_ids, then=F('downloads') + count)
+                  for count, order_ids in by_count.items()],
+                default=F('downloads'),
+            ))
+            cls.objects.bulk_create(
+                [cls(order_id=order_id, created_at=at) for order_id, at in downloads],
+                batch_size=500,
+            )
+
+
+class StoreCounter(models.Model):
+    """Materialized storefront statistics shown on the home page
+
+    Counters move in the same transaction as the rows they count:
+    ``Product.save``, ``Order.save`` and the delete signals. Deleting an
+    order does not lower the customer count, since other orders may share
+    its email; ``reconcile_store_counters`` recomputes the exact values.
+    """
+    PRODUCTS = 'products'
+    CUSTOMERS = 'customers'
+    PAID_ORDERS = 'paid_orders'
+    CACHE_KEY = 'store_counters'
+    CACHE_TIMEOUT = 30
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+    @classmethod
+    def add(cls, name, delta):
+        counter = cls.objects.filter(name=name)
+        if not counter.update(value=F('value') + delta):
+            # First use: start from the exact count, which already includes
+            # this change, unless a concurrent first use just started it.
+            cls.objects.bulk_create(
+                [cls(name=name, value=cls.compute_exact()[name] - delta)], ignore_conflicts=True,
+            )
+            counter.update(value=F('value') + delta)
+        transaction.on_commit(lambda: cache.delete(cls.CACHE_KEY))
+
+    @classmethod
+    def add_customer(cls, order):
+        """Count the just-inserted ``order``'s email, unless another order has it
+
+        The counter row is locked first, so concurrent first orders take
+        turns; the increment is then a single UPDATE ... WHERE NOT EXISTS
+        over the orders, which sees the committed order of the one before.
+        """
+        counter = cls.objects.filter(name=cls.CUSTOMERS)
+        if counter.select_for_update().values_list('value', flat=True).first() is None:
+            cls.add(cls.CUSTOMERS, 0)  # the exact count already includes this order
+            return
+        others = Order.objects.filter(email=order.email).exclude(pk=order.pk)
+        if counter.filter(~Exists(others)).update(value=F('value') + 1):
+            transaction.on_commit(lambda: cache.delete(cls.CACHE_KEY))
+
+    @classmethod
+    def compute_exact(cls):
+        return {
+            cls.PRODUCTS: Product.objects.count(),
+            cls.CUSTOMERS: Order.objects.values('email').distinct().count(),
+            cls.PAID_ORDERS: Order.objects.filter(status='paid').count(),
+        }
+
+    @classmethod
+    def snapshot(cls):
+        """Current counter values, served from a short-lived cache"""
+        counters = cache.get(cls.CACHE_KEY)
+        if counters is None:
+            counters = dict.fromkeys([cls.PRODUCTS, cls.CUSTOMERS, cls.PAID_ORDERS], 0)
+            counters.update(cls.objects.values_list('name', 'value'))
+            cache.set(cls.CACHE_KEY, counters, cls.CACHE_TIMEOUT)
+        return counters
+
+    @classmethod
+    def reconcile(cls):
+        """Overwrite the counters with exact values; returns ``{name: (old, new)}``"""
+        with transaction.atomic():
+            current = dict(cls.objects.select_for_update().values_list('name', 'value'))
+            exact = cls.compute_exact()
+            for name, value in exact.items():
+                cls.objects.update_or_create(name=name, defaults={'value': value})
+        cache.delete(cls.CACHE_KEY)
+        return {name: (current.get(name), value) for name, value in exact.items()}
+
+
+class BestsellerRank(models.Model):
+    """Precomputed paid-order sales per product and time window
+
+    ``Order.save`` bumps the rows when an order becomes paid; the
+    ``refresh_bestsellers`` command recomputes them on a schedule, which
+    also ages sales out of the 30 and 7 day windows.
+    """
+    ALL_TIME = 'all'
+    WINDOW_CHOICES = [
+        (ALL_TIME, _('All time')),
+        ('30d', _('Last 30 days')),
+        ('7d', _('Last 7 days')),
+    ]
+    WINDOW_DAYS = {ALL_TIME: None, '30d': 30, '7d': 7}
+
+    window = models.CharField(max_length=3, choices=WINDOW_CHOICES)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='bestseller_ranks')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    sales = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['window', 'product']
+        indexes = [models.Index(fields=['window', 'category', '-sales'])]
+
+    def __str__(self):
+        return f'{self.product_id} ({self.window}): {self.sales}'
+
+    @classmethod
+    def window_start(cls, window, now=None):
+        days = cls.WINDOW_DAYS[window]
+        if days is None:
+            return None
+        return (now or timezone.now()) - timedelta(days=days)
+
+    @classmethod
+    def record_sale(cls, order, delta):
+        """Add ``delta`` sales of ``order.product`` to every window covering its payment"""
+        for window in cls.WINDOW_DAYS:
+            start = cls.window_start(window)
+            if start is not None and (order.paid_at is None or order.paid_at < start):
+                continue
+            ranks = cls.objects.filter(window=window, product_id=order.product_id)
+            if delta < 0:
+                ranks.filter(sales__gte=-delta).update(sales=F('sales') + delta)
+            elif not ranks.update(sales=F('sales') + delta):
+                # First sale: start the row at zero, unless a concurrent
+                # payment just did, then add to it like everyone else.
+                category_id = Product.objects.values_list('category_id', flat=True).get(
+                    pk=order.product_id
+                )
+                cls.objects.bulk_create(
+                    [cls(window=window, product_id=order.product_id, category_id=category_id)],
+                    ignore_conflicts=True,
+                )
+                ranks.update(sales=F('sales') + delta)
+
+    @classmethod
+    def refresh(cls, windows=None):
+        """Recompute the given windows (default: all) from paid orders"""
+        now = timezone.now()
+        for window in windows or cls.WINDOW_DAYS:
+            orders = Order.objects.filter(status='paid')
+            start = cls.window_start(window, now)
+            if start is not None:
+                orders = orders.filter(paid_at__gte=start)
+            rows = (
+                orders.values('product_id', 'product__category_id')
+                .annotate(sales=models.Count('id'))
+                .order_by()
+            )
+            with transaction.atomic():
+                cls.objects.filter(window=window).delete()
+                cls.objects.bulk_create([
+                    cls(
+                        window=window, product_id=row['product_id'],
+                        category_id=row['product__category_id'], sales=row['sales'],
+                    )
+                    for row in rows
+                ])
+
+    @classmethod
+    def top_products(cls, window=ALL_TIME, category=None, limit=4):
+        """Best selling products of a window, topped up with the newest titles"""
+        products = Product.objects.with_rating_stats()
+        ranks = {'bestseller_ranks__window': window, 'bestseller_ranks__sales__gt': 0}
+        if category is not None:
+            ranks['bestseller_ranks__category'] = category
+            products = products.filter(category=category)
+        ranked = list(
+            products.filter(**ranks)
+            .annotate(sales_count=F('bestseller_ranks__sales'))
+            .order_by('-sales_count', '-pk')[:limit]
+        )
+        if len(ranked) < limit:
+            ranked += list(
+                products.exclude(pk__in=[p.pk for p in ranked])
+                .order_by('-created_at', '-pk')[:limit - len(ranked)]
+            )
+        return ranked
+
+
+class BkashToken(models.Model):
+    """The bKash grant token shared by all workers; a single row
+
+    Whoever grants or refreshes the token first claims the row's lease with
+    one conditional UPDATE, which is atomic on every database backend
+    (unlike ``cache.add`` on the file cache), so only one process calls
+    bKash for a new token at a time. Times are Unix timestamps, like the
+    ``TokenManager`` clock.
+    """
+    SINGLETON = 1
+
+    id_token = models.TextField(blank=True)
+    refresh_token = models.TextField(blank=True)
+    expires_at = models.FloatField(default=0)
+    lease_owner = models.CharField(max_length=32, blank=True)
+    lease_until = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = _("bKash Token")
+        verbose_name_plural = _("bKash Tokens")
+
+    def __str__(self):
+        return f'bKash token expiring at {self.expires_at}'
+
+    @classmethod
+    def load(cls):
+        """The stored token state, or None before the first grant"""
+        state = (
+            cls.objects.filter(pk=cls.SINGLETON, expires_at__gt=0)
+            .values('id_token', 'refresh_token', 'expires_at')
+            .first()
+        )
+        if state is not None:
+            state['refresh_token'] = state['refresh_token'] or None
+        return state
+
+    @classmethod
+    def claim(cls, owner, now, seconds):
+        """Take the refresh lease unless someone else holds it; True if taken"""
+        lease = {'lease_owner': owner, 'lease_until': now + seconds}
+        if cls.objects.filter(pk=cls.SINGLETON, lease_until__lte=now).update(**lease):
+            return True
+        try:
+            with transaction.atomic():
+                cls.objects.create(pk=cls.SINGLETON, **lease)
+        except IntegrityError:  # the row exists and someone else holds the lease
+            return False
+        return True
+
+    @classmethod
+    def release(cls, owner):
+        cls.objects.filter(pk=cls.SINGLETON, lease_owner=owner).update(lease_owner='', lease_until=0)
+
+    @classmethod
+    def store(cls, state):
+        fields = {
+            'id_token': state['id_token'],
+            'refresh_token': state['refresh_token'] or '',
+            'expires_at': state['expires_at'],
+        }
+        if not cls.objects.filter(pk=cls.SINGLETON).update(**fields):
+            cls.objects.create(pk=cls.SINGLETON, **fields)
+
+
+class JobLease(models.Model):
+    """Keeps a scheduled job from running twice at once; one row per job
+
+    Like the ``BkashToken`` lease: taken with one conditional UPDATE, or an
+    INSERT for the first run, and held until released or ``until`` (Unix
+    time) passes, so a crashed run does not block the next one for good.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    owner = models.CharField(max_length=32, blank=True)
+    until = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = _("Job Lease")
+        verbose_name_plural = _("Job Leases")
+
+    def __str__(self):
+        return f'{self.name} held by {self.owner or "nobody"}'
+
+    @classmethod
+    def claim(cls, name, owner, seconds):
+        """Take the lease on ``name`` unless someone else holds it; True if taken"""
+        now = time.time()
+        lease = {'owner': owner, 'until': now + seconds}
+        if cls.objects.filter(name=name, until__lte=now).update(**lease):
+            return True
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, **lease)
+        except IntegrityError:  # the row exists and someone else holds the lease
+            return False
+        return True
+
+    @classmethod
+    def release(cls, name, owner):
+        cls.objects.filter(name=name, owner=owner).update(owner='', until=0)
+
+    @classmethod
+    def holder(cls, name):
+        """The owner of the live lease on ``name``, or None"""
+        return (
+            cls.objects.filter(name=name, until__gt=time.time())
+            .values_list('owner', flat=True)
+            .first()
+        )
+
+
+class CircuitBreakerState(models.Model):
+    """State of the bKash circuit breaker shared by all workers; a single row
+
+    Every transition is one conditional UPDATE on ``generation``, so only
+    one worker makes it, and starts a new generation of call counts.
+    There is no row until the circuit first opens.
+    """
+    SINGLETON = 1
+
+    state = models.CharField(max_length=10)
+    generation = models.PositiveIntegerField(default=0)
+    since = models.FloatField(default=0)
+    probe_until = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = _("Circuit Breaker State")
+        verbose_name_plural = _("Circuit Breaker States")
+
+    def __str__(self):
+        return f'{self.state} (generation {self.generation})'
+
+
+class CircuitBreakerBucket(models.Model):
+    """Gateway calls and failures counted in one slice of the breaker window
+
+    The rows form a ring: a bucket takes over the slot of the bucket one
+    whole window before it.
+    """
+    slot = models.PositiveSmallIntegerField(primary_key=True)
+    generation = models.PositiveIntegerField(default=0)
+    bucket = models.BigIntegerField(default=0)
+    calls = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Circuit Breaker Bucket")
+        verbose_name_plural = _("Circuit Breaker Buckets")
+
+    def __str__(self):
+        return f'{self.bucket}: {self.failures} of {self.calls} failed'
@@ -0,0 +1,166 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset paginator over ``(created_at, id)``, newest first
+
+    Pages are addressed by opaque cursor tokens instead of page numbers, so
+    no ``COUNT(*)`` is issued and deep pages cost the same as the first one.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    @staticmethod
+    def encode_cursor(direction, obj):
+        payload = json.dumps([direction, obj.created_at.isoformat(), obj.pk])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, created_at, pk = json.loads(base64.urlsafe_b64decode(padded))
+            if direction not in ('next', 'previous'):
+                raise ValueError(direction)
+            return direction, datetime.fromisoformat(created_at), int(pk)
+        except (binascii.Error, TypeError, ValueError) as e:
+            raise InvalidCursor(cursor) from e
+
+    @classmethod
+    def normalize_cursor(cls, cursor):
+        """The canonical token for ``cursor``; '' (the first page) when it is missing or malformed"""
+        if not cursor:
+            return ''
+        try:
+            direction, created_at, pk = cls.decode_cursor(cursor)
+        except InvalidCursor:
+            return ''
+        payload = json.dumps([direction, created_at.isoformat(), pk])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def page(self, cursor=None):
+        """Return the page addressed by ``cursor``; raise InvalidCursor if it is malformed"""
+        queryset = self.queryset
+        direction = 'next'
+        if cursor:
+            direction, created_at, pk = self.decode_cursor(cursor)
+            if direction == 'next':
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+                )
+
+        if direction == 'next':
+            queryset = queryset.order_by('-created_at', '-pk')
+        else:
+            queryset = queryset.order_by('created_at', 'pk')
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'previous':
+            rows.reverse()
+
+        if direction == 'next':
+            has_next, has_previous = has_more, bool(cursor)
+        else:
+            has_next, has_previous = True, has_more
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor('next', rows[-1])
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor('previous', rows[0])
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        """Like ``page()``, but fall back to the first page on a bad cursor"""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+
+def estimate_row_count(model):
+    """Cheap row-count estimate for a whole table, or None when unavailable"""
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [model._meta.db_table],
+            )
+        elif connection.vendor == 'sqlite' and model._meta.pk.get_internal_type() in (
+            'AutoField', 'BigAutoField',
+        ):
+            pk = connection.ops.quote_name(model._meta.pk.column)
+            cursor.execute(f'SELECT MAX({pk}) - MIN({pk}) + 1 FROM {table}')
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that estimates, rather than counts, large unfiltered tables
+
+    Filtered querysets and tables under ``estimate_threshold`` rows still get
+    an exact ``COUNT(*)``.
+    """
+    estimate_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimate_row_count(queryset.model)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,99 @@
+"""Idempotent bKash payment execution.
+
+The execute endpoint is hit by redirects, browser retries and duplicate
+gateway callbacks. ``execute`` (and ``aexecute`` for the async views) makes
+those repeats cheap and safe:
+
+* a payment whose order is already paid is answered from the cache or the
+  database without calling bKash again;
+* concurrent requests for one payment coalesce behind a lease on the order,
+  taken with one conditional UPDATE (``Order.claim_execution``), so only
+  one of them calls bKash while the rest wait for its result;
+* the order is settled with a conditional ``UPDATE ... WHERE status='pending'``
+  (``Order.mark_paid``), so a sale is never counted twice.
+"""
+import asyncio
+import time
+from typing import NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .models import Order
+
+RESULT_KEY = 'payment_execution:{}'
+RESULT_TIMEOUT = 60 * 5
+LOCK_TIMEOUT = 60  # longer than one bKash call with retries
+POLL_INTERVAL = 0.1
+
+ORDER_NOT_FOUND = 'Order not found'
+EXECUTION_FAILED = 'Payment execution failed'
+
+
+class Result(NamedTuple):
+    order_id: Optional[str]
+    error: Optional[str] = None
+
+
+def lookup(payment_id):
+    """The result if it is already known without calling bKash, else None"""
+    if not payment_id:
+        # filter(bkash_payment_id=None) would match orders that never had one
+        raise ValueError('A payment id is required')
+    cached = cache.get(RESULT_KEY.format(payment_id))
+    if cached is not None:
+        return Result(*cached)
+    order = (
+        Order.objects.filter(bkash_payment_id=payment_id)
+        .values_list('id', 'status')
+        .first()
+    )
+    if order is None:
+        return Result(None, ORDER_NOT_FOUND)
+    order_id, status = order
+    if status != 'paid':
+        return None
+    result = Result(str(order_id))
+    cache.set(RESULT_KEY.format(payment_id), tuple(result), RESULT_TIMEOUT)
+    return result
+
+
+def record(payment_id, response):
+    """Settle the order from an execute response and return the result"""
+    if response and response.get('statusCode') == '0000':
+        Order.mark_paid(payment_id, response.get('trxID'))
+    # Paid now, either by this response or by a concurrent callback
+    return lookup(payment_id) or Result(None, EXECUTION_FAILED)
+
+
+def execute(payment_id, execute_payment):
+    """Execute ``payment_id`` at most once at a time; ``execute_payment`` calls bKash"""
+    result = lookup(payment_id)
+    if result is not None:
+        return result
+    lease = Order.claim_execution(payment_id, LOCK_TIMEOUT)
+    if lease is None:
+        while Order.execution_leased(payment_id):
+            time.sleep(POLL_INTERVAL)
+        return lookup(payment_id) or Result(None, EXECUTION_FAILED)
+    try:
+        return record(payment_id, execute_payment(payment_id))
+    finally:
+        Order.release_execution(payment_id, lease)
+
+
+async def aexecute(payment_id, execute_payment):
+    """``execute`` for async views; ``execute_payment`` is a coroutine function"""
+    result = await sync_to_async(lookup)(payment_id)
+    if result is not None:
+        return result
+    lease = await sync_to_async(Order.claim_execution)(payment_id, LOCK_TIMEOUT)
+    if lease is None:
+        while await sync_to_async(Order.execution_leased)(payment_id):
+            await asyncio.sleep(POLL_INTERVAL)
+        return await sync_to_async(lookup)(payment_id) or Result(None, EXECUTION_FAILED)
+    try:
+        response = await execute_payment(payment_id)
+        return await sync_to_async(record)(payment_id, response)
+    finally:
+        await sync_to_async(Order.release_execution)(payment_id, lease)
@@ -0,0 +1,139 @@
+"""On-demand request profiles.
+
+``RequestProfileMiddleware`` runs ``cProfile`` around a single request when a
+staff user asks for it, and ``save_profile`` writes two files per request to
+``PROFILE_DIR``:
+
+* ``<name>.pstats`` -- load with ``python -m pstats`` or snakeviz;
+* ``<name>.collapsed`` -- folded stacks for flamegraph.pl / speedscope.
+
+cProfile records caller/callee pairs rather than whole stacks, so the folded
+stacks are rebuilt from the call graph, splitting each function's time over
+its callers in proportion to the time spent under each of them.
+"""
+import os
+import pstats
+import re
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+TRIGGER_PARAM = '_profile'
+TRIGGER_HEADER = 'HTTP_X_PROFILE'
+MAX_STACK_DEPTH = 100
+MIN_BRANCH_SECONDS = 0.00001
+MICROSECONDS = 1_000_000
+
+
+def profile_dir():
+    return Path(settings.PROFILE_DIR)
+
+
+def is_requested(request):
+    """Whether this request asks to be profiled; cheap when it does not"""
+    if TRIGGER_PARAM not in request.GET and TRIGGER_HEADER not in request.META:
+        return False
+    return request.user.is_active and request.user.is_staff
+
+
+async def ais_requested(request):
+    """``is_requested`` for async middleware; loads the user in a thread if asked"""
+    if TRIGGER_PARAM not in request.GET and TRIGGER_HEADER not in request.META:
+        return False
+    return await sync_to_async(is_requested)(request)
+
+
+def frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':  # built-in
+        return name.strip('<>')
+    return f'{name} ({os.path.basename(filename)}:{lineno})'
+
+
+def collapsed_stacks(stats):
+    """``{"root;caller;callee": microseconds}`` of self time per stack"""
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, cumulative))
+    roots = [func for func, entry in stats.stats.items() if not entry[4]]
+
+    folded = {}
+
+    def walk(func, share, path, seen):
+        total_time = stats.stats[func][2]
+        path = path + [frame_label(func)]
+        weight = int(total_time * share * MICROSECONDS)
+        if weight:
+            key = ';'.join(path)
+            folded[key] = folded.get(key, 0) + weight
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for callee, cumulative in callees.get(func, []):
+            if callee in seen or not cumulative:
+                continue
+            callee_cumulative = stats.stats[callee][3]
+            callee_share = share * min(1, cumulative / callee_cumulative) if callee_cumulative else 0
+            # Dropping branches under MIN_BRANCH_SECONDS keeps the number of
+            # paths through a large call graph bounded.
+            if callee_share * callee_cumulative >= MIN_BRANCH_SECONDS:
+                walk(callee, callee_share, path, seen | {callee})
+
+    for root in roots:
+        walk(root, 1.0, [], {root})
+    return folded
+
+
+def profile_name(request, elapsed):
+    match = request.resolver_match
+    view = match.view_name if match else request.path
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '-', view).strip('-') or 'root'
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return f'{stamp}-{slug}-{int(elapsed * 1000)}ms'
+
+
+def save_profile(profiler, request, elapsed):
+    """Write the pstats and collapsed-stack files; returns the pstats path"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = profile_name(request, elapsed)
+
+    stats = pstats.Stats(profiler)
+    stats_path = directory / f'{name}.pstats'
+    stats.dump_stats(stats_path)
+    with open(directory / f'{name}.collapsed', 'w') as f:
+        for stack, weight in sorted(collapsed_stacks(stats).items()):
+            f.write(f'{stack} {weight}\n')
+
+    prune(directory)
+    return stats_path
+
+
+def prune(directory):
+    """Keep only the newest ``PROFILE_KEEP`` profiles"""
+    for profile in recent_profiles(directory)[settings.PROFILE_KEEP:]:
+        for path in profile['files'].values():
+            path.unlink(missing_ok=True)
+
+
+def recent_profiles(directory=None):
+    """Saved profiles, newest first"""
+    directory = directory or profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for stats_path in sorted(directory.glob('*.pstats'), reverse=True):
+        files = {'pstats': stats_path}
+        collapsed = stats_path.with_suffix('.collapsed')
+        if collapsed.exists():
+            files['collapsed'] = collapsed
+        stat = stats_path.stat()
+        profiles.append({
+            'name': stats_path.stem,
+            'created_at': datetime.fromtimestamp(stat.st_mtime),
+            'size': sum(path.stat().st_size for path in files.values()),
+            'files': files,
+        })
+    return profiles
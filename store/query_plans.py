@@ -0,0 +1,90 @@
+"""Registry of hot queries whose plans must stay on an index.
+
+Each entry builds the queryset a hot path runs. ``sequential_scans()``
+EXPLAINs it (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` on PostgreSQL)
+and returns any plan line that reads a whole table, so the test suite
+fails when an index goes missing or stops matching the query.
+"""
+import re
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, Product, Review
+
+HOT_QUERIES = {}
+
+# SQLite: "SCAN store_order" is a full table scan, while "SCAN store_order
+# USING INDEX ..." walks an index in order (fine under a LIMIT).
+SQLITE_SCAN = re.compile(r'\bSCAN (?!CONSTANT ROW)\S+(?!.*\bUSING\b)')
+POSTGRESQL_SCAN = re.compile(r'\bSeq Scan on\b')
+
+
+def hot_query(name):
+    """Register a function returning the queryset of a hot lookup"""
+    def register(func):
+        HOT_QUERIES[name] = func
+        return func
+    return register
+
+
+def explain(queryset):
+    """The backend's query plan for ``queryset``, one line per step"""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Tiny test tables are cheaper to scan; only flag a scan the
+                # planner cannot avoid.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain().splitlines()
+
+
+def sequential_scans(queryset):
+    """Plan lines that read a whole table"""
+    pattern = POSTGRESQL_SCAN if connection.vendor == 'postgresql' else SQLITE_SCAN
+    return [line.strip() for line in explain(queryset) if pattern.search(line)]
+
+
+@hot_query('order_by_payment_id')
+def order_by_payment_id():
+    return Order.objects.filter(bkash_payment_id='TR0011')
+
+
+@hot_query('returning_customer')
+def returning_customer():
+    return Order.objects.filter(email='reader@example.com')
+
+
+@hot_query('customer_count')
+def customer_count():
+    return Order.objects.values('email').distinct()
+
+
+@hot_query('paid_orders')
+def paid_orders():
+    return Order.objects.filter(status='paid')
+
+
+@hot_query('paid_orders_in_window')
+def paid_orders_in_window():
+    return Order.objects.filter(status='paid', paid_at__gte=timezone.now() - timedelta(days=7))
+
+
+@hot_query('approved_reviews_page')
+def approved_reviews_page():
+    return Review.objects.filter(product_id=1, status='approved').order_by('-created_at', '-pk')[:6]
+
+
+@hot_query('product_list_page')
+def product_list_page():
+    return Product.objects.with_rating_stats().order_by('-created_at', '-pk')[:13]
+
+
+@hot_query('category_product_page')
+def category_product_page():
+    return (
+        Product.objects.with_rating_stats()
+        .filter(category_id=1)
+        .order_by('-created_at', '-pk')[:13]
+    )
@@ -0,0 +1,193 @@
+"""Per-route database query accounting.
+
+``QueryRecorder`` is installed with ``connection.execute_wrapper`` for the
+length of one request (see ``QueryStatsMiddleware``) and counts statements,
+their total time and the slowest few, each with the first stack frame in
+project code that issued it. Everything is keyed on the resolved URL name:
+counts and DB time per request go to ``/metrics`` (``store.metrics``), which
+merges all workers; totals and the slowest statements of this process are
+listed on the staff profiles page; statements over ``SLOW_QUERY_MS`` also go
+to the ``store.slow_queries`` logger.
+
+Under ASGI the queries of a request run on whichever thread
+``sync_to_async`` picks, each with its own connection, so the async path sets
+the recorder in a context variable (``recording``) instead, and ``dispatch``,
+added to every connection as it is opened, hands statements to it.
+"""
+import contextvars
+import heapq
+import logging
+import threading
+import time
+import traceback
+from contextlib import ContextDecorator, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from . import metrics
+
+slow_query_logger = logging.getLogger('store.slow_queries')
+
+SLOWEST_KEPT = 5
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def origin_frame():
+    """``path:line in function`` of the innermost project frame, outside this module"""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        filename = frame.filename
+        if (
+            filename.startswith(base_dir)
+            and filename != __file__
+            and 'site-packages' not in filename
+        ):
+            return f'{Path(filename).relative_to(base_dir)}:{frame.lineno} in {frame.name}'
+    return None
+
+
+def route_name(request):
+    """The URL name ``request`` resolved to, or ``'unresolved'``"""
+    match = request.resolver_match
+    return match.view_name if match else 'unresolved'
+
+
+class QueryRecorder:
+    """Execute wrapper counting one request's statements
+
+    Pass ``request`` to label slow statements with its URL name, which is
+    only known once the URL has been resolved, or ``route`` to name them.
+    """
+
+    def __init__(self, route=None, slow_ms=None, keep=SLOWEST_KEPT, request=None):
+        self.route = route
+        self.request = request
+        self.slow_ms = settings.SLOW_QUERY_MS if slow_ms is None else slow_ms
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []  # min-heap of (ms, sql, origin)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.duration += ms
+            is_slow = ms >= self.slow_ms
+            if is_slow or len(self.slowest) < self.keep or ms > self.slowest[0][0]:
+                # Only pay for the stack walk when the statement is kept.
+                entry = (ms, sql, origin_frame())
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heappushpop(self.slowest, entry)
+                if is_slow:
+                    slow_query_logger.warning(
+                        '%.1f ms [%s] %s (%s)', ms, self.label(), sql, entry[2] or '?'
+                    )
+
+    def label(self):
+        if self.route:
+            return self.route
+        return route_name(self.request) if self.request is not None else '-'
+
+
+_current = contextvars.ContextVar('query_recorder', default=None)
+
+
+def dispatch(execute, sql, params, many, context):
+    """Execute wrapper passing statements to the ``recording`` recorder, if any"""
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install(connection):
+    if dispatch not in connection.execute_wrappers:
+        # At the front: execute_wrapper() blocks open at the time pop from the end
+        connection.execute_wrappers.insert(0, dispatch)
+
+
+def install_on_connect(sender, connection, **kwargs):
+    install(connection)
+
+
+@contextmanager
+def recording(recorder):
+    """Record the queries of this context, including threads it calls into"""
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+def record(route, recorder):
+    """Fold one request's queries into the per-route totals and ``/metrics``"""
+    metrics.observe_queries(route, recorder.count, recorder.duration / 1000)
+    with _lock:
+        stats = _stats.setdefault(route, {
+            'requests': 0, 'queries': 0, 'time_ms': 0.0, 'max_queries': 0, 'slowest': [],
+        })
+        stats['requests'] += 1
+        stats['queries'] += recorder.count
+        stats['time_ms'] += recorder.duration
+        stats['max_queries'] = max(stats['max_queries'], recorder.count)
+        stats['slowest'] = heapq.nlargest(
+            SLOWEST_KEPT, stats['slowest'] + recorder.slowest, key=lambda entry: entry[0]
+        )
+
+
+def snapshot():
+    """Per-route totals collected by this process so far"""
+    with _lock:
+        return {
+            route: dict(stats, slowest=list(stats['slowest']))
+            for route, stats in _stats.items()
+        }
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+class query_budget(ContextDecorator):
+    """Fail the wrapped block (or test) if it runs more than ``budget`` queries
+
+        @query_budget(6)
+        def test_home(self): ...
+
+        with query_budget(4, 'store:search'):
+            self.client.get(url)
+    """
+
+    def __init__(self, budget, label=None):
+        self.budget = budget
+        self.label = label
+
+    def __enter__(self):
+        self.queries = CaptureQueriesContext(connection)
+        self.queries.__enter__()
+        return self.queries
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.queries.__exit__(exc_type, exc_value, tb)
+        if exc_type is None and len(self.queries) > self.budget:
+            statements = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(self.queries.captured_queries, 1)
+            )
+            raise AssertionError(
+                f'{self.label or "Block"} ran {len(self.queries)} queries, '
+                f'budget is {self.budget}:\n{statements}'
+            )
+        return False
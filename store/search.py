@@ -0,0 +1,137 @@
+"""Ranked full-text search over products.
+
+On SQLite the catalog is mirrored into the ``store_product_fts`` FTS5 table
+(created by migration 0012 and kept in sync by the ``Product`` signals);
+on PostgreSQL a weighted ``tsvector`` is matched instead. Other backends
+fall back to the old ``icontains`` scan.
+"""
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+SEARCH_LIMIT = 100
+
+# Relative weight of title, author and description matches.
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 4.0
+DESCRIPTION_WEIGHT = 1.0
+
+# unicode61 treats Bengali vowel signs, virama etc. as separators; keep them
+# (and ZWNJ/ZWJ) inside tokens so words are not torn into single letters.
+BENGALI_TOKENCHARS = ''.join(
+    chr(c) for c in range(0x0980, 0x0A00)
+    if unicodedata.category(chr(c)) in ('Mn', 'Mc')
+) + '\u200c\u200d'
+
+FTS_TABLE = 'store_product_fts'
+FTS_INSERT_SQL = (
+    f'INSERT INTO {FTS_TABLE} (rowid, title, author, description) VALUES (%s, %s, %s, %s)'
+)
+
+
+def normalize(text):
+    return unicodedata.normalize('NFC', text or '')
+
+
+def fts_query(query):
+    """Turn user input into an FTS5 query: every word must match as a prefix"""
+    words = normalize(query).replace('"', ' ').split()
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def index_product(product):
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            FTS_INSERT_SQL,
+            [product.pk, normalize(product.title), normalize(product.author),
+             normalize(product.description)],
+        )
+
+
+def unindex_product(product_id):
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index(batch_size=1000):
+    """Repopulate the FTS table from the catalog; returns the number indexed"""
+    if not uses_fts():
+        return 0
+    indexed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        rows = Product.objects.order_by('pk').values_list('pk', 'title', 'author', 'description')
+        batch = []
+        for pk, title, author, description in rows.iterator(chunk_size=batch_size):
+            batch.append((pk, normalize(title), normalize(author), normalize(description)))
+            if len(batch) >= batch_size:
+                cursor.executemany(FTS_INSERT_SQL, batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(FTS_INSERT_SQL, batch)
+            indexed += len(batch)
+    return indexed
+
+
+def _ranked_ids_sqlite(query, limit):
+    match = fts_query(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, %s, %s, %s) LIMIT %s',
+            [match, TITLE_WEIGHT, AUTHOR_WEIGHT, DESCRIPTION_WEIGHT, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _ranked_ids_postgresql(query, limit):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    vector = (
+        SearchVector('title', weight='A', config='simple')
+        + SearchVector('author', weight='B', config='simple')
+        + SearchVector('description', weight='C', config='simple')
+    )
+    search_query = SearchQuery(normalize(query), config='simple', search_type='websearch')
+    return list(
+        Product.objects.annotate(search=vector, rank=SearchRank(vector, search_query))
+        .filter(search=search_query)
+        .order_by('-rank', '-pk')
+        .values_list('pk', flat=True)[:limit]
+    )
+
+
+def search_products(query, limit=SEARCH_LIMIT):
+    """Products matching ``query``, best match first, annotated with rating stats"""
+    query = query.strip()
+    if not query:
+        return []
+    if connection.vendor == 'sqlite':
+        ids = _ranked_ids_sqlite(query, limit)
+    elif connection.vendor == 'postgresql':
+        ids = _ranked_ids_postgresql(query, limit)
+    else:
+        return list(
+            Product.objects.with_rating_stats().filter(
+                Q(title__icontains=query) |
+                Q(author__icontains=query) |
+                Q(description__icontains=query)
+            )[:limit]
+        )
+    products = Product.objects.with_rating_stats().in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
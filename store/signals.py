@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import categories, search, suggest
+from .models import BestsellerRank, Category, Order, Product, RatingSummary, Review, StoreCounter
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    """Take a deleted approved review out of its product's rating summary"""
+    if instance.status == 'approved':
+        RatingSummary.apply_changes(
+            [(instance.product_id, instance.rating, -1)], create_missing=False
+        )
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    StoreCounter.add(StoreCounter.PRODUCTS, -1)
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    search.index_product(instance)
+    transaction.on_commit(suggest.bump_catalog_version)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.unindex_product(instance.pk)
+    transaction.on_commit(suggest.bump_catalog_version)
+
+
+@receiver(post_delete, sender=Order)
+def count_deleted_order(sender, instance, **kwargs):
+    if instance.status == 'paid':
+        StoreCounter.add(StoreCounter.PAID_ORDERS, -1)
+        BestsellerRank.record_sale(instance, -1)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_registry(sender, **kwargs):
+    transaction.on_commit(categories.bump_category_version)
+
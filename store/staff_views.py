@@ -0,0 +1,58 @@
+"""Staff-only views outside the admin site: request profiles and /metrics"""
+import base64
+
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import authenticate
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import render
+from django.utils.translation import gettext_lazy as _
+
+from . import metrics, profiling, query_stats
+
+
+@staff_member_required
+def profile_list(request):
+    """Recent request profiles, and the query totals of this worker"""
+    routes = sorted(
+        query_stats.snapshot().items(), key=lambda item: item[1]['time_ms'], reverse=True,
+    )
+    context = {
+        **admin.site.each_context(request),
+        'title': _('Request profiles'),
+        'profiles': profiling.recent_profiles(),
+        'profile_dir': profiling.profile_dir(),
+        'trigger_param': profiling.TRIGGER_PARAM,
+        'query_routes': routes,
+    }
+    return render(request, 'admin/store/profile_list.html', context)
+
+
+@staff_member_required
+def profile_download(request, name, kind):
+    for profile in profiling.recent_profiles():
+        if profile['name'] == name and kind in profile['files']:
+            return FileResponse(open(profile['files'][kind], 'rb'), as_attachment=True)
+    raise Http404('No such profile')
+
+
+def basic_auth_user(request):
+    """The user named by an HTTP Basic ``Authorization`` header, if the password matches"""
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode().partition(':')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def metrics_view(request):
+    """Prometheus metrics for staff: a logged-in session, or Basic auth for scrapers"""
+    user = request.user if request.user.is_authenticated else basic_auth_user(request)
+    if not (user and user.is_active and user.is_staff):
+        response = HttpResponse('Authentication required', status=401)
+        response['WWW-Authenticate'] = 'Basic realm="metrics"'
+        return response
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,121 @@
+"""In-process prefix index for search-as-you-type suggestions.
+
+Each worker keeps a sorted array of normalized title/author keys and answers
+prefix lookups with ``bisect``, so a keystroke costs one cache read (the
+catalog version) and no database query. The index is rebuilt lazily when
+the shared catalog version changes, which ``Product`` saves and deletes bump.
+"""
+import threading
+import unicodedata
+import uuid
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from .models import Product
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+MAX_KEYS = 200_000  # caps the index at a few tens of MB for very large catalogs
+MAX_KEY_LENGTH = 64
+MAX_QUERY_LENGTH = 50
+MAX_SCAN = 200
+SUGGESTION_LIMIT = 8
+
+TITLE = 'title'
+AUTHOR = 'author'
+
+
+def normalize(text):
+    """NFKC + casefold + collapsed whitespace
+
+    Composed and decomposed spellings (e.g. Bengali ড় vs ড + nukta, or
+    é vs e + accent) and letter case all compare equal.
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+
+def catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class PrefixIndex:
+    """Sorted array of ``(key, position, entry)`` tuples
+
+    Every word of a title or author starts a key, so "mas" finds
+    "ChatGPT Mastery". ``position`` (the word offset) ranks matches at the
+    start of a name first.
+    """
+
+    def __init__(self, entries, max_keys=MAX_KEYS):
+        keys = []
+        for entry in entries:
+            words = normalize(entry[0]).split(' ')
+            for position in range(len(words)):
+                keys.append((' '.join(words[position:])[:MAX_KEY_LENGTH], position, entry))
+                if len(keys) >= max_keys:
+                    break
+            if len(keys) >= max_keys:
+                break
+        keys.sort(key=lambda key: key[:2])
+        self.keys = [key for key, _, _ in keys]
+        self.matches = [(position, entry) for _, position, entry in keys]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, prefix, limit=SUGGESTION_LIMIT):
+        prefix = normalize(prefix)[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+        start = bisect_left(self.keys, prefix)
+        found = []
+        for i in range(start, min(start + MAX_SCAN, len(self.keys))):
+            if not self.keys[i].startswith(prefix):
+                break
+            found.append(self.matches[i])
+        found.sort(key=lambda match: (match[0], len(match[1][0])))
+
+        suggestions, seen = [], set()
+        for _, entry in found:
+            if entry[:2] not in seen:
+                seen.add(entry[:2])
+                suggestions.append(entry)
+                if len(suggestions) == limit:
+                    break
+        return suggestions
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def build_index():
+    entries = []
+    for pk, title, author in Product.objects.values_list('pk', 'title', 'author').iterator():
+        entries.append((title, TITLE, pk))
+        if author:
+            entries.append((author, AUTHOR, pk))
+    return PrefixIndex(entries)
+
+
+def get_index():
+    """This worker's index, rebuilt if the catalog version has moved on"""
+    global _index, _index_version
+    version = catalog_version()
+    if _index is None or version != _index_version:
+        with _lock:
+            if _index is None or version != _index_version:
+                _index = build_index()
+                _index_version = version
+    return _index
+
+
+def suggest(query, limit=SUGGESTION_LIMIT):
+    """``[(text, kind, product_id), ...]`` for a partially typed query"""
+    return get_index().lookup(query[:MAX_QUERY_LENGTH], limit)
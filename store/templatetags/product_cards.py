@@ -0,0 +1,34 @@
+# app/templatetags/product_cards.py
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+CARD_TEMPLATE = 'store/includes/product_card.html'
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+def card_cache_key(product):
+    return f'product_card:{product.pk}:{product.version}'
+
+
+@register.simple_tag
+def product_cards(products):
+    """Render product cards, fetching every cached card in one round trip
+
+    Keys carry ``Product.version``, which moves whenever the product or its
+    approved reviews change, so stale cards are never served.
+    """
+    products = list(products)
+    keys = [card_cache_key(product) for product in products]
+    cards = cache.get_many(keys)
+    missing = {}
+    for key, product in zip(keys, products):
+        if key not in cards:
+            missing[key] = render_to_string(CARD_TEMPLATE, {'product': product})
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+        cards.update(missing)
+    return mark_safe(''.join(cards[key] for key in keys))
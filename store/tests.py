@@ -1,3 +1,1855 @@
-from django.test import TestCase
+from datetime import timedelta
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import (
+    AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.urls import clear_url_caches, reverse
+from django.utils.html import linebreaks
+from markdownify.templatetags.markdownify import markdownify
+from prometheus_client.parser import text_string_to_metric_families
+from django.utils import timezone
+
+from . import downloads, metrics, payments, profiling, query_plans, query_stats, search, suggest
+from .admin import ReviewAdmin
+from .bkash_service import (
+    AsyncBkashService, BkashService, CircuitBreaker, GatewayUnavailable, TokenManager,
+    get_bkash_service,
+)
+from .fake_bkash import FakeBkashGateway
+from .management.commands import reconcile_payments
+from .categories import registry
+from .models import (
+    BestsellerRank, BkashToken, Category, CircuitBreakerBucket, CircuitBreakerState,
+    DownloadEvent, JobLease, Order, Product, RatingSummary, Review, StoreCounter,
+    star_string,
+)
+from .query_stats import query_budget
+
+
+def make_product(category=None, **kwargs):
+    if category is None:
+        category, _ = Category.objects.get_or_create(slug='ai', defaults={'name': 'AI'})
+    fields = {
+        'title': 'ChatGPT Mastery',
+        'author': 'AiShikkha',
+        'description': 'A practical guide',
+        'price': 250,
+        'sample_pdf_file': 'sample_pdfs/sample.pdf',
+    }
+    fields.update(kwargs)
+    return Product.objects.create(category=category, **fields)
+
+
+def make_review(product, rating, status='approved', **kwargs):
+    n = Review.objects.count()
+    fields = {
+        'name': f'Reader {n}',
+        'email': f'reader{n}@example.com',
+        'title': 'Review',
+        'comment': 'Useful book',
+    }
+    fields.update(kwargs)
+    return Review.objects.create(product=product, rating=rating, status=status, **fields)
+
+
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+
+    def summary(self):
+        return RatingSummary.objects.get(product=self.product)
+
+    def assertSummary(self, count, total, distribution):
+        summary = self.summary()
+        self.assertEqual((summary.count, summary.total), (count, total))
+        self.assertEqual(summary.distribution, distribution)
+
+    def test_product_without_reviews(self):
+        self.assertEqual(self.product.get_average_rating(), 0)
+        self.assertEqual(self.product.get_rating_count(), 0)
+        self.assertEqual(self.product.get_star_display(), '☆☆☆☆☆')
+        self.assertEqual(self.product.get_rating_distribution(), {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+    def test_only_approved_reviews_count(self):
+        make_review(self.product, 5)
+        make_review(self.product, 4)
+        make_review(self.product, 1, status='pending')
+        self.assertSummary(2, 9, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+
+        product = Product.objects.get(pk=self.product.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(product.get_average_rating(), 4.5)
+            self.assertEqual(product.get_rating_count(), 2)
+            self.assertEqual(product.get_star_display(), '★★★★★')
+
+    def test_status_and_rating_changes(self):
+        review = make_review(self.product, 5, status='pending')
+        self.assertFalse(RatingSummary.objects.exists())
+
+        review.status = 'approved'
+        review.save()
+        self.assertSummary(1, 5, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1})
+
+        review.rating = 3
+        review.save()
+        self.assertSummary(1, 3, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0})
+
+        review.status = 'rejected'
+        review.save()
+        self.assertSummary(0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+    def test_delete(self):
+        review = make_review(self.product, 2)
+        make_review(self.product, 4)
+        review.delete()
+        self.assertSummary(1, 4, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+        Review.objects.all().delete()
+        self.assertSummary(0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+    def test_admin_bulk_actions(self):
+        make_review(self.product, 5, status='pending')
+        make_review(self.product, 3, status='pending')
+        make_review(self.product, 4)
+
+        admin = ReviewAdmin(Review, AdminSite())
+        admin.message_user = lambda *args, **kwargs: None
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+        admin.approve_reviews(request, Review.objects.all())
+        self.assertSummary(3, 12, {1: 0, 2: 0, 3: 1, 4: 1, 5: 1})
+
+        admin.reject_reviews(request, Review.objects.filter(rating__gte=4))
+        self.assertSummary(1, 3, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0})
+
+        admin.mark_as_pending(request, Review.objects.all())
+        self.assertSummary(0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+    def test_rebuild_command_repairs_drift(self):
+        make_review(self.product, 5)
+        make_review(self.product, 2)
+        RatingSummary.objects.filter(product=self.product).update(count=7, total=1, star_5=0)
+
+        call_command('rebuild_rating_summaries', verbosity=0, stdout=StringIO())
+        self.assertSummary(2, 7, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+    def test_full_rebuild_does_not_filter_by_id(self):
+        make_review(self.product, 4)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(RatingSummary.rebuild(), 1)
+        self.assertFalse([q['sql'] for q in queries if ' IN (' in q['sql']])
+        self.assertSummary(1, 4, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_rebuild_batches_product_ids(self):
+        products = [self.product] + [make_product(title=f'Book {i}') for i in range(4)]
+        for rating, product in enumerate(products, 1):
+            make_review(product, rating)
+        RatingSummary.objects.update(count=0, total=0)
+        versions = dict(Product.objects.values_list('pk', 'version'))
+
+        with mock.patch('store.models.MAX_ID_BATCH', 2):
+            self.assertEqual(RatingSummary.rebuild([p.pk for p in products]), 5)
+        self.assertEqual(
+            sorted(RatingSummary.objects.values_list('count', 'total')),
+            [(1, 1), (1, 2), (1, 3), (1, 4), (1, 5)],
+        )
+        for pk, version in Product.objects.values_list('pk', 'version'):
+            self.assertEqual(version, versions[pk] + 1)
+
+
+class RatingAnnotationTests(TestCase):
+    def test_annotation_matches_model_methods(self):
+        products = [make_product(title=f'Book {i}') for i in range(4)]
+        for product, ratings in zip(products, [[5, 4], [3], [1, 2, 2], []]):
+            for rating in ratings:
+                make_review(product, rating)
+
+        annotated = {p.pk: p for p in Product.objects.with_rating_stats()}
+        for product in Product.objects.all():
+            with self.subTest(product=product.title):
+                listed = annotated[product.pk]
+                self.assertEqual(listed.get_average_rating(), product.get_average_rating())
+                self.assertEqual(listed.get_rating_count(), product.get_rating_count())
+                self.assertEqual(listed.get_star_display(), product.get_star_display())
+
+    def test_star_string_rounds_half_up(self):
+        self.assertEqual(star_string(0), '☆☆☆☆☆')
+        self.assertEqual(star_string(2.5), '★★★☆☆')
+        self.assertEqual(star_string(4.4), '★★★★☆')
+        self.assertEqual(star_string(5), '★★★★★')
+
+    def listing_query_count(self, url_name, n_products):
+        category = Category.objects.create(name=f'Cat {n_products}', slug=f'cat-{n_products}')
+        Product.objects.bulk_create([
+            Product(
+                title=f'Book {i}', author='AiShikkha', description='...', price=100,
+                category=category, sample_pdf_file='sample_pdfs/sample.pdf',
+            )
+            for i in range(n_products)
+        ])
+        for product in Product.objects.filter(category=category)[:3]:
+            make_review(product, 4)
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        Product.objects.all().delete()
+        return len(queries)
+
+    def test_product_list_query_count_is_constant(self):
+        self.assertEqual(
+            self.listing_query_count('store:product_list', 4),
+            self.listing_query_count('store:product_list', 400),
+        )
+
+    def test_home_query_count_is_constant(self):
+        self.assertEqual(
+            self.listing_query_count('store:home', 4),
+            self.listing_query_count('store:home', 400),
+        )
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product()
+        for i in range(12):
+            make_review(self.product, i % 5 + 1)
+        make_review(self.product, 5, status='pending')
+        # Shared timestamps exercise the id tie-break.
+        Review.objects.filter(rating__lte=2).update(created_at='2025-01-01 10:00:00')
+
+    def fetch(self, cursor=None):
+        url = reverse('store:get_reviews_ajax', args=[self.product.pk])
+        response = self.client.get(url, {'cursor': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_walk_forward_and_back(self):
+        expected = list(
+            self.product.reviews.filter(status='approved')
+            .order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        pages, cursor = [], None
+        while True:
+            data = self.fetch(cursor)
+            pages.append(data)
+            if not data['has_next']:
+                break
+            cursor = data['next_cursor']
+
+        self.assertEqual([len(p['reviews']) for p in pages], [5, 5, 2])
+        self.assertEqual([r['id'] for p in pages for r in p['reviews']], expected)
+        self.assertFalse(pages[0]['has_previous'])
+
+        back = self.fetch(pages[2]['previous_cursor'])
+        self.assertEqual(back['reviews'], pages[1]['reviews'])
+        back = self.fetch(back['previous_cursor'])
+        self.assertEqual(back['reviews'], pages[0]['reviews'])
+        self.assertFalse(back['has_previous'])
+        self.assertTrue(back['has_next'])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        self.assertEqual(self.fetch('not-a-cursor'), self.fetch())
+
+    def test_product_pages(self):
+        response = self.client.get(reverse('store:product_detail', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['reviews']), 5)
+
+        make_product(title='Second')
+        response = self.client.get(reverse('store:product_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertFalse(response.context['is_paginated'])
+
+
+class StoreCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def counters(self):
+        return dict(StoreCounter.objects.values_list('name', 'value'))
+
+    def make_order(self, product, email, **kwargs):
+        return Order.objects.create(
+            customer_name='Buyer', email=email, phone='01700000000',
+            product=product, amount=product.price, **kwargs
+        )
+
+    def test_counters_follow_writes(self):
+        product = make_product()
+        other = make_product(title='Other')
+        first = self.make_order(product, 'a@example.com')
+        self.make_order(product, 'a@example.com')
+        self.make_order(other, 'b@example.com')
+        self.assertEqual(self.counters(), {'products': 2, 'customers': 2, 'paid_orders': 0})
+
+        first.status = 'paid'
+        first.save()
+        first.save()
+        self.assertEqual(self.counters()['paid_orders'], 1)
+
+        first.status = 'failed'
+        first.save()
+        self.assertEqual(self.counters()['paid_orders'], 0)
+
+        first.status = 'paid'
+        first.save()
+        product.delete()
+        self.assertEqual(self.counters()['products'], 1)
+        self.assertEqual(self.counters()['paid_orders'], 0)
+        self.assertEqual(self.counters(), StoreCounter.compute_exact() | {'customers': 2})
+
+    def test_first_use_of_a_counter_can_race(self):
+        bulk_create = StoreCounter.objects.bulk_create
+
+        def concurrent_first_use(objs, **kwargs):
+            # Another transaction creates the row between our UPDATE and INSERT
+            StoreCounter.objects.create(name=objs[0].name, value=1)
+            return bulk_create(objs, **kwargs)
+
+        StoreCounter.objects.all().delete()
+        with mock.patch.object(
+            StoreCounter.objects, 'bulk_create', side_effect=concurrent_first_use,
+        ):
+            make_product()
+        self.assertEqual(self.counters(), {'products': 2})
+
+    def test_new_customer_check_and_count_are_one_statement(self):
+        product = make_product()
+        self.make_order(product, 'a@example.com')
+        with CaptureQueriesContext(connection) as queries:
+            self.make_order(product, 'a@example.com')
+            self.make_order(product, 'b@example.com')
+        self.assertEqual(self.counters()['customers'], 2)
+        updates = [q['sql'] for q in queries if 'UPDATE "store_storecounter"' in q['sql']]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(all('NOT EXISTS(' in sql for sql in updates))
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT 1 AS "a"')])
+
+    def test_reconcile_command(self):
+        product = make_product()
+        self.make_order(product, 'a@example.com', status='paid')
+        StoreCounter.objects.update(value=99)
+
+        call_command('reconcile_store_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), {'products': 1, 'customers': 1, 'paid_orders': 1})
+
+    def test_home_page_does_not_scan_orders(self):
+        make_product()
+        self.client.get(reverse('store:home'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('store:home'))
+        self.assertEqual(response.context['total_ebooks'], 1)
+        self.assertFalse([q for q in queries if 'FROM "store_order"' in q['sql']])
+        self.assertFalse([q for q in queries if 'store_storecounter' in q['sql']])
+
+
+class BestsellerRankTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ai = Category.objects.create(name='AI', slug='ai')
+        self.design = Category.objects.create(name='Design', slug='design')
+        self.books = [make_product(self.ai, title=f'AI {i}') for i in range(3)]
+        self.books.append(make_product(self.design, title='Design'))
+
+    def sell(self, product, status='paid'):
+        order = Order.objects.create(
+            customer_name='Buyer', email='buyer@example.com', phone='01700000000',
+            product=product, amount=product.price,
+        )
+        order.status = status
+        order.save()
+        return order
+
+    def titles(self, window='all', category=None, limit=4):
+        return [p.title for p in BestsellerRank.top_products(window, category, limit)]
+
+    def test_only_paid_orders_rank(self):
+        for _ in range(3):
+            self.sell(self.books[1])
+        self.sell(self.books[2])
+        for _ in range(5):
+            self.sell(self.books[0], status='failed')
+        self.assertEqual(self.titles(limit=2), ['AI 1', 'AI 2'])
+        self.assertEqual(self.titles('7d', self.ai, limit=2), ['AI 1', 'AI 2'])
+        self.assertEqual(self.titles('all', self.design, limit=1), ['Design'])
+
+    def test_ranking_is_topped_up_with_new_products(self):
+        self.sell(self.books[3])
+        self.assertEqual(self.titles()[0], 'Design')
+        self.assertEqual(len(self.titles()), 4)
+
+    def test_refresh_ages_out_old_sales(self):
+        old = self.sell(self.books[0])
+        self.sell(self.books[0])
+        self.sell(self.books[1])
+        Order.objects.filter(pk=old.pk).update(paid_at=timezone.now() - timedelta(days=10))
+        self.assertEqual(self.titles('7d', limit=1), ['AI 0'])
+
+        call_command('refresh_bestsellers', stdout=StringIO())
+        ranks = dict(BestsellerRank.objects.filter(window='7d').values_list('product__title', 'sales'))
+        self.assertEqual(ranks, {'AI 0': 1, 'AI 1': 1})
+        ranks = dict(BestsellerRank.objects.filter(window='30d').values_list('product__title', 'sales'))
+        self.assertEqual(ranks, {'AI 0': 2, 'AI 1': 1})
+
+    def test_first_sales_of_a_product_can_race(self):
+        order = self.sell(self.books[0], status='pending')
+        order.paid_at = timezone.now()
+        bulk_create = BestsellerRank.objects.bulk_create
+
+        def concurrent_first_sale(objs, **kwargs):
+            # Another payment inserts the row between our UPDATE and INSERT
+            BestsellerRank.objects.create(
+                window=objs[0].window, product=self.books[0], category=self.ai, sales=1,
+            )
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(
+            BestsellerRank.objects, 'bulk_create', side_effect=concurrent_first_sale,
+        ):
+            BestsellerRank.record_sale(order, 1)
+        self.assertEqual(
+            dict(BestsellerRank.objects.values_list('window', 'sales')),
+            {'all': 2, '30d': 2, '7d': 2},
+        )
+
+    def test_unpaying_an_order_removes_the_sale(self):
+        order = self.sell(self.books[0])
+        order.status = 'failed'
+        order.save()
+        self.assertFalse(BestsellerRank.objects.filter(sales__gt=0).exists())
+
+    def test_pages_select_window(self):
+        self.sell(self.books[2])
+        response = self.client.get(reverse('store:home'), {'window': '30d'})
+        self.assertEqual(response.context['bestseller_window'], '30d')
+        self.assertEqual(response.context['featured_products'][0].title, 'AI 2')
+
+        response = self.client.get(
+            reverse('store:product_list_by_category', args=['ai']), {'window': 'bogus'}
+        )
+        self.assertEqual(response.context['bestseller_window'], 'all')
+        self.assertEqual(response.context['bestsellers'][0].title, 'AI 2')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.title_hit = make_product(title='চ্যাটজিপিটি মাস্টারি', description='AI guide')
+        self.body_hit = make_product(
+            title='Prompt Engineering', description='চ্যাটজিপিটি দিয়ে কাজ শিখুন'
+        )
+        self.author_hit = make_product(title='Midjourney', author='Rafi Ahmed')
+
+    def titles(self, query):
+        return [p.title for p in search.search_products(query)]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.titles('চ্যাটজিপিটি'), ['চ্যাটজিপিটি মাস্টারি', 'Prompt Engineering'])
+
+    def test_prefix_case_and_multiple_words(self):
+        self.assertEqual(self.titles('চ্যাট'), ['চ্যাটজিপিটি মাস্টারি', 'Prompt Engineering'])
+        self.assertEqual(self.titles('PROMPT engin'), ['Prompt Engineering'])
+        self.assertEqual(self.titles('rafi'), ['Midjourney'])
+        self.assertEqual(self.titles('"'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.author_hit.title = 'Stable Diffusion'
+        self.author_hit.save()
+        self.assertEqual(self.titles('midjourney'), [])
+        self.assertEqual(self.titles('stable'), ['Stable Diffusion'])
+
+        self.title_hit.delete()
+        self.assertEqual(self.titles('মাস্টারি'), [])
+
+    def test_rebuild_command(self):
+        Product.objects.filter(pk=self.author_hit.pk).update(title='Renamed quietly')
+        self.assertEqual(self.titles('renamed'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.titles('renamed'), ['Renamed quietly'])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('store:search'), {'q': 'মাস্টারি'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['products'], [self.title_hit])
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_product(title='ChatGPT Mastery', author='রাফি আহমেদ')
+        make_product(title='চ্যাটজিপিটি দিয়ে আয়', author='Tanmoy Chowdhury')
+        make_product(title='Midjourney Mastery', author='রাফি আহমেদ')
+
+    def texts(self, query):
+        return [text for text, _, _ in suggest.suggest(query)]
+
+    def test_prefix_lookup(self):
+        self.assertEqual(self.texts('chat'), ['ChatGPT Mastery'])
+        self.assertEqual(self.texts('MAST'), ['ChatGPT Mastery', 'Midjourney Mastery'])
+        self.assertEqual(self.texts('রাফি'), ['রাফি আহমেদ'])
+        self.assertEqual(self.texts('আহ'), ['রাফি আহমেদ'])
+        self.assertEqual(self.texts('চ্যাট'), ['চ্যাটজিপিটি দিয়ে আয়'])
+        self.assertEqual(self.texts('zzz'), [])
+        self.assertEqual(self.texts('  '), [])
+
+    def test_unicode_normalization(self):
+        make_product(title='প\u09dcুন সহজে')  # precomposed ড়
+        make_product(title='Cafe\u0301 Notes')  # e + combining acute
+        self.assertEqual(self.texts('প\u09a1\u09bcু'), ['প\u09dcুন সহজে'])
+        self.assertEqual(self.texts('CAF\u00c9'), ['Cafe\u0301 Notes'])
+
+    def test_index_rebuilds_only_when_catalog_changes(self):
+        suggest.get_index()
+        with self.assertNumQueries(0):
+            self.texts('chat')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product(title='Chatbot Basics')
+        self.assertEqual(self.texts('chat'), ['Chatbot Basics', 'ChatGPT Mastery'])
+
+    def test_index_is_bounded(self):
+        index = suggest.PrefixIndex([('a b c d', 'title', 1), ('e f', 'title', 2)], max_keys=3)
+        self.assertEqual(len(index), 3)
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('store:search_suggest'), {'q': 'midj'})
+        self.assertIn('max-age=60', response['Cache-Control'])
+        product = Product.objects.get(title='Midjourney Mastery')
+        self.assertEqual(response.json(), {
+            'q': 'midj',
+            'suggestions': [['Midjourney Mastery', 'title', f'/product/{product.pk}/']],
+        })
+
+
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(title='ChatGPT Mastery')
+
+    def render_cards(self):
+        return Template('{% load product_cards %}{% product_cards products %}').render(
+            Context({'products': Product.objects.with_rating_stats()})
+        )
+
+    def test_cards_are_cached_by_version(self):
+        html = self.render_cards()
+        self.assertIn('ChatGPT Mastery', html)
+        self.assertIn('☆☆☆☆☆', html)
+        key = f'product_card:{self.product.pk}:{self.product.version}'
+        self.assertEqual(cache.get(key), html)
+
+        cache.set(key, 'cached card')
+        self.assertEqual(self.render_cards(), 'cached card')
+
+    def test_product_edit_bumps_version(self):
+        self.render_cards()
+        self.product.price = 199
+        self.product.save()
+        self.assertEqual(self.product.version, 2)
+        self.assertIn('৳199', self.render_cards())
+
+    def test_save_does_not_undo_a_concurrent_bump(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.bump_versions([self.product.pk])  # e.g. a review approved meanwhile
+        stale.price = 199
+        stale.save()
+        self.assertEqual(stale.version, 3)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).version, 3)
+
+        stale.save(update_fields=['price'])
+        self.assertEqual(stale.version, 4)
+
+    def test_review_approval_bumps_version(self):
+        self.render_cards()
+        review = make_review(self.product, 4, status='pending')
+        self.assertIn('☆☆☆☆☆', self.render_cards())
+        review.status = 'approved'
+        review.save()
+        self.assertIn('★★★★☆', self.render_cards())
+
+    def test_listing_fetches_cards_in_one_round_trip(self):
+        for i in range(5):
+            make_product(title=f'Book {i}')
+        self.render_cards()
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'set_many') as set_many:
+            self.render_cards()
+        self.assertEqual(get_many.call_count, 1)
+        set_many.assert_not_called()
+
+
+class DescriptionHtmlTests(TestCase):
+    description = '# Intro\n\nLearn **prompting**.\nLine two\n\n<script>alert(1)</script>'
+
+    def test_rendered_on_save(self):
+        product = make_product(description=self.description)
+        expected = linebreaks(markdownify(self.description))
+        self.assertEqual(product.description_html, expected)
+        self.assertIn('<strong>prompting</strong>', product.description_html)
+        self.assertNotIn('<script>', product.description_html)
+
+        product.description = 'Updated'
+        product.save(update_fields=['description'])
+        product.refresh_from_db()
+        self.assertEqual(product.description_html, linebreaks(markdownify('Updated')))
+
+    def test_only_a_changed_description_is_rendered(self):
+        product = make_product(description=self.description)
+        with mock.patch.object(
+            Product, 'render_description', autospec=True, side_effect=Product.render_description,
+        ) as render:
+            product.price = 300
+            product.save()
+            product.save(update_fields=['price'])
+            Product.objects.get(pk=product.pk).save()
+            render.assert_not_called()
+
+            product.description = 'Updated'
+            product.save(update_fields=['price'])  # the description is not being saved
+            render.assert_not_called()
+            product.save()
+            product.save()
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(
+            Product.objects.get(pk=product.pk).description_html, linebreaks(markdownify('Updated')),
+        )
+
+    def test_detail_page_does_no_markdown_work(self):
+        product = make_product(description=self.description)
+        with mock.patch('markdown.markdown') as markdown:
+            response = self.client.get(reverse('store:product_detail', args=[product.pk]))
+        markdown.assert_not_called()
+        self.assertContains(response, '<strong>prompting</strong>', count=2)
+
+    def test_backfill_command(self):
+        product = make_product(description=self.description)
+        Product.objects.filter(pk=product.pk).update(description_html='')
+        call_command('render_descriptions', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.description_html, linebreaks(markdownify(self.description)))
+
+
+class CategoryRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ai = Category.objects.create(name='AI', slug='ai')
+        make_product(self.ai)
+
+    def category_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [q for q in queries if 'FROM "store_category"' in q['sql']], response
+
+    def test_pages_do_not_query_categories(self):
+        registry.all()
+        for url in [
+            reverse('store:home'),
+            reverse('store:product_list'),
+            reverse('store:product_list_by_category', args=['ai']),
+            reverse('store:search') + '?q=chat',
+        ]:
+            with self.subTest(url=url):
+                queries, response = self.category_queries(url)
+                self.assertEqual(queries, [])
+                self.assertEqual(list(response.context['categories']), [self.ai])
+
+    def test_unknown_slug_is_404(self):
+        response = self.client.get(reverse('store:product_list_by_category', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_changes_are_picked_up_through_the_version_key(self):
+        self.assertEqual(registry.id_for_slug('ai'), self.ai.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            design = Category.objects.create(name='Design', slug='design')
+        self.assertEqual(registry.get_by_slug('design'), design)
+        self.assertEqual(registry.all(), [self.ai, design])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            design.delete()
+        self.assertIsNone(registry.get_by_slug('design'))
+
+
+class ReviewPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_review(self.product, 5, title='Great')
+        self.url = reverse('store:get_reviews_ajax', args=[self.product.pk])
+
+    def test_matching_etag_gets_not_modified_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['reviews'][0]['title'], 'Great')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_page_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+
+    def test_approval_changes_invalidate_pages(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            review = make_review(self.product, 3, status='pending', title='Okay')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.filter(pk=review.pk).set_status('approved')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([r['title'] for r in response.json()['reviews']], ['Okay', 'Great'])
+
+    def test_invalid_cursors_share_the_first_page(self):
+        etag = self.client.get(self.url)['ETag']
+        for cursor in ('junk', 'junk2', 'bm90IGpzb24'):
+            with self.assertNumQueries(0):  # served from the first page's cache entry
+                response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response['ETag'], etag)
+
+    def test_missing_product(self):
+        missing = self.product.pk + 1
+        url = reverse('store:get_reviews_ajax', args=[missing])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertIsNone(cache.get(Review.PAGE_VERSION_KEY.format(missing)))
+
+    def test_version_stamps_expire(self):
+        with mock.patch.object(cache, 'get_or_set', wraps=cache.get_or_set) as get_or_set:
+            cache.clear()
+            self.client.get(self.url)
+        self.assertTrue(get_or_set.call_args_list)
+        for call in get_or_set.call_args_list:
+            self.assertEqual(call.args[2], Review.PAGE_VERSION_TIMEOUT)
+
+
+class ReviewAdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin_user)
+        self.url = reverse('admin:store_review_changelist')
+
+    def add_reviews(self, count):
+        for i in range(count):
+            product = make_product(title=f'Book {Review.objects.count()}')
+            make_review(product, 1 + i % 5, status='pending' if i % 2 else 'approved')
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_reviews(5)
+        few = self.changelist_queries()
+        self.add_reviews(25)
+        self.assertEqual(self.changelist_queries(), few)
+
+    def test_product_filter_loads_only_selected_product(self):
+        self.add_reviews(10)
+        product = Review.objects.first().product
+        response = self.client.get(self.url, {'product__id__exact': product.pk})
+        self.assertEqual(list(response.context['cl'].result_list), [Review.objects.first()])
+        self.assertContains(response, 'id="product-filter"')
+        # One extra query renders the selected product's label, however many products exist
+        self.assertEqual(self.changelist_queries(product__id__exact=product.pk),
+                         self.changelist_queries(status__exact='approved') + 1)
+
+    def test_invalid_product_filter_is_rejected(self):
+        response = self.client.get(self.url, {'product__id__exact': 'abc'})
+        self.assertRedirects(response, f'{self.url}?e=1', fetch_redirect_response=False)
+
+    def test_large_table_count_is_estimated(self):
+        from .pagination import EstimatedCountPaginator
+
+        self.add_reviews(3)
+        paginator = EstimatedCountPaginator(Review.objects.all(), 25)
+        with mock.patch('store.pagination.estimate_row_count', return_value=50_000):
+            self.assertEqual(paginator.count, 50_000)
+        filtered = EstimatedCountPaginator(Review.objects.filter(status='approved'), 25)
+        with mock.patch('store.pagination.estimate_row_count', return_value=50_000):
+            self.assertEqual(filtered.count, 2)
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        self.assertTrue(query_plans.HOT_QUERIES)
+        for name, build in query_plans.HOT_QUERIES.items():
+            with self.subTest(name):
+                self.assertEqual(query_plans.sequential_scans(build()), [])
+
+    def test_unindexed_lookup_is_reported(self):
+        self.assertTrue(query_plans.sequential_scans(Order.objects.filter(trx_id='TR0011')))
+
+
+class QueryBudgetTests(TestCase):
+    """Upper bounds on the queries each storefront view may run"""
+    BUDGETS = {
+        'store:home': 4,
+        'store:product_list': 1,
+        'store:product_detail': 3,
+        'store:get_reviews_ajax': 2,
+        'store:search': 2,
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product()
+        for i in range(6):
+            make_review(self.product, i % 5 + 1)
+
+    def get(self, view_name, *args, **params):
+        with query_budget(self.BUDGETS[view_name], view_name):
+            response = self.client.get(reverse(view_name, args=args), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_views_stay_within_budget(self):
+        self.get('store:home')
+        self.get('store:product_list')
+        self.get('store:product_detail', self.product.pk)
+        self.get('store:get_reviews_ajax', self.product.pk)
+        self.get('store:search', q='chatgpt')
+
+    def test_exceeding_the_budget_fails(self):
+        with self.assertRaisesMessage(AssertionError, 'ran 2 queries, budget is 1'):
+            with query_budget(1):
+                Product.objects.count()
+                Review.objects.count()
+
+
+class QueryStatsMiddlewareTests(TestCase):
+    def setUp(self):
+        query_stats.reset()
+        self.product = make_product()
+
+    @override_settings(QUERY_STATS=True)
+    def test_stats_are_recorded_per_url_name(self):
+        url = reverse('store:product_detail', args=[self.product.pk])
+        requests = metric_value('store_request_db_queries_count', view='store:product_detail')
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(
+            metric_value('store_request_db_queries_count', view='store:product_detail'),
+            requests + 2,
+        )
+        stats = query_stats.snapshot()['store:product_detail']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertLessEqual(len(stats['slowest']), query_stats.SLOWEST_KEPT)
+        ms, sql, origin = stats['slowest'][0]
+        self.assertIn('SELECT', sql)
+        self.assertTrue(origin.startswith('store'))
+
+    @override_settings(QUERY_STATS=True, SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('store.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('store:product_detail', args=[self.product.pk]))
+        self.assertIn('[store:product_detail]', logs.output[0])
+
+    @override_settings(QUERY_STATS=True)
+    def test_totals_are_listed_for_staff(self):
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        self.client.get(reverse('store:product_detail', args=[self.product.pk]))
+        response = self.client.get(reverse('admin_profiles'))
+        self.assertContains(response, 'Database queries in this worker')
+        self.assertContains(response, 'store:product_detail')
+
+    def test_disabled_by_default(self):
+        self.client.get(reverse('store:product_detail', args=[self.product.pk]))
+        self.assertEqual(query_stats.snapshot(), {})
+
+    @override_settings(QUERY_STATS=True)
+    async def test_middleware_stays_async_under_asgi(self):
+        from .middleware import MetricsMiddleware, QueryStatsMiddleware, RequestProfileMiddleware
+
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware in (MetricsMiddleware, QueryStatsMiddleware, RequestProfileMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(get_response)))
+
+        # Opened before the middleware existed, so it missed connection_created
+        await sync_to_async(query_stats.install)(connection)
+        response = await AsyncClient().get(reverse('store:product_detail', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 200)
+        stats = query_stats.snapshot()['store:product_detail']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+
+
+class BenchmarkViewsTests(TestCase):
+    def test_benchmark_leaves_download_counts_alone(self):
+        call_command('generate_catalog', products=5, categories=1, batch_size=5, stdout=StringIO())
+        paid = Order.objects.filter(status='paid').order_by('-created_at').first()
+        events = DownloadEvent.objects.count()
+        with tempfile.NamedTemporaryFile(suffix='.json') as output, mock.patch(
+            'store.management.commands.benchmark_views.setup_test_environment',
+        ):  # the test runner already did
+            call_command(
+                'benchmark_views', view=['download_ebook'], repeat=2, warmup=1,
+                output=output.name, stdout=StringIO(),
+            )
+            report = json.load(output)
+        self.assertEqual(report['views']['download_ebook']['requests'], 2)
+        self.assertEqual(Order.objects.get(pk=paid.pk).downloads, paid.downloads)
+        self.assertEqual(DownloadEvent.objects.count(), events)
+
+
+class GenerateCatalogTests(TestCase):
+    def generate(self, **options):
+        call_command('generate_catalog', products=30, categories=3, batch_size=10,
+                     stdout=StringIO(), **options)
+
+    def test_generated_catalog_is_consistent(self):
+        self.generate()
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(Category.objects.filter(slug__startswith='synthetic-').count(), 3)
+        statuses = list(Review.objects.values_list('status', flat=True))
+        self.assertGreater(statuses.count('approved'), len(statuses) / 2)
+        for product in Product.objects.with_rating_stats():
+            approved = product.reviews.filter(status='approved')
+            self.assertEqual(product.rating_count, approved.count())
+        self.assertEqual(
+            StoreCounter.snapshot()[StoreCounter.PAID_ORDERS],
+            Order.objects.filter(status='paid').count(),
+        )
+        self.assertTrue(all(Product.objects.values_list('description_html', flat=True)))
+        self.assertTrue(search.search_products(Product.objects.first().title.split()[0]))
+
+    def test_same_seed_same_catalog(self):
+        def fingerprint():
+            return (
+                list(Product.objects.order_by('pk').values_list('title', 'price')),
+                list(Review.objects.order_by('pk').values_list('rating', 'status')),
+                sorted(Order.objects.values_list('id', 'status')),
+            )
+
+        self.generate(seed=7)
+        first = fingerprint()
+        DownloadEvent.record([(Order.objects.values_list('pk', flat=True).first(), timezone.now())])
+        self.generate(seed=7, flush=True)
+        self.assertEqual(fingerprint(), first)
+        self.assertFalse(DownloadEvent.objects.exists())
+
+
+class RequestProfileTests(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        self.settings_override = self.settings(PROFILE_DIR=self.profile_dir.name, PROFILE_KEEP=2)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        self.url = reverse('store:product_detail', args=[make_product().pk])
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'_profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        [profile] = profiling.recent_profiles()
+        self.assertEqual(response['X-Profile'], profile['name'])
+        self.assertIn('store-product_detail', profile['name'])
+        self.assertEqual(set(profile['files']), {'pstats', 'collapsed'})
+        stacks = profile['files']['collapsed'].read_text()
+        self.assertIn('product_detail (views.py:', stacks)
+        for line in stacks.splitlines():
+            stack, weight = line.rsplit(' ', 1)
+            self.assertGreater(int(weight), 0)
+
+        response = self.client.get(reverse('admin_profiles'))
+        self.assertContains(response, profile['name'])
+        response = self.client.get(reverse('admin_profile_download', args=[profile['name'], 'pstats']))
+        self.assertEqual(response.status_code, 200)
+
+    def test_header_trigger_and_pruning(self):
+        self.client.force_login(self.staff)
+        for _ in range(3):
+            self.client.get(self.url, HTTP_X_PROFILE='1')
+        self.assertEqual(len(profiling.recent_profiles()), 2)
+
+    def test_not_profiled_without_trigger_or_for_customers(self):
+        self.client.get(self.url, {'_profile': '1'})
+        self.client.force_login(User.objects.create_user('reader', 'reader@example.com', 'pw'))
+        response = self.client.get(self.url, {'_profile': '1'})
+        self.assertNotIn('X-Profile', response)
+        self.client.force_login(self.staff)
+        self.client.get(self.url)
+        self.assertEqual(profiling.recent_profiles(), [])
+        self.assertEqual(self.client.get(reverse('admin_profiles')).status_code, 200)
+
+
+class StubGateway:
+    """Local HTTP server standing in for the bKash API
+
+    ``responses`` maps a path to a list of ``(status, body, delay)`` tuples,
+    served in order (the last one repeats); every request is recorded.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                gateway.requests.append((self.path, self.client_address[1], dict(self.headers), body))
+                queue = gateway.responses.get(self.path) or [(404, {}, 0)]
+                status, payload, delay = queue.pop(0) if len(queue) > 1 else queue[0]
+                time.sleep(delay)
+                content = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up waiting
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def paths(self):
+        return [path for path, _, _, _ in self.requests]
+
+
+GRANT = '/tokenized/checkout/token/grant'
+CREATE = '/tokenized/checkout/create'
+STATUS = '/tokenized/checkout/payment/status'
+
+
+class BkashServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gateway = StubGateway()
+        self.addCleanup(self.gateway.close)
+        self.gateway.responses[GRANT] = [(200, {'id_token': 'token-1'}, 0)]
+        config = {
+            **settings.BKASH_CONFIG, 'PRODUCTION_BASE_URL': self.gateway.url, 'READ_TIMEOUT': 0.5,
+        }
+        override = self.settings(BKASH_CONFIG=config)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.service = BkashService()
+        for adapter in self.service.session.adapters.values():
+            adapter.max_retries.backoff_factor = 0
+        self.addCleanup(self.service.session.close)
+
+    def test_connections_are_reused(self):
+        self.gateway.responses[STATUS] = [(200, {'transactionStatus': 'Completed'}, 0)]
+        for _ in range(3):
+            self.assertEqual(self.service.query_payment('P1')['transactionStatus'], 'Completed')
+        self.assertEqual(self.gateway.paths(), [GRANT, STATUS, STATUS, STATUS])
+        ports = {port for path, port, _, _ in self.gateway.requests if path == STATUS}
+        self.assertEqual(len(ports), 1)
+        headers = self.gateway.requests[1][2]
+        self.assertEqual(headers['authorization'], 'token-1')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_idempotent_calls_are_retried(self):
+        self.gateway.responses[GRANT] = [(503, {}, 0), (502, {}, 0), (200, {'id_token': 'token-2'}, 0)]
+        self.assertEqual(self.service.get_token(), 'token-2')
+        self.assertEqual(self.gateway.paths(), [GRANT] * 3)
+
+        self.gateway.responses[STATUS] = [(200, {}, 1), (200, {'transactionStatus': 'Completed'}, 0)]
+        self.assertEqual(self.service.query_payment('P1'), {'transactionStatus': 'Completed'})
+
+    def test_payment_creation_is_not_retried(self):
+        self.gateway.responses[CREATE] = [(503, {}, 0), (200, {'statusCode': '0000'}, 0)]
+        self.assertIsNone(self.service.create_payment(100, 'INV-1'))
+        self.assertEqual(self.gateway.paths(), [GRANT, CREATE])
+
+    def test_slow_gateway_times_out(self):
+        self.gateway.responses[CREATE] = [(200, {'statusCode': '0000'}, 2)]
+        start = time.perf_counter()
+        with self.assertLogs('store.bkash_service', 'WARNING'):
+            self.assertIsNone(self.service.create_payment(100, 'INV-1'))
+        self.assertLess(time.perf_counter() - start, 1.5)
+
+    def test_unreachable_gateway(self):
+        self.gateway.close()
+        with self.assertLogs('store.bkash_service', 'WARNING'):
+            self.assertIsNone(self.service.get_token())
+
+    def test_service_is_shared(self):
+        from .bkash_service import get_bkash_service
+
+        self.assertIs(get_bkash_service(), get_bkash_service())
+
+
+
+REFRESH = '/tokenized/checkout/token/refresh'
+
+
+class TokenManagerTests(TransactionTestCase):
+    # Threads share the token through the database, on their own connections.
+
+    def setUp(self):
+        cache.clear()
+        self.gateway = StubGateway()
+        self.addCleanup(self.gateway.close)
+        self.gateway.responses[GRANT] = [
+            (200, {'id_token': 'granted', 'refresh_token': 'r-1', 'expires_in': 3600}, 0.2)
+        ]
+        self.gateway.responses[REFRESH] = [
+            (200, {'id_token': 'refreshed', 'refresh_token': 'r-2', 'expires_in': 3600}, 0)
+        ]
+        override = self.settings(
+            BKASH_CONFIG={**settings.BKASH_CONFIG, 'PRODUCTION_BASE_URL': self.gateway.url}
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.now = 1_000_000.0
+
+    def manager(self):
+        service = BkashService()
+        self.addCleanup(service.session.close)
+        service.tokens = TokenManager(service, clock=lambda: self.now)
+        return service.tokens
+
+    def test_concurrent_requests_share_one_grant(self):
+        manager = self.manager()
+        tokens = []
+
+        def request():
+            tokens.append(manager.get_token())
+            connection.close()
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['granted'] * 8)
+        self.assertEqual(self.gateway.paths(), [GRANT])
+
+        # Another worker picks the token up from the database.
+        self.assertEqual(self.manager().get_token(), 'granted')
+        self.assertEqual(self.gateway.paths(), [GRANT])
+
+    def test_waits_for_a_refresh_in_another_process(self):
+        self.assertTrue(BkashToken.claim('other-process', self.now, 30))
+        self.assertFalse(BkashToken.claim('this-process', self.now, 30))
+
+        def other_process_finishes():
+            time.sleep(0.2)
+            BkashToken.store({
+                'id_token': 'theirs', 'refresh_token': 'r-9', 'expires_at': self.now + 3600,
+            })
+            connection.close()
+
+        threading.Thread(target=other_process_finishes).start()
+        self.assertEqual(self.manager().get_token(), 'theirs')
+        self.assertEqual(self.gateway.paths(), [])
+
+    def test_refreshes_ahead_of_expiry_in_the_background(self):
+        manager = self.manager()
+        self.assertEqual(manager.get_token(), 'granted')
+        self.now += 3600 - TokenManager.REFRESH_AHEAD + 1
+
+        self.assertEqual(manager.get_token(), 'granted')  # still valid, served at once
+        manager._background.join()
+        self.assertEqual(manager.get_token(), 'refreshed')
+        self.assertEqual(self.gateway.paths(), [GRANT, REFRESH])
+        self.assertEqual(self.gateway.requests[-1][3]['refresh_token'], 'r-1')
+
+    def test_expired_token_falls_back_to_grant_when_refresh_fails(self):
+        manager = self.manager()
+        manager.get_token()
+        self.gateway.responses[REFRESH] = [(401, {'statusCode': '2079'}, 0)]
+        self.now += 7200
+        self.assertEqual(manager.get_token(), 'granted')
+        self.assertEqual(self.gateway.paths(), [GRANT, REFRESH, GRANT])
+        self.assertEqual(BkashToken.objects.get().lease_owner, '')
+
+
+
+class AsyncPaymentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gateway = FakeBkashGateway(latency=0.3).start()
+        self.addCleanup(self.gateway.stop)
+        self.service = AsyncBkashService(BkashService(base_url=self.gateway.url))
+        self.addCleanup(self.service.service.session.close)
+        patcher = mock.patch('store.views.get_async_bkash_service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.order = Order.objects.create(
+            customer_name='Reader', email='reader@example.com', phone='01700000000',
+            product=make_product(), amount=250,
+        )
+
+    async def test_gateway_waits_overlap(self):
+        await self.service.get_token()
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            self.service.create_payment(100, f'INV-{i}') for i in range(20)
+        ))
+        elapsed = time.perf_counter() - start
+        await self.service.aclose()
+        self.assertEqual({response['statusCode'] for response in responses}, {'0000'})
+        # Twenty 300 ms round trips, one after another, would take six seconds.
+        self.assertLess(elapsed, 2)
+
+    async def test_create_and_execute_views(self):
+        from .views import create_payment_async, execute_payment_async
+
+        factory = AsyncRequestFactory()
+        request = factory.post(
+            '/api/create-payment/', {'order_id': str(self.order.id)},
+            content_type='application/json',
+        )
+        data = json.loads((await create_payment_async(request)).content)
+        self.assertTrue(data['success'])
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual(order.bkash_payment_id, data['payment_id'])
+
+        request = factory.get('/api/execute-payment/', {'paymentID': data['payment_id']})
+        response = await execute_payment_async(request)
+        await self.service.aclose()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse('store:payment_success', args=[self.order.id]))
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual(order.status, 'paid')
+        self.assertTrue(order.trx_id)
+
+    def use_async_urls(self):
+        """Bind the URLs as ``ASYNC_PAYMENT_VIEWS=True`` does at import time"""
+        import core.urls
+        from . import urls
+
+        def reload():
+            importlib.reload(urls)
+            importlib.reload(core.urls)
+            clear_url_caches()
+
+        override = override_settings(ASYNC_PAYMENT_VIEWS=True)
+        override.enable()
+        reload()
+        self.addCleanup(reload)
+        self.addCleanup(override.disable)
+
+    async def test_payment_flow_through_asgi_handler(self):
+        self.use_async_urls()
+        client = AsyncClient(enforce_csrf_checks=True)
+        response = await client.post(
+            reverse('store:create_payment'), {'order_id': str(self.order.id)},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertTrue(data['success'])
+
+        response = await client.get(
+            reverse('store:payment_callback'), {'paymentID': data['payment_id']},
+        )
+        await self.service.aclose()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse('store:payment_success', args=[self.order.id]))
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual(order.status, 'paid')
+
+    async def test_unknown_order(self):
+        from .views import create_payment_async
+
+        request = AsyncRequestFactory().post(
+            '/api/create-payment/', {'order_id': '00000000-0000-4000-8000-000000000000'},
+            content_type='application/json',
+        )
+        with self.assertLogs('store.views', 'ERROR'):
+            data = json.loads((await create_payment_async(request)).content)
+        self.assertFalse(data['success'])
+        self.assertEqual(self.gateway.calls, {})
+
+
+class ReconcilePaymentsTests(TransactionTestCase):
+    # The query workers read and write the token on their own connections.
+
+    def setUp(self):
+        cache.clear()
+        self.gateway = FakeBkashGateway().start()
+        self.addCleanup(self.gateway.stop)
+        service = BkashService(base_url=self.gateway.url)
+        self.addCleanup(service.session.close)
+        patcher = mock.patch(
+            'store.management.commands.reconcile_payments.get_bkash_service', return_value=service,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.product = make_product()
+
+    def make_order(self, status='Initiated', minutes_ago=60, **kwargs):
+        payment_id = f'TR{Order.objects.count():08d}'
+        order = Order.objects.create(
+            customer_name='Reader', email='reader@example.com', phone='01700000000',
+            product=self.product, amount=250, bkash_payment_id=payment_id, **kwargs,
+        )
+        self.gateway.payments[payment_id] = {'paymentID': payment_id, 'transactionStatus': status}
+        if status == 'Completed':
+            self.gateway.payments[payment_id]['trxID'] = f'TRX{payment_id}'
+        Order.objects.filter(pk=order.pk).update(
+            updated_at=timezone.now() - timedelta(minutes=minutes_ago),
+        )
+        return order
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_payments', '--rate', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_settles_stale_orders(self):
+        completed = self.make_order('Completed')
+        cancelled = self.make_order('Cancelled')
+        initiated = self.make_order('Initiated')
+        recent = self.make_order('Completed', minutes_ago=1)
+        unknown = self.make_order()
+        del self.gateway.payments[unknown.bkash_payment_id]
+
+        output = self.reconcile('--batch-size', '2')
+
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[completed.pk], 'paid')
+        self.assertEqual(statuses[cancelled.pk], 'failed')
+        self.assertEqual(statuses[initiated.pk], 'pending')
+        self.assertEqual(statuses[recent.pk], 'pending')
+        self.assertEqual(statuses[unknown.pk], 'pending')
+        completed.refresh_from_db()
+        self.assertEqual(completed.trx_id, f'TRX{completed.bkash_payment_id}')
+        self.assertIsNotNone(completed.paid_at)
+        self.assertEqual(StoreCounter.objects.get(name=StoreCounter.PAID_ORDERS).value, 1)
+        self.assertEqual(self.gateway.calls['/tokenized/checkout/payment/status'], 4)
+        self.assertIn('4 orders', output)
+        self.assertIn('1 paid, 1 failed, 1 pending, 1 error, 0 skipped', output)
+        self.assertIsNone(JobLease.holder(reconcile_payments.LOCK_NAME))
+
+    def test_dry_run_changes_nothing(self):
+        order = self.make_order('Completed')
+        output = self.reconcile('--dry-run')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.assertIn('1 paid', output)
+
+    def test_skips_orders_settled_meanwhile(self):
+        order = self.make_order('Completed')
+        command = reconcile_payments.Command()
+        self.assertEqual(command.apply([(order.pk, 'paid', 'TRX1')]), set())
+        self.assertEqual(command.apply([(order.pk, 'failed', None)]), {order.pk})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'paid')
+
+    def test_lock_prevents_overlapping_runs(self):
+        order = self.make_order('Completed')
+        self.assertTrue(JobLease.claim(reconcile_payments.LOCK_NAME, 'other', 60))
+        output = self.reconcile()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.assertIn('Another reconciliation is running', output)
+        self.assertEqual(JobLease.holder(reconcile_payments.LOCK_NAME), 'other')
+
+        JobLease.objects.filter(name=reconcile_payments.LOCK_NAME).update(until=0)  # it crashed
+        self.reconcile()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'paid')
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = reconcile_payments.RateLimiter(50)
+        start = time.perf_counter()
+        for _ in range(6):
+            limiter.wait()
+        # The first call goes straight through, the other five wait 20 ms each.
+        self.assertGreaterEqual(time.perf_counter() - start, 0.09)
+
+
+class PaymentExecutionTests(TestCase):
+    EXECUTE = '/tokenized/checkout/execute'
+
+    def setUp(self):
+        cache.clear()
+        self.gateway = FakeBkashGateway().start()
+        self.addCleanup(self.gateway.stop)
+        self.service = BkashService(base_url=self.gateway.url)
+        self.addCleanup(self.service.session.close)
+        patcher = mock.patch('store.views.get_bkash_service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.payment_id = self.gateway.handle(
+            '/tokenized/checkout/create', {'amount': '250'},
+        )[1]['paymentID']
+        self.order = Order.objects.create(
+            customer_name='Reader', email='reader@example.com', phone='01700000000',
+            product=make_product(), amount=250, bkash_payment_id=self.payment_id,
+        )
+
+    def paid_orders(self):
+        return StoreCounter.objects.get(name=StoreCounter.PAID_ORDERS).value
+
+    def test_repeat_callbacks_execute_once(self):
+        success = reverse('store:payment_success', args=[self.order.id])
+        url = reverse('store:payment_callback')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url, {'paymentID': self.payment_id})
+        self.assertRedirects(response, success, fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(self.order.trx_id, self.gateway.payments[self.payment_id]['trxID'])
+        self.assertIsNotNone(self.order.paid_at)
+
+        # Served from the cache: no bKash call and no database query
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'paymentID': self.payment_id})
+        self.assertRedirects(response, success, fetch_redirect_response=False)
+        cache.clear()
+        response = self.client.get(url, {'paymentID': self.payment_id})
+        self.assertRedirects(response, success, fetch_redirect_response=False)
+
+        self.assertEqual(self.gateway.calls[self.EXECUTE], 1)
+        self.assertEqual(self.paid_orders(), 1)
+        self.assertEqual(BestsellerRank.objects.get(window='7d').sales, 1)
+
+    def test_missing_payment_id_is_rejected(self):
+        self.order.status = 'paid'
+        self.order.bkash_payment_id = None
+        self.order.save()
+        url = reverse('store:payment_callback')
+        for params in ({}, {'paymentID': ''}, {'paymentID': '  '}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.gateway.calls, {})
+        with self.assertRaises(ValueError):
+            payments.lookup(None)
+        with self.assertRaises(ValueError):
+            Order.mark_paid('', 'TRX1')
+
+    def test_mark_paid_only_counts_pending_orders(self):
+        self.assertTrue(Order.mark_paid(self.payment_id, 'TRX1'))
+        self.assertFalse(Order.mark_paid(self.payment_id, 'TRX2'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.trx_id, 'TRX1')
+        self.assertEqual(self.paid_orders(), 1)
+
+    def test_concurrent_execution_waits_for_the_holder(self):
+        lease = Order.claim_execution(self.payment_id, payments.LOCK_TIMEOUT)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(Order.claim_execution(self.payment_id, payments.LOCK_TIMEOUT))
+
+        def finish(seconds):  # the holder settles the order while we wait
+            Order.mark_paid(self.payment_id, 'TRX1')
+            Order.release_execution(self.payment_id, lease)
+
+        execute = mock.Mock()
+        with mock.patch('store.payments.time.sleep', side_effect=finish) as sleep:
+            result = payments.execute(self.payment_id, execute)
+        self.assertEqual(result, payments.Result(str(self.order.id)))
+        sleep.assert_called_once()
+        execute.assert_not_called()
+
+    def test_failed_execution_is_not_cached(self):
+        execute = mock.Mock(return_value={'statusCode': '2056'})
+        result = payments.execute(self.payment_id, execute)
+        self.assertEqual(result.error, payments.EXECUTION_FAILED)
+        self.assertIsNone(cache.get(payments.RESULT_KEY.format(self.payment_id)))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+        self.assertEqual(self.order.execute_lease_until, 0)  # a retry may execute again
+
+
+class FakeBkashGatewayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def service(self, **kwargs):
+        gateway = FakeBkashGateway(**kwargs).start()
+        self.addCleanup(gateway.stop)
+        service = BkashService(base_url=gateway.url)
+        self.addCleanup(service.session.close)
+        return gateway, service
+
+    def test_error_rate(self):
+        gateway, service = self.service(error_rate=1, error_status=502, seed=1)
+        with self.assertLogs('store.bkash_service', 'ERROR'):
+            self.assertIsNone(service.get_token())
+        # Grant is idempotent, so the session retried it before giving up
+        self.assertEqual(gateway.calls['/tokenized/checkout/token/grant'], 3)
+
+    def test_status_codes(self):
+        gateway, service = self.service(status_codes={'execute': '2023'})
+        payment = service.create_payment(100, 'INV-1')
+        response = service.execute_payment(payment['paymentID'])
+        self.assertEqual(response['statusCode'], '2023')
+        self.assertEqual(response['statusMessage'], 'Insufficient Balance')
+        status = service.query_payment(payment['paymentID'])
+        self.assertEqual(status['transactionStatus'], 'Initiated')
+
+    def test_base_url_setting(self):
+        with override_settings(
+            BKASH_CONFIG={**settings.BKASH_CONFIG, 'BASE_URL': 'http://127.0.0.1:8765'},
+        ):
+            self.assertEqual(get_bkash_service().base_url, 'http://127.0.0.1:8765')
+        self.assertEqual(
+            get_bkash_service().base_url, settings.BKASH_CONFIG['PRODUCTION_BASE_URL'],
+        )
+
+
+class LoadtestCheckoutTests(TransactionTestCase):
+    # Workers use their own connections, so the orders must really be committed.
+
+    def test_checkout_flows(self):
+        product = make_product()
+        out = StringIO()
+        call_command(
+            'loadtest_checkout', '--orders', '3', '--workers', '1', '--latency', '0',
+            '--product', str(product.pk), stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn('Paid 3/3 orders', output)
+        self.assertIn('database lock errors: 0', output)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(StoreCounter.objects.get(name=StoreCounter.PAID_ORDERS).value, 0)
+        # The fake gateway's token stayed in the run's own service
+        self.assertFalse(BkashToken.objects.exists())
+        self.assertNotIn('127.0.0.1', get_bkash_service().base_url)
+
+
+def metric_value(name, **labels):
+    """A sample's value in what ``/metrics`` would serve right now"""
+    for family in text_string_to_metric_families(metrics.render().decode()):
+        for sample in family.samples:
+            if sample.name == name and sample.labels == labels:
+                return sample.value
+    return 0
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_gateway_calls(self):
+        gateway = FakeBkashGateway(status_codes={'execute': '2023'}).start()
+        self.addCleanup(gateway.stop)
+        service = BkashService(base_url=gateway.url)
+        self.addCleanup(service.session.close)
+        creates = metric_value('bkash_request_duration_seconds_count', endpoint='create')
+        declined = metric_value('bkash_request_errors_total', endpoint='execute', reason='bkash_2023')
+
+        payment = service.create_payment(100, 'INV-1')
+        service.execute_payment(payment['paymentID'])
+
+        self.assertEqual(
+            metric_value('bkash_request_duration_seconds_count', endpoint='create'), creates + 1,
+        )
+        self.assertEqual(
+            metric_value('bkash_request_errors_total', endpoint='execute', reason='bkash_2023'),
+            declined + 1,
+        )
+        self.assertEqual(metric_value('bkash_requests_in_flight', endpoint='create'), 0)
+
+    def test_unreachable_gateway(self):
+        gateway = FakeBkashGateway()
+        url = gateway.url
+        gateway.server.server_close()  # nothing listens there any more
+        service = BkashService(base_url=url)
+        self.addCleanup(service.session.close)
+        failures = metric_value('bkash_request_errors_total', endpoint='grant', reason='connection')
+        with self.assertLogs('store.bkash_service', 'WARNING'):
+            self.assertIsNone(service.grant_token())
+        self.assertEqual(
+            metric_value('bkash_request_errors_total', endpoint='grant', reason='connection'),
+            failures + 1,
+        )
+
+    def test_samples_stay_in_this_test_run(self):
+        self.assertEqual(os.environ['PROMETHEUS_MULTIPROC_DIR'], settings.METRICS_DIR)
+        self.assertIn('aishikkha-test-metrics-', settings.METRICS_DIR)
+        metrics.BREAKER_REJECTIONS.inc()
+        self.assertTrue(os.listdir(settings.METRICS_DIR))
+
+    def test_request_latency(self):
+        labels = {'view': 'store:search_suggest', 'method': 'GET', 'status': '2xx'}
+        before = metric_value('store_request_duration_seconds_count', **labels)
+        self.client.get(reverse('store:search_suggest'), {'q': 'py'})
+        self.assertEqual(metric_value('store_request_duration_seconds_count', **labels), before + 1)
+
+    def test_staff_only(self):
+        User.objects.create_user('reader', 'reader@example.com', 'pw')
+        User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        url = reverse('metrics')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
+        response = self.client.get(url, HTTP_AUTHORIZATION='Basic cmVhZGVyOnB3')  # reader:pw
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get(url, HTTP_AUTHORIZATION='Basic c3RhZmY6cHc=')  # staff:pw
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'store_request_duration_seconds', response.content)
+
+        self.client.login(username='staff', password='pw')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 1_000_000.0
+        self.breaker = CircuitBreaker(clock=lambda: self.now)
+        self.breaker.MIN_CALLS = 4
+
+    def trip(self):
+        with self.assertLogs('store.bkash_service', 'WARNING') as logs:
+            for _ in range(4):
+                self.breaker.record(False, 0.1)
+        self.assertIn('bKash circuit opened (4 of 4 calls failed', logs.output[0])
+
+    def test_opens_on_failure_rate(self):
+        for ok in (True, True, False, True, False):
+            self.breaker.record(ok, 0.1)
+        self.assertEqual(self.breaker.state(), 'closed')  # 2 of 5 failed
+        self.assertFalse(self.breaker.before_call())
+
+        with self.assertLogs('store.bkash_service', 'WARNING') as logs:
+            self.breaker.record(True, CircuitBreaker.SLOW_CALL)  # too slow counts as failed
+        self.assertIn('3 of 6 calls failed', logs.output[0])
+        self.assertEqual(self.breaker.state(), 'open')
+        with self.assertRaises(GatewayUnavailable) as raised:
+            self.breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, CircuitBreaker.OPEN_SECONDS)
+
+    def test_old_failures_leave_the_window(self):
+        for _ in range(3):
+            self.breaker.record(False, 0.1)
+        self.now += CircuitBreaker.WINDOW + CircuitBreaker.BUCKET
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state(), 'closed')
+
+    def test_half_open_probe(self):
+        self.trip()
+        self.now += CircuitBreaker.OPEN_SECONDS
+        self.assertEqual(self.breaker.state(), 'half_open')
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.before_call())
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(GatewayUnavailable):
+            self.breaker.before_call()  # only one probe at a time
+
+        with self.assertLogs('store.bkash_service', 'WARNING'):
+            self.breaker.record(True, 0.1, probe=True)
+        self.assertEqual(self.breaker.state(), 'closed')
+        # A fresh window: one more failure does not reopen it
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state(), 'closed')
+
+    def test_workers_share_one_state(self):
+        other = CircuitBreaker(clock=lambda: self.now)  # as in another process
+        other.MIN_CALLS = 4
+        stale = other._state()
+        with self.assertLogs('store.bkash_service', 'WARNING') as logs:
+            for breaker in (self.breaker, other, self.breaker, other):
+                breaker.record(False, 0.1)
+            self.assertEqual(other.state(), 'closed')  # each has only seen its own two
+            self.now += CircuitBreaker.FLUSH_SECONDS
+            self.breaker.record(False, 0.1)
+            other.record(False, 0.1)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('6 of 6 calls failed', logs.output[0])
+        self.assertEqual(other.state(), 'open')
+        with self.assertNoLogs('store.bkash_service', 'WARNING'):
+            other._transition(stale, 'open', 'counted twice')  # someone already moved on
+
+        self.now += CircuitBreaker.OPEN_SECONDS
+        self.assertTrue(other.before_call())
+        with self.assertRaises(GatewayUnavailable):
+            self.breaker.before_call()  # the probe slot is taken for every worker
+
+    def test_successful_calls_are_written_in_batches(self):
+        with self.assertNumQueries(1):  # reading the state
+            for _ in range(10):
+                self.breaker.record(True, 0.1)
+        self.assertFalse(CircuitBreakerBucket.objects.exists())
+        self.now += CircuitBreaker.FLUSH_SECONDS
+        self.breaker.record(True, 0.1)
+        self.assertEqual(CircuitBreakerBucket.objects.get().calls, 11)
+
+    def test_isolated_service_keeps_its_own_breaker(self):
+        service = BkashService(base_url='http://127.0.0.1:9', isolated=True)
+        self.addCleanup(service.session.close)
+        service.breaker.clock = lambda: self.now
+        service.breaker.MIN_CALLS = 4
+        with self.assertLogs('store.bkash_service', 'WARNING'):
+            for _ in range(4):
+                service.breaker.record(False, 0.1)
+        self.assertEqual(service.breaker.state(), 'open')
+        self.assertEqual(self.breaker.state(), 'closed')
+        self.assertFalse(CircuitBreakerState.objects.exists())
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.now += CircuitBreaker.OPEN_SECONDS
+        self.assertTrue(self.breaker.before_call())
+        with self.assertLogs('store.bkash_service', 'WARNING'):
+            self.breaker.record(False, 0.1, probe=True)
+        self.assertEqual(self.breaker.state(), 'open')
+        self.assertEqual(self.breaker.retry_after(), CircuitBreaker.OPEN_SECONDS)
+
+
+class GatewayFastFailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gateway = FakeBkashGateway().start()
+        self.addCleanup(self.gateway.stop)
+        self.service = BkashService(base_url=self.gateway.url)
+        self.service.breaker.MIN_CALLS = 4
+        self.addCleanup(self.service.session.close)
+        patcher = mock.patch('store.views.get_bkash_service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.order = Order.objects.create(
+            customer_name='Reader', email='reader@example.com', phone='01700000000',
+            product=make_product(), amount=250,
+        )
+
+    def create_payment(self):
+        return self.client.post(
+            reverse('store:create_payment'), {'order_id': str(self.order.id)},
+            content_type='application/json',
+        )
+
+    def test_failing_gateway_opens_the_circuit(self):
+        self.service.get_token()
+        self.gateway.error_rate = 1
+        with self.assertLogs('store.bkash_service', 'WARNING') as logs:
+            for _ in range(4):
+                self.assertFalse(self.create_payment().json()['success'])
+        self.assertIn('bKash circuit opened', logs.output[-1])
+        creates = self.gateway.calls['/tokenized/checkout/create']
+
+        response = self.create_payment()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(CircuitBreaker.OPEN_SECONDS))
+        self.assertIn('try again shortly', response.json()['message'])
+        self.assertEqual(self.gateway.calls['/tokenized/checkout/create'], creates)
+
+        response = self.client.get(reverse('store:payment_page', args=[self.order.id]))
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, 'try again shortly', status_code=503)
+        self.assertNotContains(response, 'id="bkash-payment-btn"', status_code=503)
+        self.assertEqual(metric_value('bkash_circuit_state', state='open'), 1)
+
+    def test_closed_circuit_renders_the_payment_button(self):
+        response = self.client.get(reverse('store:payment_page', args=[self.order.id]))
+        self.assertContains(response, 'id="bkash-payment-btn"')
+        self.assertEqual(metric_value('bkash_circuit_state', state='closed'), 1)
+
+
+class DownloadCountTests(TestCase):
+    def setUp(self):
+        product = make_product(drive_link='https://drive.example.com/book')
+        self.orders = [
+            Order.objects.create(
+                customer_name='Reader', email=f'reader{i}@example.com', phone='01700000000',
+                product=product, amount=250, status='paid',
+            )
+            for i in range(2)
+        ]
+        self.addCleanup(downloads.flush)
+
+    def download(self, order):
+        return self.client.get(reverse('store:download_ebook', args=[order.id]))
+
+    def test_each_download_is_written_atomically(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.download(self.orders[0])
+        self.assertRedirects(response, 'https://drive.example.com/book', fetch_redirect_response=False)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"downloads" = CASE', updates[0])  # an increment, not a full-row save
+        self.assertNotIn('"customer_name"', updates[0])
+        self.orders[0].refresh_from_db()
+        self.assertEqual(self.orders[0].downloads, 1)
+        self.assertEqual(DownloadEvent.objects.get().order_id, self.orders[0].id)
+
+    @override_settings(DOWNLOAD_FLUSH_INTERVAL=60, DOWNLOAD_BUFFER_SIZE=10)
+    def test_buffered_downloads_are_flushed_in_one_batch(self):
+        first, second = self.orders
+        for order in (first, second, first):
+            self.download(order)
+        self.assertFalse(DownloadEvent.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(downloads.flush(), 3)
+        writes = [q for q in queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len(writes), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.downloads, second.downloads), (2, 1))
+        self.assertEqual(DownloadEvent.objects.count(), 3)
+
+    @override_settings(DOWNLOAD_FLUSH_INTERVAL=60, DOWNLOAD_BUFFER_SIZE=2)
+    def test_full_buffer_flushes_at_once(self):
+        self.download(self.orders[0])
+        self.download(self.orders[0])
+        self.assertEqual(DownloadEvent.objects.count(), 2)
+        self.assertEqual(downloads.flush(), 0)
+
+    @override_settings(DOWNLOAD_FLUSH_INTERVAL=60, DOWNLOAD_BUFFER_SIZE=10)
+    def test_failed_flush_is_retried_by_the_timer(self):
+        buffer = downloads.DownloadBuffer()
+        buffer.add(self.orders[0].id)
+        with mock.patch.object(DownloadEvent, 'record', side_effect=DatabaseError('locked')):
+            with self.assertLogs('store.downloads', 'ERROR'):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertIsNotNone(buffer.timer)
+        self.assertEqual(buffer.flush(), 1)  # what the timer will do
+        self.assertIsNone(buffer.timer)
+        self.assertEqual(DownloadEvent.objects.count(), 1)
+
+    def test_unpaid_order_is_not_counted(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(status='pending')
+        self.assertEqual(self.download(self.orders[0]).status_code, 403)
+        self.assertFalse(DownloadEvent.objects.exists())
@@ -1,8 +1,15 @@
+from django.conf import settings
 from django.urls import path
 from .views import *
 
 app_name = 'store'
 
+# Under core.asgi the async payment views wait on bKash without tying up a thread
+if settings.ASYNC_PAYMENT_VIEWS:
+    create_payment_view, execute_payment_view = create_payment_async, execute_payment_async
+else:
+    create_payment_view, execute_payment_view = create_payment, execute_payment
+
 urlpatterns = [
     path('', HomePageView.as_view(), name='home'),
     path('product', ProductListView.as_view(), name='product_list'),
@@ -16,11 +23,12 @@ urlpatterns = [
 
     path('order/<str:ref_no>/', order_detail, name='order_detail'),
     path('search/', search, name='search'),
+    path('search/suggest/', search_suggest, name='search_suggest'),
     path('checkout/<int:product_id>/', checkout_page, name='checkout'),
     path('payment/<uuid:order_id>/', payment_page, name='payment_page'),
-    path('api/create-payment/', create_payment, name='create_payment'),
-    path('api/execute-payment/', execute_payment, name='execute_payment'),
+    path('api/create-payment/', create_payment_view, name='create_payment'),
+    path('api/execute-payment/', execute_payment_view, name='execute_payment'),
     path('download/<uuid:order_id>/', download_ebook, name='download_ebook'),
     path('payment/success/<uuid:order_id>/', payment_success, name='payment_success'),
-    path('payment/callback/', execute_payment, name='payment_callback'),
+    path('payment/callback/', execute_payment_view, name='payment_callback'),
 ]
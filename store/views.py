@@ -4,77 +4,101 @@ from django.utils.translation import gettext_lazy as _
 from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib import messages
-import random
-import string
-from django.db.models import Q, Count, Avg
-from django.http import JsonResponse, HttpResponse, FileResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, Http404
 from django.contrib.auth.decorators import login_required
 from .forms import ReviewForm
-from django.core.paginator import Paginator
+from .categories import get_category_or_404
+from .pagination import CursorPaginator
+from .search import search_products
+from .suggest import suggest
+from django.urls import reverse
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from urllib.parse import urlencode
 
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-from .bkash_service import BkashService
+from .bkash_service import GatewayUnavailable, get_async_bkash_service, get_bkash_service
+from . import downloads, payments
+import hashlib
 import json
 import logging
 
 
 
-from .models import Product, Category, Order, Review
+from .models import Product, Order, Review, StoreCounter, BestsellerRank
 from .forms import OrderForm
 
 logger = logging.getLogger(__name__)
 
-class HomePageView(ListView):
+class BestsellerWindowMixin:
+    """Read the bestseller ranking window from the ``window`` query parameter"""
+    
+    def get_bestseller_window(self):
+        window = self.request.GET.get('window')
+        if window in BestsellerRank.WINDOW_DAYS:
+            return window
+        return BestsellerRank.ALL_TIME
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['bestseller_window'] = self.get_bestseller_window()
+        context['bestseller_windows'] = BestsellerRank.WINDOW_CHOICES
+        return context
+
+class HomePageView(BestsellerWindowMixin, ListView):
     model = Product
     template_name = 'store/index.html'
     context_object_name = 'featured_products'
-    paginate_by = 4  # This ensures only 4 products are shown per page
     
     def get_queryset(self):
-        # Annotate each product with the count of orders
-        queryset = Product.objects.annotate(
-            sales_count=Count('order')
-        ).order_by('-sales_count')
-        
+        # Top 4 products from the precomputed bestseller ranking
+        category = None
         category_slug = self.kwargs.get('category_slug')
         if category_slug:
-            category = get_object_or_404(Category, slug=category_slug)
-            queryset = queryset.filter(category=category)
-
+            category = get_category_or_404(category_slug)
         
-        return queryset[:4]  # Return only top 4 products
+        return BestsellerRank.top_products(self.get_bestseller_window(), category, limit=4)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
         # Add statistics to context
-        context['total_ebooks'] = Product.objects.count()
+        counters = StoreCounter.snapshot()
+        context['total_ebooks'] = counters[StoreCounter.PRODUCTS]
         
-        # Count unique customers (assuming Order has a 'customer' field)
-        context['total_customers'] = Order.objects.values('email').distinct().count() + 234
+        # Count unique customers (distinct order emails)
+        context['total_customers'] = counters[StoreCounter.CUSTOMERS] + 234
         
         # Count total downloads (paid orders)
-        # Assuming 'is_paid' is a field in Order model and 'downloads' is a count
-        context['total_downloads'] = Order.objects.filter(status='paid').count() + 312
+        context['total_downloads'] = counters[StoreCounter.PAID_ORDERS] + 312
         return context
 
-class ProductListView(ListView):
+class ProductListView(BestsellerWindowMixin, ListView):
     model = Product
     template_name = 'store/product_list.html'
     context_object_name = 'products'
+    paginate_by = 12
+    category = None
     
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size)
+        page = paginator.get_page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().with_rating_stats()
         category_slug = self.kwargs.get('category_slug')
         if category_slug:
-            category = get_object_or_404(Category, slug=category_slug)
-            queryset = queryset.filter(category=category)
+            self.category = get_category_or_404(category_slug)
+            queryset = queryset.filter(category=self.category)
         return queryset
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
+        if self.category:
+            context['category'] = self.category
+            context['bestsellers'] = BestsellerRank.top_products(
+                self.get_bestseller_window(), self.category, limit=4
+            )
         return context
 
 class ProductDetailView(DetailView):
@@ -91,9 +115,8 @@ def product_detail(request, id, **slug):
     reviews = product.reviews.filter(status='approved')
     
     # Pagination for reviews
-    paginator = Paginator(reviews, 5)  # Show 5 reviews per page
-    page_number = request.GET.get('page')
-    page_reviews = paginator.get_page(page_number)
+    paginator = CursorPaginator(reviews, 5)  # Show 5 reviews per page
+    page_reviews = paginator.get_page(request.GET.get('cursor'))
     
     # Check if user has already reviewed this product
     user_has_reviewed = False
@@ -192,14 +215,38 @@ def delete_review(request, review_id):
     
     return render(request, 'store/review/delete.html', context)
 
+REVIEWS_PAGE_TIMEOUT = 60 * 60 * 24
+
 def get_reviews_ajax(request, product_id):
-    """Get reviews via AJAX for dynamic loading"""
-    product = get_object_or_404(Product, id=product_id)
-    page_number = request.GET.get('page', 1)
-    
-    reviews = product.reviews.filter(status='approved').select_related('user')
-    paginator = Paginator(reviews, 5)
-    page_reviews = paginator.get_page(page_number)
+    """Get reviews via AJAX for dynamic loading
+
+    Pages are serialized once per review version and served from the cache;
+    a matching ``If-None-Match`` gets a 304 without touching the database.
+    """
+    # Key on the decoded cursor so junk cursors all share the first page's entry
+    cursor = CursorPaginator.normalize_cursor(request.GET.get('cursor', ''))
+    version = Review.page_version(product_id)
+    if version is None:
+        raise Http404('No such product')
+    page_key = hashlib.md5(f'{product_id}:{version}:{cursor}'.encode()).hexdigest()
+    etag = f'"{page_key}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        cache_key = f'reviews_page:{page_key}'
+        content = cache.get(cache_key)
+        if content is None:
+            content = _serialize_reviews_page(product_id, cursor)
+            cache.set(cache_key, content, REVIEWS_PAGE_TIMEOUT)
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+def _serialize_reviews_page(product_id, cursor):
+    reviews = Review.objects.filter(product_id=product_id, status='approved')
+    paginator = CursorPaginator(reviews, 5)
+    page_reviews = paginator.get_page(cursor)
     
     reviews_data = []
     for review in page_reviews:
@@ -217,9 +264,9 @@ def get_reviews_ajax(request, product_id):
         'reviews': reviews_data,
         'has_next': page_reviews.has_next(),
         'has_previous': page_reviews.has_previous(),
-        'page_number': page_reviews.number,
-        'total_pages': paginator.num_pages,
-    })
+        'next_cursor': page_reviews.next_cursor,
+        'previous_cursor': page_reviews.previous_cursor,
+    }).content
 
 def order_detail(request, ref_no):
     order = get_object_or_404(Order, reference_no=ref_no)
@@ -229,23 +276,27 @@ def order_detail(request, ref_no):
 
 def search(request):
     query = request.GET.get('q', '').strip()
-
-    if query:
-        products = Product.objects.filter(
-            Q(title__icontains=query) | 
-            Q(author__icontains=query) |
-            Q(description__icontains=query)
-        ).distinct()
-    else:
-        products = Product.objects.none()
+    products = search_products(query)
     
     return render(request, 'store/search_results.html', {
         'products': products,
         'query': query,
-        'categories': Category.objects.all(),  # Include categories for sidebar
     })
 
-
+def search_suggest(request):
+    """Typeahead suggestions served from the in-process prefix index"""
+    query = request.GET.get('q', '').strip()
+    suggestions = []
+    for text, kind, product_id in suggest(query):
+        if kind == 'title':
+            url = reverse('store:product_detail', args=[product_id])
+        else:
+            url = f"{reverse('store:search')}?{urlencode({'q': text})}"
+        suggestions.append([text, kind, url])
+    
+    response = JsonResponse({'q': query, 'suggestions': suggestions})
+    patch_cache_control(response, public=True, max_age=60)
+    return response
 
 def checkout_page(request, product_id):
     product = get_object_or_404(Product, id=product_id)
@@ -267,20 +318,42 @@ def checkout_page(request, product_id):
     
     return render(request, 'store/checkout.html', {'product': product, 'form': OrderForm})
 
+GATEWAY_UNAVAILABLE_MESSAGE = _('bKash is not responding right now. Please try again shortly.')
+
+def gateway_unavailable(retry_after):
+    """Fast ``create_payment`` answer while the bKash circuit breaker is open"""
+    response = JsonResponse({
+        'success': False,
+        'message': str(GATEWAY_UNAVAILABLE_MESSAGE),
+        'retry_after': retry_after,
+    }, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
 def payment_page(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     
     if order.status == 'paid':
         return redirect('store:payment_success', order_id=order.id)
     
+    breaker = get_bkash_service().breaker
     context = {
         'order': order,
         'bkash_config': {
             'app_key': settings.BKASH_CONFIG['APP_KEY'],
             'is_sandbox': settings.BKASH_CONFIG['IS_SANDBOX']
-        }
+        },
+        'gateway_unavailable': breaker.is_open(),
     }
-    return render(request, 'store/payment.html', context)
+    if not context['gateway_unavailable']:
+        return render(request, 'store/payment.html', context)
+
+    # Still render the page: a customer coming back from bKash executes from it.
+    retry_after = breaker.retry_after()
+    context['gateway_message'] = GATEWAY_UNAVAILABLE_MESSAGE
+    response = render(request, 'store/payment.html', context, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
 
 @csrf_exempt
 def create_payment(request):
@@ -290,14 +363,14 @@ def create_payment(request):
             order_id = data.get('order_id')
             order = get_object_or_404(Order, id=order_id)
             
-            bkash_service = BkashService()
+            bkash_service = get_bkash_service()
             payment_response = bkash_service.create_payment(
                 amount=float(order.amount),
                 invoice_number=str(order.id)
             )
             if payment_response and payment_response.get('statusCode') == '0000':
                 order.bkash_payment_id = payment_response.get('paymentID')
-                order.save()
+                order.save(update_fields=['bkash_payment_id'])
                 
                 return JsonResponse({
                     'success': True,
@@ -310,6 +383,8 @@ def create_payment(request):
                     'message': 'Failed to create payment'
                 })
                 
+        except GatewayUnavailable as e:
+            return gateway_unavailable(e.retry_after)
         except Exception as e:
             logger.error(f"Payment creation error: {str(e)}")
             return JsonResponse({
@@ -323,29 +398,78 @@ def create_payment(request):
 def execute_payment(request):
     if request.method == 'GET':
         try:
-            payment_id = request.GET.get('paymentID')
-            
-            bkash_service = BkashService()
-            execute_response = bkash_service.execute_payment(payment_id)
-            
-            if execute_response and execute_response.get('statusCode') == '0000':
-                # Update order status
-                try:
-                    order = Order.objects.get(bkash_payment_id=payment_id)
-                    order.status = 'paid'
-                    order.trx_id = execute_response.get('trxID')
-                    order.save()
-                    
-                    # Send email with download link
-                    # send_ebook_email(order)
-                    return redirect('store:payment_success', order_id=order.id)
-
-                except Order.DoesNotExist:
-                    return redirect('store:payment_failed', message= 'Order not found')
+            payment_id = request.GET.get('paymentID', '').strip()
+            if not payment_id:
+                return HttpResponseBadRequest('Missing paymentID')
+            result = payments.execute(payment_id, get_bkash_service().execute_payment)
+            if result.error:
+                return redirect('store:payment_failed', message=result.error)
+
+            # Send email with download link
+            # send_ebook_email(order)
+            return redirect('store:payment_success', order_id=result.order_id)
+
+        except Exception as e:
+            logger.error(f"Payment execution error: {str(e)}")
+            return JsonResponse({
+                'success': False,
+                'message': 'An error occurred'
+            })
+    
+    return JsonResponse({'success': False, 'message': 'Invalid request'})
 
+async def create_payment_async(request):
+    """``create_payment`` for ASGI: waiting on bKash holds no worker thread"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            order_id = data.get('order_id')
+            order = await Order.objects.aget(id=order_id)
+            
+            payment_response = await get_async_bkash_service().create_payment(
+                amount=float(order.amount),
+                invoice_number=str(order.id)
+            )
+            if payment_response and payment_response.get('statusCode') == '0000':
+                order.bkash_payment_id = payment_response.get('paymentID')
+                await order.asave(update_fields=['bkash_payment_id'])
+                
+                return JsonResponse({
+                    'success': True,
+                    'payment_id': payment_response.get('paymentID'),
+                    'bkash_url': payment_response.get('bkashURL'), 
+                })
             else:
-                return redirect('store:payment_failed', message= 'Payment execution failed')
+                return JsonResponse({
+                    'success': False,
+                    'message': 'Failed to create payment'
+                })
                 
+        except GatewayUnavailable as e:
+            return gateway_unavailable(e.retry_after)
+        except Exception as e:
+            logger.error(f"Payment creation error: {str(e)}")
+            return JsonResponse({
+                'success': False,
+                'message': 'An error occurred'
+            })
+    
+    return JsonResponse({'success': False, 'message': 'Invalid request'})
+
+async def execute_payment_async(request):
+    """``execute_payment`` for ASGI: waiting on bKash holds no worker thread"""
+    if request.method == 'GET':
+        try:
+            payment_id = request.GET.get('paymentID', '').strip()
+            if not payment_id:
+                return HttpResponseBadRequest('Missing paymentID')
+            result = await payments.aexecute(
+                payment_id, get_async_bkash_service().execute_payment,
+            )
+            if result.error:
+                return redirect('store:payment_failed', message=result.error)
+            return redirect('store:payment_success', order_id=result.order_id)
+
         except Exception as e:
             logger.error(f"Payment execution error: {str(e)}")
             return JsonResponse({
@@ -355,6 +479,11 @@ def execute_payment(request):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
+# On Django 4.2 @csrf_exempt wraps a coroutine function in a sync one, which
+# would hand the handler an un-awaited coroutine; mark the views instead.
+create_payment_async.csrf_exempt = True
+execute_payment_async.csrf_exempt = True
+
 def send_ebook_email(order):
     try:
         subject = f'Your eBook Purchase: {order.product.title}'
@@ -385,15 +514,14 @@ def send_ebook_email(order):
         logger.error(f"Email sending error: {str(e)}")
 
 def download_ebook(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('product'), id=order_id)
     
     if order.status != 'paid':
         return HttpResponse('Payment not confirmed', status=403)
     
     # Serve the file
     if order.product.drive_link:
-        order.downloads += 1
-        order.save()
+        downloads.record_download(order.pk)
         return redirect(order.product.drive_link)
     
     return HttpResponse('File not found. Please contact with AiShikkha', status=404)
@@ -404,15 +532,3 @@ def payment_success(request, order_id):
 
 def payment_failed(request, message):
     return render(request, 'store/payment_failed.html', {'message': message})
-
-@csrf_exempt
-def payment_callback(request):
-    # Handle bKash callback (optional)
-    payment_id = request.GET.get('paymentID')
-            
-    bkash_service = BkashService()
-    execute_response = bkash_service.execute_payment(payment_id)
-    if request.method == "POST":
-        # Process callback data
-        pass
-    return HttpResponse('OK')